@@ -9,14 +9,30 @@ class Settings:
     BQ_TABLE_FITBIT: str = os.getenv("BQ_TABLE_FITBIT", "fitbit_daily")
     BQ_TABLE_MONTHLY: str = os.getenv("BQ_TABLE_MONTHLY", "monthly_reports")
     BQ_TABLE_PROFILES: str = os.getenv("BQ_TABLE_PROFILES", "profiles")
+    BQ_TABLE_DAILY_ROLLUP: str = os.getenv("BQ_TABLE_DAILY_ROLLUP", "daily_rollup")
+    BQ_TABLE_MONTHLY_ROLLUP: str = os.getenv("BQ_TABLE_MONTHLY_ROLLUP", "monthly_rollup")
+    BQ_RAW_PARTITION_EXPIRATION_DAYS: int = int(os.getenv("BQ_RAW_PARTITION_EXPIRATION_DAYS", "0"))  # 0=無期限
+    BQ_SCHEMA_ENSURE_ON_STARTUP: bool = os.getenv("BQ_SCHEMA_ENSURE_ON_STARTUP", "1") == "1"
     BQ_LOCATION: str = os.getenv("HP_BQ_LOCATION", "asia-northeast1")
+    # 送信済み行のプロセス内フィルタ（同じキー・同じ内容の行は再送しない）
+    BQ_SEEN_MAX_KEYS: int = int(os.getenv("BQ_SEEN_MAX_KEYS", "100000"))
+    BQ_SEEN_TTL_SEC: float = float(os.getenv("BQ_SEEN_TTL_SEC", "86400"))
     
     # Health Planet
+    # 旧形式（タグごとの縦持ち＋raw）。新規行は HP_BQ_TABLE_BODY（測定ごとのワイド行）に書く
     HP_BQ_TABLE: str = os.getenv("HP_BQ_TABLE", "peak-empire-396108.health_raw.healthplanet_innerscan")
+    HP_BQ_TABLE_BODY: str = os.getenv("HP_BQ_TABLE_BODY", "healthplanet_body")
+    # 旧テーブルも分析で読む（scripts/bq_migrate.py --hp-wide で移行し終えたら 0 にする）
+    HP_LEGACY_READ: bool = os.getenv("HP_LEGACY_READ", "1") == "1"
+    HP_INNERSCAN_TAGS: str = os.getenv("HP_INNERSCAN_TAGS", "6021,6022,6023,6024,6025,6026,6027,6028,6029")
     HEALTHPLANET_CLIENT_ID: Optional[str] = os.getenv("HEALTHPLANET_CLIENT_ID")
     HEALTHPLANET_CLIENT_SECRET: Optional[str] = os.getenv("HEALTHPLANET_CLIENT_SECRET")
     HEALTHPLANET_SCOPE: str = os.getenv("HEALTHPLANET_SCOPE", "innerscan")
     HP_REDIRECT_URI: str = "https://www.healthplanet.jp/success.html"
+    # Health Planet 履歴インポート（innerscan.json は1リクエストあたり3か月まで）
+    HP_IMPORT_DAYS: int = int(os.getenv("HP_IMPORT_DAYS", str(365 * 5)))
+    HP_IMPORT_WINDOW_DAYS: int = int(os.getenv("HP_IMPORT_WINDOW_DAYS", "89"))
+    HP_IMPORT_CONCURRENCY: int = int(os.getenv("HP_IMPORT_CONCURRENCY", "4"))
     
     # LINE
     LINE_ACCESS_TOKEN: Optional[str] = os.getenv("LINE_ACCESS_TOKEN")
@@ -25,14 +41,77 @@ class Settings:
     # OpenAI - デフォルトをgpt-4oに変更（Chat Completions APIで確実に動作する）
     OPENAI_API_KEY: Optional[str] = os.getenv("OPENAI_API_KEY")
     OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o")
+    OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+    OPENAI_CACHE_ENABLED: bool = os.getenv("OPENAI_CACHE_ENABLED", "1") == "1"
+    OPENAI_CACHE_TTL_SEC: int = int(os.getenv("OPENAI_CACHE_TTL_SEC", "86400"))
+    OPENAI_CACHE_MAX_ENTRIES: int = int(os.getenv("OPENAI_CACHE_MAX_ENTRIES", "256"))
+    
+    # 食事画像（Vision 前処理）
+    MEAL_IMAGE_MAX_BYTES: int = int(os.getenv("MEAL_IMAGE_MAX_BYTES", str(15 * 1024 * 1024)))
+    VISION_DETAIL: str = os.getenv("VISION_DETAIL", "auto")  # auto | low | high
+    VISION_MAX_LONG_SIDE: int = int(os.getenv("VISION_MAX_LONG_SIDE", "2048"))
+    VISION_MAX_SHORT_SIDE: int = int(os.getenv("VISION_MAX_SHORT_SIDE", "768"))
+    VISION_LOW_DETAIL_MAX_SIDE: int = int(os.getenv("VISION_LOW_DETAIL_MAX_SIDE", "512"))
+    VISION_IMAGE_FORMAT: str = os.getenv("VISION_IMAGE_FORMAT", "JPEG")  # JPEG | WEBP
+    VISION_IMAGE_QUALITY: int = int(os.getenv("VISION_IMAGE_QUALITY", "85"))
+    MEAL_DEDUPE_ENABLED: bool = os.getenv("MEAL_DEDUPE_ENABLED", "1") == "1"
+    MEAL_DEDUPE_MAX_DISTANCE: int = int(os.getenv("MEAL_DEDUPE_MAX_DISTANCE", "6"))  # dHash 64bit のハミング距離
+    MEAL_DEDUPE_LOOKBACK: int = int(os.getenv("MEAL_DEDUPE_LOOKBACK", "50"))
+    
+    # 分析
+    SLEEP_TARGET_MIN: int = int(os.getenv("SLEEP_TARGET_MIN", "420"))
+    ANALYTICS_PROMPT_DAYS: int = int(os.getenv("ANALYTICS_PROMPT_DAYS", "90"))
     
     # Fitbit
     FITBIT_CLIENT_ID: Optional[str] = os.getenv("FITBIT_CLIENT_ID")
     FITBIT_CLIENT_SECRET: Optional[str] = os.getenv("FITBIT_CLIENT_SECRET")
     FITBIT_SCOPE: str = "activity heartrate sleep oxygen_saturation profile"
+    FITBIT_SUBSCRIBER_VERIFY_CODE: Optional[str] = os.getenv("FITBIT_SUBSCRIBER_VERIFY_CODE")
+    FITBIT_SUBSCRIBER_ID: Optional[str] = os.getenv("FITBIT_SUBSCRIBER_ID")
+    FITBIT_WEBHOOK_WORKERS: int = int(os.getenv("FITBIT_WEBHOOK_WORKERS", "2"))
+    FITBIT_WEBHOOK_DEDUPE_SEC: float = float(os.getenv("FITBIT_WEBHOOK_DEDUPE_SEC", "60"))
+    FITBIT_WEBHOOK_MAX_RETRIES: int = int(os.getenv("FITBIT_WEBHOOK_MAX_RETRIES", "3"))
+    FITBIT_OPEN_DAYS: int = int(os.getenv("FITBIT_OPEN_DAYS", "2"))
+    FITBIT_MAX_CONCURRENCY: int = int(os.getenv("FITBIT_MAX_CONCURRENCY", "4"))
+    FITBIT_RATE_LIMIT_PER_HOUR: int = int(os.getenv("FITBIT_RATE_LIMIT_PER_HOUR", "150"))
+    FITBIT_RATE_LOW_PRIORITY_RESERVE: int = int(os.getenv("FITBIT_RATE_LOW_PRIORITY_RESERVE", "30"))
+    FITBIT_RATE_MAX_WAIT: float = float(os.getenv("FITBIT_RATE_MAX_WAIT", "10"))
+    FITBIT_RATE_LOW_PRIORITY_MAX_WAIT: float = float(os.getenv("FITBIT_RATE_LOW_PRIORITY_MAX_WAIT", "120"))
+    FITBIT_BACKFILL_DAYS: int = int(os.getenv("FITBIT_BACKFILL_DAYS", "365"))
+    FITBIT_BACKFILL_CHUNK_DAYS: int = int(os.getenv("FITBIT_BACKFILL_CHUNK_DAYS", "300"))
+    FITBIT_BACKFILL_RUN_SEC: float = float(os.getenv("FITBIT_BACKFILL_RUN_SEC", "90"))
     
     # App
     RUN_BASE_URL: Optional[str] = os.getenv("RUN_BASE_URL")
     UI_API_TOKEN: str = os.getenv("UI_API_TOKEN", "")
+    
+    # Firestore（同期クライアント用の専用スレッド数）
+    FIRESTORE_MAX_WORKERS: int = int(os.getenv("FIRESTORE_MAX_WORKERS", "32"))
+    
+    # BigQuery アウトボックス（書き込み遅延キュー）
+    OUTBOX_POLL_SEC: float = float(os.getenv("OUTBOX_POLL_SEC", "5"))
+    OUTBOX_BATCH_SIZE: int = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+    OUTBOX_MAX_BACKOFF_SEC: float = float(os.getenv("OUTBOX_MAX_BACKOFF_SEC", "3600"))
+    OUTBOX_LEASE_SEC: float = float(os.getenv("OUTBOX_LEASE_SEC", "300"))
+    
+    # OAuth トークンキャッシュ
+    TOKEN_CACHE_SKEW_SEC: int = int(os.getenv("TOKEN_CACHE_SKEW_SEC", "120"))
+    TOKEN_CACHE_DEFAULT_TTL_SEC: int = int(os.getenv("TOKEN_CACHE_DEFAULT_TTL_SEC", "600"))
+    
+    # Cron バッチ
+    CRON_CONCURRENCY: int = int(os.getenv("CRON_CONCURRENCY", "16"))
+    CRON_USER_TIMEOUT_SEC: float = float(os.getenv("CRON_USER_TIMEOUT_SEC", "120"))
+    CRON_DEADLINE_SEC: float = float(os.getenv("CRON_DEADLINE_SEC", "1500"))
+    BATCH_DELIVERY_LEASE_SEC: float = float(os.getenv("BATCH_DELIVERY_LEASE_SEC", "900"))
+    
+    # HTTP クライアント（上流APIごとのコネクションプール）
+    HTTP2_ENABLED: bool = os.getenv("HTTP2_ENABLED", "0") == "1"
+    HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+    FITBIT_HTTP_TIMEOUT: float = float(os.getenv("FITBIT_HTTP_TIMEOUT", "30"))
+    FITBIT_HTTP_MAX_CONNECTIONS: int = int(os.getenv("FITBIT_HTTP_MAX_CONNECTIONS", "20"))
+    HEALTHPLANET_HTTP_TIMEOUT: float = float(os.getenv("HEALTHPLANET_HTTP_TIMEOUT", "30"))
+    HEALTHPLANET_HTTP_MAX_CONNECTIONS: int = int(os.getenv("HEALTHPLANET_HTTP_MAX_CONNECTIONS", "10"))
+    OPENAI_HTTP_TIMEOUT: float = float(os.getenv("OPENAI_HTTP_TIMEOUT", "60"))
+    OPENAI_HTTP_MAX_CONNECTIONS: int = int(os.getenv("OPENAI_HTTP_MAX_CONNECTIONS", "20"))
 
 settings = Settings()
@@ -1,8 +1,14 @@
 # Database connection modules
-from .firestore import db, user_doc, get_latest_profile, fitbit_token_doc, healthplanet_token_doc
+from .firestore import (
+    db, user_doc, get_latest_profile, fitbit_token_doc, healthplanet_token_doc, list_user_ids, get_line_user_id,
+    fs_run, fs_get, fs_set, fs_stream,
+)
 from .bigquery import bq_client, bq_insert_rows, bq_upsert_profile
+from .rollup import bq_refresh_rollups, bq_read_monthly_rollup
 
 __all__ = [
     "db", "user_doc", "get_latest_profile", "fitbit_token_doc", "healthplanet_token_doc",
-    "bq_client", "bq_insert_rows", "bq_upsert_profile"
+    "list_user_ids", "get_line_user_id", "fs_run", "fs_get", "fs_set", "fs_stream",
+    "bq_client", "bq_insert_rows", "bq_upsert_profile",
+    "bq_refresh_rollups", "bq_read_monthly_rollup"
 ]
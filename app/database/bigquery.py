@@ -1,7 +1,16 @@
 from google.cloud import bigquery
-from datetime import datetime, timezone
+from datetime import datetime, date, timezone
 from typing import List, Dict, Any
 from app.config import settings
+from app.models.fitbit import FitbitDay
+
+# fitbit_daily の数値カラム（FitbitDay のフィールドと同名）
+_FITBIT_BQ_COLUMNS = (
+    ("steps_total", "INT64"), ("calories_total", "INT64"),
+    ("sleep_minutes", "INT64"), ("sleep_deep_min", "INT64"), ("sleep_rem_min", "INT64"),
+    ("sleep_light_min", "INT64"), ("sleep_wake_min", "INT64"),
+    ("spo2_avg", "FLOAT64"), ("spo2_min", "FLOAT64"), ("spo2_max", "FLOAT64"),
+)
 
 bq_client = bigquery.Client(project=settings.BQ_PROJECT_ID) if settings.BQ_PROJECT_ID else None
 
@@ -179,55 +188,60 @@ def bq_upsert_profile(user_id: str = "demo") -> Dict[str, Any]:
             }
 
 def bq_upsert_fitbit_days(user_id: str, days: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """Fitbit日次データをBigQueryに保存（日付パーティションごとに上書き）"""
+    """Fitbit日次データをBigQueryに保存（(user_id, date) をキーに1回のMERGEで上書き）"""
     if not bq_client or not days:
         return {"ok": False, "reason": "bq disabled or empty"}
 
-    def to_int(x):
-        try:
-            return int(float(x))
-        except Exception:
-            return 0
-
-    jobs = []
+    # 同一日付が複数あれば後勝ち（MERGEのソース重複を避ける）
+    by_date: Dict[str, FitbitDay] = {}
     for d in days:
-        if not d.get("date"):
-            continue
-        date_str = d["date"]                 # "YYYY-MM-DD"
-        part = date_str.replace("-", "")     # "YYYYMMDD"
-        table_id = f"{settings.BQ_PROJECT_ID}.{settings.BQ_DATASET}.{settings.BQ_TABLE_FITBIT}${part}"
-
-        row = {
-            "user_id": user_id,
-            "date": date_str,
-            "steps_total": to_int(d.get("steps_total", 0)),
-            "sleep_line": d.get("sleep_line", ""),
-            "spo2_line": d.get("spo2_line", ""),
-            "calories_total": to_int(d.get("calories_total", 0)),
-            "ingested_at": datetime.now(timezone.utc).isoformat(),
-        }
+        if d.get("date"):
+            by_date[d["date"]] = FitbitDay.from_dict(d)
+    if not by_date:
+        return {"ok": False, "reason": "bq disabled or empty"}
 
-        job_config = bigquery.LoadJobConfig(
-            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
-            schema=[
-                bigquery.SchemaField("user_id", "STRING"),
-                bigquery.SchemaField("date", "DATE"),
-                bigquery.SchemaField("steps_total", "INTEGER"),
-                bigquery.SchemaField("sleep_line", "STRING"),
-                bigquery.SchemaField("spo2_line", "STRING"),
-                bigquery.SchemaField("calories_total", "INTEGER"),
-                bigquery.SchemaField("ingested_at", "TIMESTAMP"),
-            ],
+    structs = [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter("date", "DATE", date.fromisoformat(date_str)),
+            *[bigquery.ScalarQueryParameter(name, bq_type, getattr(d, name)) for name, bq_type in _FITBIT_BQ_COLUMNS],
         )
+        for date_str, d in sorted(by_date.items())
+    ]
 
-        job = bq_client.load_table_from_json([row], table_id, job_config=job_config)
-        jobs.append(job)
+    cols = [name for name, _ in _FITBIT_BQ_COLUMNS]
+    table_id = f"{settings.BQ_PROJECT_ID}.{settings.BQ_DATASET}.{settings.BQ_TABLE_FITBIT}"
+    # 全日分をクエリパラメータの配列で渡し、ジョブ1本（ロードジョブ枠を消費しない）で反映
+    merge_query = f"""
+    MERGE `{table_id}` T
+    USING (SELECT @user_id AS user_id, r.* FROM UNNEST(@rows) AS r) S
+    ON T.user_id = S.user_id AND T.date = S.date
+    WHEN MATCHED THEN
+        UPDATE SET
+            {", ".join(f"{c} = S.{c}" for c in cols)},
+            ingested_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+        INSERT (user_id, date, {", ".join(cols)}, ingested_at)
+        VALUES (S.user_id, S.date, {", ".join(f"S.{c}" for c in cols)}, CURRENT_TIMESTAMP())
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("user_id", "STRING", user_id),
+            bigquery.ArrayQueryParameter("rows", "STRUCT", structs),
+        ]
+    )
 
-    errors = []
-    for j in jobs:
-        j.result()
-        if j.errors:
-            errors.extend(j.errors)
+    try:
+        job = bq_client.query(merge_query, job_config=job_config)
+        job.result()
+    except Exception as e:
+        print(f"[ERROR] bq_upsert_fitbit_days MERGE failed: {e}")
+        return {"ok": False, "errors": [str(e)], "count": len(structs), "method": "merge"}
 
-    return {"ok": not bool(errors), "errors": errors, "count": len(jobs)}
+    return {
+        "ok": True,
+        "errors": [],
+        "count": len(structs),
+        "method": "merge",
+        "rows_affected": job.num_dml_affected_rows,
+    }
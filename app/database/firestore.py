@@ -1,8 +1,36 @@
 from google.cloud import firestore
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
+from app.config import settings
+from app.utils.async_utils import run_in_executor
 
 db = firestore.Client()
 
+# 同期クライアントのI/Oをイベントループ外で実行する専用スレッドプール
+FIRESTORE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings.FIRESTORE_MAX_WORKERS, thread_name_prefix="firestore"
+)
+
+async def fs_run(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Firestoreを触る同期関数を専用 executor で実行（async ハンドラから使う）"""
+    return await run_in_executor(FIRESTORE_EXECUTOR, fn, *args, **kwargs)
+
+async def fs_get(ref) -> Any:
+    """ドキュメント参照の get() を非同期で実行"""
+    return await fs_run(ref.get)
+
+async def fs_set(ref, data: Dict[str, Any], merge: bool = False) -> Any:
+    """ドキュメント参照の set() を非同期で実行"""
+    return await fs_run(ref.set, data, merge=merge)
+
+async def fs_stream(query) -> List[Any]:
+    """クエリの stream() を非同期で実行し、スナップショットのリストを返す"""
+    return await fs_run(lambda: list(query.stream()))
+
+def shutdown_firestore_executor() -> None:
+    """Firestore executor を停止（シャットダウン時）"""
+    FIRESTORE_EXECUTOR.shutdown(wait=True, cancel_futures=True)
+
 def user_doc(user_id: str = "demo"):
     """ユーザードキュメントの参照を返す"""
     return db.collection("users").document(user_id)
@@ -19,3 +47,17 @@ def fitbit_token_doc(user_id: str = "demo"):
 def healthplanet_token_doc(user_id: str = "demo"):
     """Health Planetトークンドキュメントの参照を返す"""
     return user_doc(user_id).collection("private").document("healthplanet_oauth")
+
+def list_user_ids() -> List[str]:
+    """usersコレクション配下の全ユーザーIDを返す（サブコレクションのみのドキュメントも含む）"""
+    return [ref.id for ref in db.collection("users").list_documents()]
+
+def get_line_user_id(user_id: str = "demo") -> Optional[str]:
+    """ユーザーのLINE送信先を返す（既定の LINE_USER_ID に落とすのは demo ユーザーだけ。他は未設定なら None）"""
+    snap = user_doc(user_id).get()
+    if snap.exists:
+        line_id = (snap.to_dict() or {}).get("line_user_id")
+        if line_id:
+            return line_id
+    # 他人の健康データを既定の送信先へ流さない
+    return settings.LINE_USER_ID if user_id == "demo" else None
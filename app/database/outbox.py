@@ -0,0 +1,343 @@
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
+from google.api_core.exceptions import FailedPrecondition, NotFound
+from app.config import settings
+from app.database.firestore import db, fs_run
+from app.database.bigquery import bq_client, bq_upsert_fitbit_days, bq_upsert_profile
+from app.database.rollup import bq_refresh_rollups
+
+# BigQuery ミラー書き込みの永続キュー（Firestore コレクション）
+OUTBOX_COLLECTION = "bq_outbox"
+
+# 直近のドレイン結果（所要時間・反映遅延。/debug/outbox 用）
+_last_drain: Dict[str, Any] = {}
+
+def outbox_ref(key: str):
+    """アウトボックス項目の参照（キーが同じなら上書き＝冪等）"""
+    return db.collection(OUTBOX_COLLECTION).document(key)
+
+def outbox_item(op: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """アウトボックス項目のドキュメントを生成"""
+    now = time.time()
+    return {
+        "op": op,
+        "payload": payload,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+def commit_with_outbox(
+    writes: List[Tuple[Any, Dict[str, Any], bool]],
+    items: List[Tuple[str, str, Dict[str, Any]]],
+) -> None:
+    """
+    一次書き込みとアウトボックス項目を1つの WriteBatch でアトミックにコミット
+
+    writes: [(doc_ref, data, merge), ...]
+    items:  [(key, op, payload), ...]  BigQuery無効時は積まない
+    """
+    batch = db.batch()
+    for ref, data, merge in writes:
+        batch.set(ref, data, merge=merge)
+    if bq_client:
+        for key, op, payload in items:
+            batch.set(outbox_ref(key), outbox_item(op, payload))
+    batch.commit()
+
+def outbox_result(**extra: Any) -> Dict[str, Any]:
+    """commit_with_outbox で BigQuery 反映を積んだかどうか（BigQuery無効時は積まれない）"""
+    if not bq_client:
+        return {"ok": False, "reason": "BigQuery not configured"}
+    return {"ok": True, "queued": "outbox", **extra}
+
+def _enqueue_rollups(touched: Dict[str, set]) -> None:
+    """元テーブル反映に成功した (user_id, date) の集計更新を後続項目として積む"""
+    if not touched:
+        return
+    batch = db.batch()
+    for user_id, dates in touched.items():
+        ds = sorted(dates)
+        digest = hashlib.sha1(",".join(ds).encode()).hexdigest()[:12]
+        batch.set(outbox_ref(f"rollup-{user_id}-{digest}-{int(time.time() * 1000)}"),
+                  outbox_item("rollup_refresh", {"user_id": user_id, "dates": ds}))
+    batch.commit()
+
+def _backoff(attempts: int) -> float:
+    return float(min(settings.OUTBOX_MAX_BACKOFF_SEC, 5 * (2 ** min(attempts, 12))))
+
+def _apply_insert_rows(snaps: List[Any]) -> Dict[str, Optional[str]]:
+    """insert_rows 項目をテーブルごとにまとめ、insertId 付きで一括挿入"""
+    results: Dict[str, Optional[str]] = {}
+    by_table: Dict[str, List[Tuple[str, Dict[str, Any], str]]] = {}
+    for snap in snaps:
+        p = snap.to_dict()["payload"]
+        for i, row in enumerate(p.get("rows", [])):
+            row_id = (p.get("row_ids") or [])[i] if i < len(p.get("row_ids") or []) else f"{snap.id}-{i}"
+            by_table.setdefault(p["table"], []).append((snap.id, row, row_id))
+        results[snap.id] = None
+
+    for table, entries in by_table.items():
+        table_id = f"{settings.BQ_PROJECT_ID}.{settings.BQ_DATASET}.{table}"
+        for start in range(0, len(entries), 500):
+            chunk = entries[start:start + 500]
+            try:
+                errors = bq_client.insert_rows_json(
+                    table_id,
+                    [row for _, row, _ in chunk],
+                    row_ids=[rid for _, _, rid in chunk],
+                    ignore_unknown_values=True,
+                )
+                for e in errors or []:
+                    results[chunk[e["index"]][0]] = str(e.get("errors"))[:500]
+            except Exception as e:
+                for key, _, _ in chunk:
+                    results[key] = repr(e)[:500]
+
+    # 食事が入った日は日次/月次集計を更新
+    touched: Dict[str, set] = {}
+    for key, row, _ in by_table.get(settings.BQ_TABLE_MEALS, []):
+        if results.get(key) is None and row.get("user_id") and row.get("when_date"):
+            touched.setdefault(row["user_id"], set()).add(row["when_date"])
+    _enqueue_rollups(touched)
+    return results
+
+def _apply_fitbit_days(snaps: List[Any]) -> Dict[str, Optional[str]]:
+    """fitbit_days_upsert 項目をユーザーごとにまとめて1回のMERGEで反映"""
+    results: Dict[str, Optional[str]] = {}
+    touched: Dict[str, set] = {}
+    by_user: Dict[str, List[Any]] = {}
+    for snap in snaps:
+        by_user.setdefault(snap.to_dict()["payload"]["user_id"], []).append(snap)
+    for user_id, user_snaps in by_user.items():
+        days: Dict[str, Dict[str, Any]] = {}
+        for snap in sorted(user_snaps, key=lambda s: s.to_dict().get("created_at", "")):
+            for d in snap.to_dict()["payload"].get("days", []):
+                days[d["date"]] = d
+        try:
+            res = bq_upsert_fitbit_days(user_id, list(days.values()))
+            err = None if res.get("ok") else str(res.get("errors") or res.get("reason"))[:500]
+        except Exception as e:
+            err = repr(e)[:500]
+        if err is None:
+            touched[user_id] = set(days)
+        for snap in user_snaps:
+            results[snap.id] = err
+    _enqueue_rollups(touched)
+    return results
+
+def _apply_rollups(snaps: List[Any]) -> Dict[str, Optional[str]]:
+    """rollup_refresh 項目をユーザーごとに日付をまとめて1回のスクリプトで反映"""
+    results: Dict[str, Optional[str]] = {}
+    by_user: Dict[str, List[Any]] = {}
+    for snap in snaps:
+        by_user.setdefault(snap.to_dict()["payload"]["user_id"], []).append(snap)
+    for user_id, user_snaps in by_user.items():
+        dates = sorted({d for s in user_snaps for d in s.to_dict()["payload"].get("dates", [])})
+        try:
+            res = bq_refresh_rollups(user_id, dates)
+            err = None if res.get("ok") else str(res.get("errors") or res.get("reason"))[:500]
+        except Exception as e:
+            err = repr(e)[:500]
+        for snap in user_snaps:
+            results[snap.id] = err
+    return results
+
+def _apply_profiles(snaps: List[Any]) -> Dict[str, Optional[str]]:
+    """profile_upsert 項目をユーザーごとに1回だけ反映（最新プロフィールを読む）"""
+    results: Dict[str, Optional[str]] = {}
+    by_user: Dict[str, List[Any]] = {}
+    for snap in snaps:
+        by_user.setdefault(snap.to_dict()["payload"]["user_id"], []).append(snap)
+    for user_id, user_snaps in by_user.items():
+        try:
+            res = bq_upsert_profile(user_id)
+            err = None if res.get("ok") else str(res)[:500]
+        except Exception as e:
+            err = repr(e)[:500]
+        for snap in user_snaps:
+            results[snap.id] = err
+    return results
+
+_HANDLERS = {
+    "insert_rows": _apply_insert_rows,
+    "fitbit_days_upsert": _apply_fitbit_days,
+    "profile_upsert": _apply_profiles,
+    "rollup_refresh": _apply_rollups,
+}
+
+def _claim(snaps: List[Any], now: float) -> List[Tuple[Any, Any]]:
+    """
+    取り出した項目にリースを掛ける（読んだ時点から更新されていない場合だけ next_attempt_at を先送り）
+
+    他インスタンスが先に取った項目や、取り出し後に上書きされた項目は外す。
+    戻り値は (snap, リース後の update_time)。
+    """
+    claimed = []
+    for snap in snaps:
+        try:
+            res = snap.reference.update(
+                {"next_attempt_at": now + settings.OUTBOX_LEASE_SEC},
+                option=db.write_option(last_update_time=snap.update_time),
+            )
+            claimed.append((snap, res.update_time))
+        except (FailedPrecondition, NotFound):
+            continue
+    return claimed
+
+def _finish(snap: Any, leased_at: Any, err: Optional[str]) -> str:
+    """成功は削除、失敗はバックオフ。リース後に上書きされていれば触らない（新しい内容を次回反映）"""
+    option = db.write_option(last_update_time=leased_at)
+    try:
+        if err is None:
+            snap.reference.delete(option=option)
+            return "done"
+        attempts = int(snap.to_dict().get("attempts", 0)) + 1
+        snap.reference.update({
+            "attempts": attempts,
+            "next_attempt_at": time.time() + _backoff(attempts),
+            "last_error": err,
+        }, option=option)
+        print(f"[WARN] outbox {snap.id} failed (attempt {attempts}): {err}")
+        return "failed"
+    except (FailedPrecondition, NotFound):
+        return "superseded"
+
+def _age_sec(created_at: Optional[str], now: float) -> Optional[float]:
+    """created_at（ISO8601）からの経過秒"""
+    if not created_at:
+        return None
+    try:
+        return round(now - datetime.fromisoformat(created_at).timestamp(), 1)
+    except ValueError:
+        return None
+
+def _record_drain(t0: float, res: Dict[str, Any], latencies: List[float]) -> Dict[str, Any]:
+    """ドレイン1回分の所要時間と、反映できた項目の積んでからの遅延を記録"""
+    _last_drain.clear()
+    _last_drain.update({
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "duration_ms": round((time.perf_counter() - t0) * 1000, 1),
+        "processed": res.get("processed", 0),
+        "done": res.get("done", 0),
+        "max_latency_sec": max(latencies) if latencies else None,
+        "avg_latency_sec": round(sum(latencies) / len(latencies), 1) if latencies else None,
+    })
+    return res
+
+def drain_outbox_once(limit: Optional[int] = None) -> Dict[str, Any]:
+    """期限が来た項目にリースを掛けてBigQueryへ反映。成功は削除、失敗はバックオフして再試行"""
+    if not bq_client:
+        return {"ok": False, "reason": "bq disabled"}
+
+    t0 = time.perf_counter()
+    now = time.time()
+    q = (db.collection(OUTBOX_COLLECTION)
+         .where("next_attempt_at", "<=", now)
+         .order_by("next_attempt_at")
+         .limit(limit or settings.OUTBOX_BATCH_SIZE))
+    fetched = list(q.stream())
+    if not fetched:
+        return _record_drain(t0, {"ok": True, "processed": 0}, [])
+
+    claimed = _claim(fetched, now)
+    snaps = [snap for snap, _ in claimed]
+
+    by_op: Dict[str, List[Any]] = {}
+    for snap in snaps:
+        by_op.setdefault(snap.to_dict().get("op"), []).append(snap)
+
+    results: Dict[str, Optional[str]] = {}
+    for op, op_snaps in by_op.items():
+        handler = _HANDLERS.get(op)
+        if handler is None:
+            results.update({s.id: f"unknown op: {op}" for s in op_snaps})
+            continue
+        results.update(handler(op_snaps))
+
+    counts = {"done": 0, "failed": 0, "superseded": 0}
+    latencies: List[float] = []
+    done_at = time.time()
+    for snap, leased_at in claimed:
+        outcome = _finish(snap, leased_at, results.get(snap.id))
+        counts[outcome] += 1
+        if outcome == "done" and (age := _age_sec(snap.to_dict().get("created_at"), done_at)) is not None:
+            latencies.append(age)
+    return _record_drain(t0, {
+        "ok": counts["failed"] == 0,
+        # 取り切れていない判定のため、取り出した件数を返す
+        "processed": len(fetched),
+        "claimed": len(claimed),
+        **counts,
+    }, latencies)
+
+def _count(q) -> int:
+    """集計クエリで件数を数える（ドキュメントは読まない）"""
+    return int(q.count().get()[0][0].value)
+
+def outbox_stats() -> Dict[str, Any]:
+    """アウトボックスの滞留状況（件数・最古項目の経過時間・直近のドレイン）"""
+    col = db.collection(OUTBOX_COLLECTION)
+    now = time.time()
+
+    oldest = list(col.order_by("created_at").limit(1).stream())
+    due = list(col.order_by("next_attempt_at").limit(1).stream())
+    oldest_age = _age_sec(oldest[0].to_dict().get("created_at"), now) if oldest else None
+    # 期限を過ぎても取り出されていない時間（ドレインの遅れ。リース中・バックオフ中は 0）
+    overdue = max(0.0, round(now - float(due[0].to_dict().get("next_attempt_at", now)), 1)) if due else None
+
+    # op 別の内訳は先頭の一部だけを見る（件数は集計クエリ）
+    sample = list(col.order_by("next_attempt_at").limit(1000).stream())
+    by_op: Dict[str, int] = {}
+    for s in sample:
+        op = s.to_dict().get("op", "?")
+        by_op[op] = by_op.get(op, 0) + 1
+    return {
+        "pending": _count(col),
+        "retrying": _count(col.where("attempts", ">", 0)),
+        "oldest_pending_age_sec": oldest_age,
+        "overdue_sec": overdue,
+        "by_op": by_op,
+        "by_op_sampled": len(sample),
+        "last_drain": dict(_last_drain),
+    }
+
+class OutboxWorker:
+    """アウトボックスを定期的にドレインするバックグラウンドタスク"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 終了前に1回だけ取りこぼしを流す（失敗しても項目は残る）
+        try:
+            await fs_run(drain_outbox_once)
+        except Exception as e:
+            print(f"[WARN] outbox final drain failed: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                res = await fs_run(drain_outbox_once)
+                # 取り切れていない可能性があれば待たずに続行
+                if res.get("processed", 0) >= settings.OUTBOX_BATCH_SIZE:
+                    continue
+            except Exception as e:
+                print(f"[WARN] outbox drain error: {e}")
+            await asyncio.sleep(settings.OUTBOX_POLL_SEC)
+
+outbox_worker = OutboxWorker()
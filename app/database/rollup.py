@@ -0,0 +1,125 @@
+from google.cloud import bigquery
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional
+from app.config import settings
+from app.database.bigquery import bq_client
+from app.database.schema import ensure_table, get_spec
+
+def _table(name: str) -> str:
+    return f"{settings.BQ_PROJECT_ID}.{settings.BQ_DATASET}.{name}"
+
+_ROLLUP_TABLES_READY = False
+
+def ensure_rollup_tables() -> None:
+    """集計テーブルがなければ作成（プロセスごとに1回）"""
+    global _ROLLUP_TABLES_READY
+    if _ROLLUP_TABLES_READY or not bq_client:
+        return
+    ensure_table(get_spec(settings.BQ_TABLE_DAILY_ROLLUP))
+    ensure_table(get_spec(settings.BQ_TABLE_MONTHLY_ROLLUP))
+    _ROLLUP_TABLES_READY = True
+
+def bq_refresh_rollups(user_id: str, dates: List[str]) -> Dict[str, Any]:
+    """
+    指定日の日次集計を元テーブルから再計算し、その日を含む月の月次集計を更新
+
+    触った (user_id, date) だけを再計算するので、コストは履歴の長さに依存しない。
+    fitbit_daily に過去の重複行があっても ingested_at が最新の1行だけを採用する。
+    """
+    if not bq_client or not dates:
+        return {"ok": False, "reason": "bq disabled or empty"}
+    ensure_rollup_tables()
+
+    day_list = sorted({date.fromisoformat(d[:10]) for d in dates})
+    months = sorted({d.replace(day=1) for d in day_list})
+
+    script = f"""
+    MERGE `{_table(settings.BQ_TABLE_DAILY_ROLLUP)}` T
+    USING (
+      WITH k AS (SELECT d AS date FROM UNNEST(@dates) AS d),
+      f AS (
+        SELECT date, ARRAY_AGG(STRUCT(steps_total, calories_total) ORDER BY ingested_at DESC LIMIT 1)[OFFSET(0)] AS v
+        FROM `{_table(settings.BQ_TABLE_FITBIT)}`
+        WHERE user_id = @user_id AND date IN UNNEST(@dates)
+        GROUP BY date
+      ),
+      m AS (
+        SELECT when_date AS date, COUNT(*) AS meal_count, CAST(SUM(kcal) AS FLOAT64) AS meal_kcal
+        FROM `{_table(settings.BQ_TABLE_MEALS)}`
+        WHERE user_id = @user_id AND when_date IN UNNEST(@dates)
+        GROUP BY when_date
+      )
+      SELECT @user_id AS user_id, k.date, f.v.steps_total, f.v.calories_total,
+             IFNULL(m.meal_count, 0) AS meal_count, m.meal_kcal
+      FROM k LEFT JOIN f USING (date) LEFT JOIN m USING (date)
+      WHERE f.date IS NOT NULL OR m.date IS NOT NULL
+    ) S
+    ON T.user_id = S.user_id AND T.date = S.date
+    WHEN MATCHED THEN
+      UPDATE SET steps_total = S.steps_total, calories_total = S.calories_total,
+                 meal_count = S.meal_count, meal_kcal = S.meal_kcal, updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+      INSERT (user_id, date, steps_total, calories_total, meal_count, meal_kcal, updated_at)
+      VALUES (S.user_id, S.date, S.steps_total, S.calories_total, S.meal_count, S.meal_kcal, CURRENT_TIMESTAMP());
+
+    MERGE `{_table(settings.BQ_TABLE_MONTHLY_ROLLUP)}` T
+    USING (
+      SELECT user_id, FORMAT_DATE('%Y-%m', date) AS month,
+             COUNTIF(steps_total IS NOT NULL) AS days,
+             AVG(steps_total) AS avg_steps, MIN(steps_total) AS min_steps, MAX(steps_total) AS max_steps,
+             AVG(calories_total) AS avg_cal, MIN(calories_total) AS min_cal, MAX(calories_total) AS max_cal,
+             SUM(meal_count) AS meal_count, SUM(meal_kcal) AS meal_kcal
+      FROM `{_table(settings.BQ_TABLE_DAILY_ROLLUP)}`
+      WHERE user_id = @user_id AND DATE_TRUNC(date, MONTH) IN UNNEST(@months)
+      GROUP BY user_id, month
+    ) S
+    ON T.user_id = S.user_id AND T.month = S.month
+    WHEN MATCHED THEN
+      UPDATE SET days = S.days, avg_steps = S.avg_steps, min_steps = S.min_steps, max_steps = S.max_steps,
+                 avg_cal = S.avg_cal, min_cal = S.min_cal, max_cal = S.max_cal,
+                 meal_count = S.meal_count, meal_kcal = S.meal_kcal, updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+      INSERT (user_id, month, days, avg_steps, min_steps, max_steps, avg_cal, min_cal, max_cal,
+              meal_count, meal_kcal, updated_at)
+      VALUES (S.user_id, S.month, S.days, S.avg_steps, S.min_steps, S.max_steps, S.avg_cal, S.min_cal, S.max_cal,
+              S.meal_count, S.meal_kcal, CURRENT_TIMESTAMP());
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("user_id", "STRING", user_id),
+            bigquery.ArrayQueryParameter("dates", "DATE", day_list),
+            bigquery.ArrayQueryParameter("months", "DATE", months),
+        ]
+    )
+    try:
+        bq_client.query(script, job_config=job_config).result()
+    except Exception as e:
+        print(f"[ERROR] bq_refresh_rollups failed for {user_id}: {e}")
+        return {"ok": False, "errors": [str(e)]}
+    return {"ok": True, "days": len(day_list), "months": [m.strftime("%Y-%m") for m in months]}
+
+def bq_rebuild_rollups(user_id: str, days: int = 400) -> Dict[str, Any]:
+    """既存データから集計テーブルを作り直す（導入時・不整合時の一括再計算）"""
+    today = datetime.now(timezone.utc).astimezone().date()
+    dates = [(today - timedelta(days=i)).isoformat() for i in range(days)]
+    return bq_refresh_rollups(user_id, dates)
+
+def bq_read_monthly_rollup(user_id: str, month: str) -> Optional[Dict[str, Any]]:
+    """月次集計の1行を読む（なければ None）"""
+    if not bq_client:
+        return None
+    ensure_rollup_tables()
+    sql = f"""
+    SELECT days, avg_steps, min_steps, max_steps, avg_cal, min_cal, max_cal, meal_count, meal_kcal
+    FROM `{_table(settings.BQ_TABLE_MONTHLY_ROLLUP)}`
+    WHERE user_id = @user_id AND month = @month
+    LIMIT 1
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("user_id", "STRING", user_id),
+            bigquery.ScalarQueryParameter("month", "STRING", month),
+        ]
+    )
+    rows = list(bq_client.query(sql, job_config=job_config).result())
+    return dict(rows[0].items()) if rows else None
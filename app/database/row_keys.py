@@ -0,0 +1,93 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Iterable, Tuple
+from app.config import settings
+
+# insertId の上限（これを超えるキーはハッシュにする）
+_MAX_INSERT_ID_LEN = 128
+
+# 取り込み時刻など、同じ行でも毎回変わる列（内容比較から外す）
+_VOLATILE_FIELDS = ("ingested", "ingested_at", "updated_at")
+
+def row_key(*parts: Any) -> str:
+    """行の自然キーから決定的な insertId を作る"""
+    key = ":".join(str(p) for p in parts)
+    if len(key) > _MAX_INSERT_ID_LEN:
+        key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return key
+
+def hp_row_id(user_id: str, measured_at: str) -> str:
+    """Health Planet 測定行のキー (user, measured_at)。全タグを1行に持つ"""
+    return row_key("hp", user_id, measured_at)
+
+def fitbit_row_id(user_id: str, date_str: str) -> str:
+    """Fitbit 日次行のキー (user, date)"""
+    return row_key("fitbit", user_id, date_str)
+
+def meal_row_id(meal_id: str) -> str:
+    """食事行のキー（Firestore の食事ドキュメントID）"""
+    return row_key("meal", meal_id)
+
+def row_fingerprint(row: Dict[str, Any]) -> str:
+    """取り込み時刻を除いた行内容のハッシュ"""
+    body = {k: v for k, v in row.items() if k not in _VOLATILE_FIELDS}
+    raw = json.dumps(body, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class RecentlySeen:
+    """
+    直近に送信済みの行（キー → 内容ハッシュ）のプロセス内 LRU
+
+    同じキー・同じ内容の行はネットワークに出す前に落とす。内容が変わった行は通す。
+    BigQuery 側の insertId 重複排除は短時間のベストエフォートなので、その手前の一次フィルタ。
+    """
+
+    def __init__(self):
+        self._lru: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"checked": 0, "skipped": 0, "marked": 0}
+
+    def _seen(self, key: str, fp: str, now: float) -> bool:
+        item = self._lru.get(key)
+        if not item:
+            return False
+        seen_fp, expires_at = item
+        if expires_at <= now:
+            self._lru.pop(key, None)
+            return False
+        return seen_fp == fp
+
+    def filter(self, keys: List[str], rows: List[Dict[str, Any]]) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """未送信（または内容が変わった）行だけを (keys, rows) で返す"""
+        now = time.time()
+        out_keys: List[str] = []
+        out_rows: List[Dict[str, Any]] = []
+        with self._lock:
+            for key, row in zip(keys, rows):
+                self.stats["checked"] += 1
+                if self._seen(key, row_fingerprint(row), now):
+                    self.stats["skipped"] += 1
+                    continue
+                out_keys.append(key)
+                out_rows.append(row)
+        return out_keys, out_rows
+
+    def mark(self, keys: Iterable[str], rows: Iterable[Dict[str, Any]]) -> None:
+        """送信に成功した（または永続キューに積んだ）行を記録"""
+        expires_at = time.time() + settings.BQ_SEEN_TTL_SEC
+        with self._lock:
+            for key, row in zip(keys, rows):
+                self._lru[key] = (row_fingerprint(row), expires_at)
+                self._lru.move_to_end(key)
+                self.stats["marked"] += 1
+            while len(self._lru) > settings.BQ_SEEN_MAX_KEYS:
+                self._lru.popitem(last=False)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self._lru), **self.stats}
+
+recent_rows = RecentlySeen()
@@ -0,0 +1,305 @@
+from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Any, Optional
+from app.config import settings
+from app.database.bigquery import bq_client
+
+F = bigquery.SchemaField
+
+class TableSpec:
+    """BigQuery テーブルのあるべきレイアウト（スキーマ・パーティション・クラスタリング・保持期間）"""
+
+    def __init__(self, name: str, schema: List[bigquery.SchemaField],
+                 partition_field: Optional[str] = None, partition_type: str = "MONTH",
+                 clustering: Optional[List[str]] = None, expiration_days: int = 0):
+        self.name = name
+        self.schema = schema
+        self.partition_field = partition_field
+        self.partition_type = partition_type
+        self.clustering = clustering or []
+        self.expiration_days = expiration_days
+
+    @property
+    def table_id(self) -> str:
+        # HP_BQ_TABLE は project.dataset.table の完全修飾名
+        if self.name.count(".") == 2:
+            return self.name
+        return f"{settings.BQ_PROJECT_ID}.{settings.BQ_DATASET}.{self.name}"
+
+    def time_partitioning(self) -> Optional[bigquery.TimePartitioning]:
+        if not self.partition_field:
+            return None
+        return bigquery.TimePartitioning(
+            type_=self.partition_type,
+            field=self.partition_field,
+            expiration_ms=self.expiration_days * 86400 * 1000 if self.expiration_days else None,
+        )
+
+def table_specs() -> List[TableSpec]:
+    """アプリが使う全テーブルの宣言（取り込み量が少ないため月単位パーティション＋user_id クラスタ）"""
+    raw_expiration = settings.BQ_RAW_PARTITION_EXPIRATION_DAYS
+    return [
+        TableSpec(settings.BQ_TABLE_FITBIT, [
+            F("user_id", "STRING"), F("date", "DATE"),
+            F("steps_total", "INT64"), F("calories_total", "INT64"),
+            F("sleep_minutes", "INT64"), F("sleep_deep_min", "INT64"), F("sleep_rem_min", "INT64"),
+            F("sleep_light_min", "INT64"), F("sleep_wake_min", "INT64"),
+            F("spo2_avg", "FLOAT64"), F("spo2_min", "FLOAT64"), F("spo2_max", "FLOAT64"),
+            # 旧形式の表示文字列（過去行の参照用。新規行では書き込まない）
+            F("sleep_line", "STRING"), F("spo2_line", "STRING"),
+            F("ingested_at", "TIMESTAMP"),
+        ], partition_field="date", clustering=["user_id"], expiration_days=raw_expiration),
+        TableSpec(settings.BQ_TABLE_MEALS, [
+            F("user_id", "STRING"), F("when", "TIMESTAMP"), F("when_date", "DATE"),
+            F("text", "STRING"), F("kcal", "FLOAT64"), F("source", "STRING"),
+            F("file_name", "STRING"), F("mime", "STRING"), F("ingested_at", "TIMESTAMP"),
+        ], partition_field="when_date", clustering=["user_id"]),
+        TableSpec(settings.BQ_TABLE_MONTHLY, [
+            F("user_id", "STRING"), F("month", "STRING"),
+            F("summary_text", "STRING"), F("created_at", "TIMESTAMP"),
+        ], partition_field="created_at", partition_type="YEAR", clustering=["user_id", "month"]),
+        TableSpec(settings.BQ_TABLE_PROFILES, [
+            F("user_id", "STRING"), F("updated_at", "TIMESTAMP"), F("age", "INT64"), F("sex", "STRING"),
+            F("height_cm", "FLOAT64"), F("weight_kg", "FLOAT64"), F("target_weight_kg", "FLOAT64"),
+            F("goal", "STRING"), F("smoking_status", "STRING"), F("alcohol_habit", "STRING"),
+            F("past_history", "STRING"), F("medications", "STRING"), F("allergies", "STRING"),
+            F("notes", "STRING"),
+        ], clustering=["user_id"]),
+        # 旧形式（タグごとの縦持ち＋raw）。過去行の参照と移行元としてのみ残す
+        # ワイド行へ移行する前に履歴が消えないよう、保持期間は掛けない
+        TableSpec(settings.HP_BQ_TABLE, [
+            F("user_id", "STRING"), F("measured_at", "DATETIME"), F("tag", "STRING"),
+            F("value", "FLOAT64"), F("unit", "STRING"), F("ingested", "TIMESTAMP"), F("raw", "JSON"),
+        ], partition_field="measured_at", clustering=["user_id", "tag"]),
+        TableSpec(settings.HP_BQ_TABLE_BODY, [
+            F("user_id", "STRING"), F("measured_at", "DATETIME"),
+            F("weight_kg", "FLOAT64"), F("body_fat_pct", "FLOAT64"), F("muscle_mass_kg", "FLOAT64"),
+            F("muscle_score", "INT64"), F("visceral_fat_level", "FLOAT64"), F("basal_metabolism_kcal", "INT64"),
+            F("body_age", "INT64"), F("bone_mass_kg", "FLOAT64"), F("model", "STRING"),
+            F("ingested", "TIMESTAMP"),
+        ], partition_field="measured_at", clustering=["user_id"]),
+        TableSpec(settings.BQ_TABLE_DAILY_ROLLUP, [
+            F("user_id", "STRING", mode="REQUIRED"), F("date", "DATE", mode="REQUIRED"),
+            F("steps_total", "INT64"), F("calories_total", "INT64"),
+            F("meal_count", "INT64"), F("meal_kcal", "FLOAT64"), F("updated_at", "TIMESTAMP"),
+        ], partition_field="date", clustering=["user_id"]),
+        TableSpec(settings.BQ_TABLE_MONTHLY_ROLLUP, [
+            F("user_id", "STRING", mode="REQUIRED"), F("month", "STRING", mode="REQUIRED"),
+            F("days", "INT64"),
+            F("avg_steps", "FLOAT64"), F("min_steps", "INT64"), F("max_steps", "INT64"),
+            F("avg_cal", "FLOAT64"), F("min_cal", "INT64"), F("max_cal", "INT64"),
+            F("meal_count", "INT64"), F("meal_kcal", "FLOAT64"), F("updated_at", "TIMESTAMP"),
+        ], clustering=["user_id", "month"]),
+    ]
+
+def get_spec(name: str) -> TableSpec:
+    for spec in table_specs():
+        if spec.name == name:
+            return spec
+    raise KeyError(name)
+
+def _partition_expr(field: str, field_type: str, unit: str) -> Optional[str]:
+    if field_type == "DATE":
+        return f"DATE_TRUNC({field}, {unit})"
+    if field_type == "TIMESTAMP":
+        return f"TIMESTAMP_TRUNC({field}, {unit})"
+    if field_type == "DATETIME":
+        return f"DATETIME_TRUNC({field}, {unit})"
+    return None
+
+def plan_table(spec: TableSpec) -> Dict[str, Any]:
+    """現在のテーブルと宣言を比較し、必要な変更を返す"""
+    try:
+        table = bq_client.get_table(spec.table_id)
+    except NotFound:
+        return {"table": spec.table_id, "action": "create"}
+
+    existing = {f.name: f for f in table.schema}
+    missing = [f.name for f in spec.schema if f.name not in existing]
+    changes: List[str] = []
+    if missing:
+        changes.append("add_columns")
+    if (table.clustering_fields or []) != spec.clustering:
+        changes.append("clustering")
+
+    cur = table.time_partitioning
+    cur_field = cur.field if cur else None
+    cur_type = cur.type_ if cur else None
+    action = "ok"
+    if spec.partition_field and (cur_field != spec.partition_field or cur_type != spec.partition_type):
+        # パーティションは既存テーブルを変更できないので作り直し
+        field = existing.get(spec.partition_field)
+        if field is None or _partition_expr(spec.partition_field, field.field_type, spec.partition_type) is None:
+            action = "manual"
+        else:
+            action = "recreate"
+    elif spec.partition_field:
+        want_ms = spec.time_partitioning().expiration_ms
+        if (cur.expiration_ms or None) != want_ms:
+            changes.append("expiration")
+    if action == "ok" and changes:
+        action = "update"
+
+    return {
+        "table": spec.table_id,
+        "action": action,
+        "changes": changes,
+        "missing_columns": missing,
+        "partitioning": {"current": [cur_field, cur_type], "wanted": [spec.partition_field, spec.partition_type]},
+        "clustering": {"current": table.clustering_fields, "wanted": spec.clustering},
+        "rows": table.num_rows,
+    }
+
+def _create(spec: TableSpec) -> None:
+    table = bigquery.Table(spec.table_id, schema=spec.schema)
+    table.time_partitioning = spec.time_partitioning()
+    table.clustering_fields = spec.clustering or None
+    bq_client.create_table(table, exists_ok=True)
+
+def _add_columns(spec: TableSpec, missing: List[str]) -> None:
+    """不足列だけを追加（既存データに影響しない）"""
+    table = bq_client.get_table(spec.table_id)
+    table.schema = list(table.schema) + [f for f in spec.schema if f.name in missing]
+    bq_client.update_table(table, ["schema"])
+
+def _update(spec: TableSpec) -> None:
+    """列追加・クラスタリング・保持期間はその場で変更できる"""
+    table = bq_client.get_table(spec.table_id)
+    names = {f.name for f in table.schema}
+    table.schema = list(table.schema) + [f for f in spec.schema if f.name not in names]
+    table.clustering_fields = spec.clustering or None
+    fields = ["schema", "clustering_fields"]
+    if spec.partition_field and table.time_partitioning:
+        table.time_partitioning.expiration_ms = spec.time_partitioning().expiration_ms
+        fields.append("time_partitioning")
+    bq_client.update_table(table, fields)
+
+def _recreate(spec: TableSpec) -> str:
+    """CTAS でパーティション付きテーブルを作り、旧テーブルを退避して差し替える"""
+    _update(spec)
+    table = bq_client.get_table(spec.table_id)
+    ptype = {f.name: f.field_type for f in table.schema}[spec.partition_field]
+    part = _partition_expr(spec.partition_field, ptype, spec.partition_type)
+    options = f"OPTIONS(partition_expiration_days={spec.expiration_days})" if spec.expiration_days else ""
+    cluster = f"CLUSTER BY {', '.join(spec.clustering)}" if spec.clustering else ""
+    suffix = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    short = spec.table_id.split(".")[-1]
+    tmp_id = f"{spec.table_id}__migrating"
+    backup = f"{short}__backup_{suffix}"
+
+    bq_client.query(f"""
+    CREATE OR REPLACE TABLE `{tmp_id}`
+    PARTITION BY {part}
+    {cluster}
+    {options}
+    AS SELECT * FROM `{spec.table_id}`
+    """).result()
+    bq_client.query(f"ALTER TABLE `{spec.table_id}` RENAME TO `{backup}`").result()
+    bq_client.query(f"ALTER TABLE `{tmp_id}` RENAME TO `{short}`").result()
+    return backup
+
+def ensure_table(spec: TableSpec) -> Dict[str, Any]:
+    """テーブルがなければ宣言どおりに作成する（既存テーブルには触れない）"""
+    plan = plan_table(spec)
+    if plan["action"] == "create":
+        _create(spec)
+    return plan
+
+def apply_schema(apply: bool = False, allow_recreate: bool = False) -> Dict[str, Any]:
+    """
+    全テーブルの差分を確認し、apply=True なら作成・更新する
+
+    パーティション変更（作り直し）は allow_recreate=True のときのみ実行する。
+    ストリーミングバッファが残っているテーブルは RENAME できないため、取り込みを止めてから実行すること。
+    """
+    if not bq_client:
+        return {"ok": False, "reason": "bq disabled"}
+
+    results = []
+    for spec in table_specs():
+        plan = plan_table(spec)
+        if apply:
+            try:
+                if plan["action"] == "create":
+                    _create(spec)
+                    plan["applied"] = True
+                elif plan["action"] == "update":
+                    _update(spec)
+                    plan["applied"] = True
+                elif plan["action"] == "recreate" and allow_recreate:
+                    plan["backup"] = _recreate(spec)
+                    plan["applied"] = True
+            except Exception as e:
+                plan["error"] = repr(e)
+                print(f"[ERROR] schema apply failed for {spec.table_id}: {e}")
+        results.append(plan)
+    return {"ok": not any("error" in r for r in results), "tables": results}
+
+def scan_report_queries(user_id: str = "demo") -> Dict[str, Any]:
+    """アプリの代表的なクエリ（SQL とパラメータ）。ドライランでスキャン量を見るために使う"""
+    today = datetime.now(timezone.utc).astimezone().date()
+    month_start = today.replace(day=1)
+    week_dates = [today - timedelta(days=i) for i in range(7)]
+    t = lambda name: get_spec(name).table_id
+    uid = bigquery.ScalarQueryParameter("user_id", "STRING", user_id)
+    return {
+        "monthly_meals": (f"""
+            SELECT when_date, text FROM `{t(settings.BQ_TABLE_MEALS)}`
+            WHERE user_id=@user_id AND when_date BETWEEN @start AND @end
+            ORDER BY when_date DESC LIMIT 10""",
+            [uid, bigquery.ScalarQueryParameter("start", "DATE", month_start),
+             bigquery.ScalarQueryParameter("end", "DATE", today)]),
+        "monthly_rollup": (f"""
+            SELECT * FROM `{t(settings.BQ_TABLE_MONTHLY_ROLLUP)}`
+            WHERE user_id=@user_id AND month=@month LIMIT 1""",
+            [uid, bigquery.ScalarQueryParameter("month", "STRING", month_start.strftime("%Y-%m"))]),
+        "rollup_refresh_fitbit": (f"""
+            SELECT date, steps_total, calories_total FROM `{t(settings.BQ_TABLE_FITBIT)}`
+            WHERE user_id=@user_id AND date IN UNNEST(@dates)""",
+            [uid, bigquery.ArrayQueryParameter("dates", "DATE", week_dates)]),
+        "rollup_refresh_meals": (f"""
+            SELECT when_date, kcal FROM `{t(settings.BQ_TABLE_MEALS)}`
+            WHERE user_id=@user_id AND when_date IN UNNEST(@dates)""",
+            [uid, bigquery.ArrayQueryParameter("dates", "DATE", week_dates)]),
+        "healthplanet_7d_legacy": (f"""
+            SELECT measured_at, tag, value FROM `{t(settings.HP_BQ_TABLE)}`
+            WHERE user_id=@user_id AND measured_at >= DATETIME(@start) AND tag IN ('6021', '6022')""",
+            [uid, bigquery.ScalarQueryParameter("start", "DATE", week_dates[-1])]),
+        "healthplanet_7d": (f"""
+            SELECT measured_at, weight_kg, body_fat_pct FROM `{t(settings.HP_BQ_TABLE_BODY)}`
+            WHERE user_id=@user_id AND measured_at >= DATETIME(@start)""",
+            [uid, bigquery.ScalarQueryParameter("start", "DATE", week_dates[-1])]),
+    }
+
+def ensure_all_tables() -> Dict[str, Any]:
+    """起動時用：存在しないテーブルの作成と不足列の追加のみ行い、その他の差分は報告のみ"""
+    if not bq_client:
+        return {"ok": False, "reason": "bq disabled"}
+    pending = []
+    for spec in table_specs():
+        plan = ensure_table(spec)
+        if plan.get("missing_columns"):
+            _add_columns(spec, plan["missing_columns"])
+            plan["changes"] = [c for c in plan["changes"] if c != "add_columns"]
+            if plan["action"] == "update" and not plan["changes"]:
+                plan["action"] = "ok"
+        if plan["action"] not in ("ok", "create"):
+            pending.append({"table": plan["table"], "action": plan["action"]})
+    if pending:
+        print(f"[WARN] BigQuery layout differs from spec (run scripts/bq_migrate.py): {pending}")
+    return {"ok": True, "pending": pending}
+
+def scan_report(user_id: str = "demo") -> Dict[str, Any]:
+    """代表クエリをドライランし、スキャンされるバイト数を返す（課金なし）"""
+    if not bq_client:
+        return {"ok": False, "reason": "bq disabled"}
+    report: Dict[str, Any] = {}
+    for name, (sql, params) in scan_report_queries(user_id).items():
+        cfg = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False, query_parameters=params)
+        try:
+            job = bq_client.query(sql, job_config=cfg)
+            report[name] = {"bytes": job.total_bytes_processed}
+        except Exception as e:
+            report[name] = {"error": repr(e)[:300]}
+    return {"ok": True, "measured_at": datetime.now(timezone.utc).isoformat(), "queries": report}
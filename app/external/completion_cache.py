@@ -0,0 +1,95 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Tuple
+from app.config import settings
+from app.database.firestore import db, fs_get, fs_set
+
+# 永続キャッシュの Firestore コレクション
+CACHE_COLLECTION = "llm_cache"
+
+def completion_key(model: str, prompt: str, params: Dict[str, Any]) -> str:
+    """(model, prompt, parameters) の内容ハッシュ"""
+    raw = json.dumps({"model": model, "prompt": prompt, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class CompletionCache:
+    """
+    OpenAI 応答の2層キャッシュ
+
+    - メモリ: LRU（OPENAI_CACHE_MAX_ENTRIES 件）
+    - Firestore: llm_cache/{key}（インスタンス間で共有）
+    どちらも OPENAI_CACHE_TTL_SEC で失効する。
+    """
+
+    def __init__(self):
+        self._lru: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "firestore_hits": 0, "misses": 0, "bypassed": 0, "stores": 0}
+
+    def _mem_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._lru.get(key)
+            if not item:
+                return None
+            text, expires_at = item
+            if expires_at <= time.time():
+                self._lru.pop(key, None)
+                return None
+            self._lru.move_to_end(key)
+            return text
+
+    def _mem_put(self, key: str, text: str, expires_at: float) -> None:
+        with self._lock:
+            self._lru[key] = (text, expires_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > settings.OPENAI_CACHE_MAX_ENTRIES:
+                self._lru.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        text = self._mem_get(key)
+        if text is not None:
+            self.stats["memory_hits"] += 1
+            return text
+        try:
+            snap = await fs_get(db.collection(CACHE_COLLECTION).document(key))
+            if snap.exists:
+                d = snap.to_dict() or {}
+                if d.get("expires_at", 0) > time.time() and d.get("text") is not None:
+                    self._mem_put(key, d["text"], d["expires_at"])
+                    self.stats["firestore_hits"] += 1
+                    return d["text"]
+        except Exception as e:
+            print(f"[WARN] completion cache read failed: {e}")
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, key: str, text: str, model: str) -> None:
+        expires_at = time.time() + settings.OPENAI_CACHE_TTL_SEC
+        self._mem_put(key, text, expires_at)
+        self.stats["stores"] += 1
+        try:
+            await fs_set(db.collection(CACHE_COLLECTION).document(key), {
+                "text": text,
+                "model": model,
+                "expires_at": expires_at,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            })
+        except Exception as e:
+            print(f"[WARN] completion cache write failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        hits = self.stats["memory_hits"] + self.stats["firestore_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._lru),
+            "ttl_sec": settings.OPENAI_CACHE_TTL_SEC,
+            "enabled": settings.OPENAI_CACHE_ENABLED,
+        }
+
+completion_cache = CompletionCache()
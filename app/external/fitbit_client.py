@@ -1,9 +1,13 @@
 import asyncio
 import base64
+import time
 import httpx
+from typing import Dict, Any, Mapping
 from datetime import datetime, timezone, timedelta
 from app.config import settings
-from app.database.firestore import fitbit_token_doc
+from app.database.firestore import fitbit_token_doc, fs_get, fs_set
+from app.external.http_client import get_http_client
+from app.external.token_cache import token_cache
 
 FITBIT_TOKEN_LOCK = asyncio.Lock()
 
@@ -25,10 +29,10 @@ async def fitbit_exchange_code(code: str) -> dict:
         "code": code
     }
     
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        r = await client.post("https://api.fitbit.com/oauth2/token", headers=headers, data=data)
-        r.raise_for_status()
-        return r.json()
+    client = get_http_client("fitbit")
+    r = await client.post("https://api.fitbit.com/oauth2/token", headers=headers, data=data)
+    r.raise_for_status()
+    return r.json()
 
 async def fitbit_refresh(refresh_token: str) -> dict:
     """リフレッシュトークンで新しいアクセストークンを取得"""
@@ -39,35 +43,41 @@ async def fitbit_refresh(refresh_token: str) -> dict:
     }
     data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
     
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        r = await client.post("https://api.fitbit.com/oauth2/token", headers=headers, data=data)
-        r.raise_for_status()
-        return r.json()
+    client = get_http_client("fitbit")
+    r = await client.post("https://api.fitbit.com/oauth2/token", headers=headers, data=data)
+    r.raise_for_status()
+    return r.json()
 
 async def get_fitbit_access_token(user_id: str = "demo") -> str:
     """Fitbit アクセストークンを返す。期限が近ければ1回だけリフレッシュする（ロック付き）"""
+    cached = token_cache.get("fitbit", user_id)
+    if cached:
+        return cached
+
     doc = fitbit_token_doc(user_id)
 
     def _now_ts() -> int:
         return int(datetime.now(timezone.utc).timestamp())
 
-    snap = doc.get()
+    snap = await fs_get(doc)
     if not snap.exists:
         raise RuntimeError("Fitbit not connected. Open /fitbit/login first.")
     
     tok = snap.to_dict()
     if tok.get("expires_at", 0) > _now_ts() + 120:
+        token_cache.put("fitbit", user_id, tok["access_token"], tok["expires_at"])
         return tok["access_token"]
 
     async with FITBIT_TOKEN_LOCK:
-        snap = doc.get()
+        snap = await fs_get(doc)
         tok = snap.to_dict()
         if tok.get("expires_at", 0) > _now_ts() + 120:
+            token_cache.put("fitbit", user_id, tok["access_token"], tok["expires_at"])
             return tok["access_token"]
 
         newtok = await fitbit_refresh(tok["refresh_token"])
         expires_at = _now_ts() + int(newtok.get("expires_in", 3600))
-        doc.set({
+        await fs_set(doc, {
             "access_token": newtok["access_token"],
             "refresh_token": newtok.get("refresh_token", tok["refresh_token"]),
             "token_type": newtok.get("token_type", "Bearer"),
@@ -76,12 +86,127 @@ async def get_fitbit_access_token(user_id: str = "demo") -> str:
             "expires_at": expires_at,
             "updated_at": datetime.now(timezone.utc).isoformat(),
         }, merge=True)
+        token_cache.put("fitbit", user_id, newtok["access_token"], expires_at)
         return newtok["access_token"]
 
-async def fitbit_get(access_token: str, url: str) -> dict:
-    """FitbitのAPIにGETリクエストを送信"""
+class FitbitRateLimitError(RuntimeError):
+    """Fitbitのレート制限により呼び出しを延期すべきときに送出"""
+    def __init__(self, user_id: str, retry_after: float):
+        super().__init__(f"Fitbit rate limit budget exhausted for {user_id}; retry after {int(retry_after)}s")
+        self.user_id = user_id
+        self.retry_after = retry_after
+
+class FitbitRateBudget:
+    """ユーザー単位のトークンバケット。1時間ごとに満タンに戻り、レスポンスヘッダで補正する"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.capacity = settings.FITBIT_RATE_LIMIT_PER_HOUR
+        self.remaining = self.capacity
+        self.reset_at = time.monotonic() + 3600
+        self.blocked_until = 0.0
+        self.learned = False
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now >= self.reset_at:
+            self.remaining = self.capacity
+            self.reset_at = now + 3600
+            self.learned = False
+
+    async def acquire(self, priority: str = "high") -> None:
+        """1リクエスト分の予算を確保する。低優先度は予備枠を残して待機/延期する"""
+        reserve = settings.FITBIT_RATE_LOW_PRIORITY_RESERVE if priority == "low" else 0
+        max_wait = settings.FITBIT_RATE_LOW_PRIORITY_MAX_WAIT if priority == "low" else settings.FITBIT_RATE_MAX_WAIT
+        while True:
+            async with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.remaining > reserve:
+                    self.remaining -= 1
+                    return
+                else:
+                    wait = self.reset_at - now
+            if wait > max_wait:
+                raise FitbitRateLimitError(self.user_id, wait)
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Fitbit-Rate-Limit-* ヘッダから残量とリセット時刻を学習"""
+        now = time.monotonic()
+        limit = headers.get("fitbit-rate-limit-limit")
+        remaining = headers.get("fitbit-rate-limit-remaining")
+        reset = headers.get("fitbit-rate-limit-reset")
+        try:
+            if limit is not None:
+                self.capacity = int(limit)
+            if remaining is not None:
+                self.remaining = int(remaining)
+                self.learned = True
+            if reset is not None:
+                self.reset_at = now + int(reset)
+        except ValueError:
+            pass
+
+    def block_for(self, seconds: float) -> None:
+        """429受信時、指定秒数すべての呼び出しを止める"""
+        self.remaining = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "user_id": self.user_id,
+            "limit": self.capacity,
+            "remaining": self.remaining,
+            "reset_in_sec": max(0, int(self.reset_at - now)),
+            "blocked_for_sec": max(0, int(self.blocked_until - now)),
+            "learned_from_headers": self.learned,
+            "low_priority_reserve": settings.FITBIT_RATE_LOW_PRIORITY_RESERVE,
+        }
+
+_RATE_BUDGETS: Dict[str, FitbitRateBudget] = {}
+
+def get_rate_budget(user_id: str = "demo") -> FitbitRateBudget:
+    """ユーザーのレート予算を返す（なければ生成）"""
+    budget = _RATE_BUDGETS.get(user_id)
+    if budget is None:
+        budget = _RATE_BUDGETS[user_id] = FitbitRateBudget(user_id)
+    return budget
+
+def _retry_after_seconds(r: httpx.Response) -> float:
+    """Retry-After / Fitbit-Rate-Limit-Reset から待機秒数を求める"""
+    for key in ("retry-after", "fitbit-rate-limit-reset"):
+        v = r.headers.get(key)
+        if v:
+            try:
+                return float(v)
+            except ValueError:
+                continue
+    return 60.0
+
+async def fitbit_get(access_token: str, url: str, user_id: str = "demo", priority: str = "high") -> dict:
+    """FitbitのAPIにGETリクエストを送信（ユーザー単位のレート予算を消費）"""
     headers = {"Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient(timeout=30.0) as client:
+    client = get_http_client("fitbit")
+    budget = get_rate_budget(user_id)
+
+    for attempt in range(2):
+        await budget.acquire(priority)
         r = await client.get(url, headers=headers)
-        r.raise_for_status()
-        return r.json()
+        budget.update_from_headers(r.headers)
+        if r.status_code != 429:
+            break
+        wait = _retry_after_seconds(r)
+        budget.block_for(wait)
+        print(f"[WARN] Fitbit 429 for {user_id}; blocked {int(wait)}s")
+        if attempt == 0:
+            # 待機が許容範囲内なら1回だけ再試行（acquire内で待つ）
+            max_wait = settings.FITBIT_RATE_LOW_PRIORITY_MAX_WAIT if priority == "low" else settings.FITBIT_RATE_MAX_WAIT
+            if wait > max_wait:
+                raise FitbitRateLimitError(user_id, wait)
+    r.raise_for_status()
+    return r.json()
@@ -1,16 +1,24 @@
-import httpx
 import urllib.parse
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict, Any
 from app.config import settings
-from app.database.firestore import healthplanet_token_doc
+from app.database.firestore import healthplanet_token_doc, fs_get
+from app.external.http_client import get_http_client
+from app.external.token_cache import token_cache
 
-def get_access_token(user_id: str = "demo") -> Optional[str]:
-    """Health Planetアクセストークンを取得"""
-    snap = healthplanet_token_doc(user_id).get()
+async def get_access_token(user_id: str = "demo") -> Optional[str]:
+    """Health Planetアクセストークンを取得（期限まではプロセス内キャッシュから返す）"""
+    cached = token_cache.get("healthplanet", user_id)
+    if cached:
+        return cached
+
+    snap = await fs_get(healthplanet_token_doc(user_id))
     if not snap.exists:
         return None
-    return (snap.to_dict() or {}).get("access_token")
+    tok = snap.to_dict() or {}
+    access = tok.get("access_token")
+    token_cache.put("healthplanet", user_id, access, tok.get("expires_at"))
+    return access
 
 def jst_now() -> datetime:
     """JST現在時刻を返す"""
@@ -50,10 +58,10 @@ async def exchange_code_for_token(code: str) -> Dict[str, Any]:
         "grant_type": "authorization_code",
     }
     
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        r = await client.post("https://www.healthplanet.jp/oauth/token", data=data)
-        r.raise_for_status()
-        return r.json()
+    client = get_http_client("healthplanet")
+    r = await client.post("https://www.healthplanet.jp/oauth/token", data=data)
+    r.raise_for_status()
+    return r.json()
 
 async def fetch_innerscan_data(
     user_id: str = "demo",
@@ -63,7 +71,7 @@ async def fetch_innerscan_data(
     to_dt: Optional[str] = None
 ) -> Dict[str, Any]:
     """体組成データを取得"""
-    access = get_access_token(user_id)
+    access = await get_access_token(user_id)
     if not access:
         raise ValueError("Health Planet not connected")
     
@@ -73,7 +81,7 @@ async def fetch_innerscan_data(
     if to_dt:
         params["to"] = to_dt
     
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        r = await client.get("https://www.healthplanet.jp/status/innerscan.json", params=params)
-        r.raise_for_status()
-        return r.json()
+    client = get_http_client("healthplanet")
+    r = await client.get("https://www.healthplanet.jp/status/innerscan.json", params=params)
+    r.raise_for_status()
+    return r.json()
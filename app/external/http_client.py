@@ -0,0 +1,67 @@
+import httpx
+from typing import Dict, Any
+from app.config import settings
+
+# 上流APIごとの接続設定（タイムアウト秒・プールサイズ）
+UPSTREAMS: Dict[str, Dict[str, Any]] = {
+    "fitbit": {
+        "timeout": settings.FITBIT_HTTP_TIMEOUT,
+        "max_connections": settings.FITBIT_HTTP_MAX_CONNECTIONS,
+    },
+    "healthplanet": {
+        "timeout": settings.HEALTHPLANET_HTTP_TIMEOUT,
+        "max_connections": settings.HEALTHPLANET_HTTP_MAX_CONNECTIONS,
+    },
+    "openai": {
+        "timeout": settings.OPENAI_HTTP_TIMEOUT,
+        "max_connections": settings.OPENAI_HTTP_MAX_CONNECTIONS,
+    },
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+def _http2_available() -> bool:
+    """HTTP/2 が有効かつ h2 パッケージが利用可能か"""
+    if not settings.HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("[WARN] HTTP2_ENABLED but 'h2' is not installed; falling back to HTTP/1.1")
+        return False
+
+def _build_client(name: str) -> httpx.AsyncClient:
+    """上流API用の AsyncClient を生成"""
+    conf = UPSTREAMS[name]
+    max_conn = int(conf["max_connections"])
+    limits = httpx.Limits(
+        max_connections=max_conn,
+        max_keepalive_connections=max_conn,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(conf["timeout"], connect=min(10.0, conf["timeout"]))
+    return httpx.AsyncClient(timeout=timeout, limits=limits, http2=_http2_available())
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """共有 AsyncClient を返す（未初期化なら生成する）"""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _build_client(name)
+        _clients[name] = client
+    return client
+
+async def open_http_clients() -> None:
+    """全上流APIのクライアントを起動時に生成"""
+    for name in UPSTREAMS:
+        get_http_client(name)
+
+async def close_http_clients() -> None:
+    """全クライアントを閉じる（シャットダウン時）"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            print(f"[WARN] http client close failed: {e}")
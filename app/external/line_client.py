@@ -1,17 +1,18 @@
 from linebot import LineBotApi
 from linebot.models import TextSendMessage
 from app.config import settings
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 line_bot = LineBotApi(settings.LINE_ACCESS_TOKEN) if settings.LINE_ACCESS_TOKEN else None
 
-def push_line(text: str) -> Dict[str, Any]:
-    """LINEメッセージを送信"""
-    if not settings.LINE_ACCESS_TOKEN or not settings.LINE_USER_ID:
+def push_line(text: str, to: Optional[str] = None) -> Dict[str, Any]:
+    """LINEメッセージを送信（to 未指定時は LINE_USER_ID 宛）"""
+    target = to or settings.LINE_USER_ID
+    if not settings.LINE_ACCESS_TOKEN or not target:
         return {"sent": False, "reason": "LINE secrets not set"}
     
     try:
-        line_bot.push_message(settings.LINE_USER_ID, TextSendMessage(text=text))
+        line_bot.push_message(target, TextSendMessage(text=text))
         return {"sent": True}
     except Exception as e:
         return {"sent": False, "reason": repr(e)}
@@ -1,19 +1,19 @@
-import httpx
 import base64
+import json
+from typing import AsyncIterator, Dict, Any, Optional
 from app.config import settings
+from app.external.http_client import get_http_client
+from app.external.completion_cache import completion_cache, completion_key
 
-async def ask_gpt5(text: str) -> str:
-    """OpenAI Chat Completions API 呼び出し"""
-    if not settings.OPENAI_API_KEY:
-        return "（OPENAI_API_KEY が未設定です）"
-    
-    headers = {
+def _headers() -> Dict[str, str]:
+    return {
         "Authorization": f"Bearer {settings.OPENAI_API_KEY}", 
         "Content-Type": "application/json"
     }
-    
-    # Chat Completions API形式に修正
-    body = {
+
+def coaching_chat_body(text: str) -> Dict[str, Any]:
+    """コーチング用 Chat Completions リクエストボディ（同期・ストリーミング・Batch で共通）"""
+    return {
         "model": settings.OPENAI_MODEL,
         "messages": [
             {
@@ -24,22 +24,121 @@ async def ask_gpt5(text: str) -> str:
         "max_tokens": 1500,
         "temperature": 0.7
     }
+
+def coaching_cache_key(body: Dict[str, Any]) -> str:
+    """リクエストボディに対応する応答キャッシュのキー"""
+    text = body["messages"][0]["content"]
+    return completion_key(body["model"], text, {"max_tokens": body["max_tokens"], "temperature": body["temperature"]})
+
+async def ask_gpt5(text: str, use_cache: bool = True) -> str:
+    """OpenAI Chat Completions API 呼び出し（同一の model/prompt/パラメータはキャッシュから返す）"""
+    if not settings.OPENAI_API_KEY:
+        return "（OPENAI_API_KEY が未設定です）"
+    
+    body = coaching_chat_body(text)
+    
+    cache_on = use_cache and settings.OPENAI_CACHE_ENABLED
+    key = coaching_cache_key(body)
+    if cache_on:
+        cached = await completion_cache.get(key)
+        if cached is not None:
+            return cached
+    else:
+        completion_cache.stats["bypassed"] += 1
+    
+    client = get_http_client("openai")
+    r = await client.post(f"{settings.OPENAI_BASE_URL}/chat/completions", headers=_headers(), json=body)
+    r.raise_for_status()
+    data = r.json()
+    content = data["choices"][0]["message"]["content"]
+    if settings.OPENAI_CACHE_ENABLED:
+        await completion_cache.put(key, content, body["model"])
+    return content
+
+async def ask_gpt5_stream(text: str, use_cache: bool = True) -> AsyncIterator[str]:
+    """OpenAI Chat Completions API をストリーミング（stream=True）で呼び、トークン差分を順次 yield"""
+    if not settings.OPENAI_API_KEY:
+        yield "（OPENAI_API_KEY が未設定です）"
+        return
+    
+    body = coaching_chat_body(text)
+    
+    # キャッシュキーは非ストリーミングと共通（同じ回答を共有）
+    key = coaching_cache_key(body)
+    if use_cache and settings.OPENAI_CACHE_ENABLED:
+        cached = await completion_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
     
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        r = await client.post("https://api.openai.com/v1/chat/completions", headers=headers, json=body)
-        r.raise_for_status()
-        data = r.json()
-        return data["choices"][0]["message"]["content"]
+    parts = []
+    client = get_http_client("openai")
+    async with client.stream("POST", f"{settings.OPENAI_BASE_URL}/chat/completions", headers=_headers(), json={**body, "stream": True}) as r:
+        if r.is_error:
+            await r.aread()
+            r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            choices = chunk.get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                parts.append(delta)
+                yield delta
+    
+    if parts and settings.OPENAI_CACHE_ENABLED:
+        await completion_cache.put(key, "".join(parts), body["model"])
+
+async def openai_upload_batch_file(jsonl: bytes, filename: str = "batch.jsonl") -> str:
+    """Batch API 用 JSONL をアップロードし file_id を返す"""
+    client = get_http_client("openai")
+    r = await client.post(
+        f"{settings.OPENAI_BASE_URL}/files",
+        headers={"Authorization": f"Bearer {settings.OPENAI_API_KEY}"},
+        data={"purpose": "batch"},
+        files={"file": (filename, jsonl, "application/jsonl")},
+    )
+    r.raise_for_status()
+    return r.json()["id"]
 
-async def vision_extract_meal_bytes(data: bytes, mime: str | None) -> str:
+async def openai_create_batch(input_file_id: str, metadata: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Chat Completions の Batch を作成"""
+    client = get_http_client("openai")
+    r = await client.post(f"{settings.OPENAI_BASE_URL}/batches", headers=_headers(), json={
+        "input_file_id": input_file_id,
+        "endpoint": "/v1/chat/completions",
+        "completion_window": "24h",
+        "metadata": metadata or {},
+    })
+    r.raise_for_status()
+    return r.json()
+
+async def openai_get_batch(batch_id: str) -> Dict[str, Any]:
+    """Batch の状態を取得"""
+    client = get_http_client("openai")
+    r = await client.get(f"{settings.OPENAI_BASE_URL}/batches/{batch_id}", headers=_headers())
+    r.raise_for_status()
+    return r.json()
+
+async def openai_file_content(file_id: str) -> str:
+    """ファイル（Batch 出力 JSONL 等）の中身を取得"""
+    client = get_http_client("openai")
+    r = await client.get(f"{settings.OPENAI_BASE_URL}/files/{file_id}/content", headers=_headers())
+    r.raise_for_status()
+    return r.text
+
+async def vision_extract_meal_bytes(data: bytes, mime: str | None, detail: str = "auto") -> str:
     """画像バイナリを base64 で直接 OpenAI に渡して食事内容を短く要約"""
     if not settings.OPENAI_API_KEY:
         return "（OPENAI_API_KEY が未設定です）"
     
-    headers = {
-        "Authorization": f"Bearer {settings.OPENAI_API_KEY}", 
-        "Content-Type": "application/json"
-    }
     instruction = (
         "この食事写真を短い日本語テキストで説明してください。"
         "料理名・主な食材・推定量を簡潔に。可能なら大まかなカロリーも一言で。"
@@ -61,7 +160,8 @@ async def vision_extract_meal_bytes(data: bytes, mime: str | None) -> str:
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:{mime or 'image/jpeg'};base64,{b64}"
+                            "url": f"data:{mime or 'image/jpeg'};base64,{b64}",
+                            "detail": detail
                         }
                     }
                 ]
@@ -71,8 +171,8 @@ async def vision_extract_meal_bytes(data: bytes, mime: str | None) -> str:
         "temperature": 0.3
     }
     
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        r = await client.post("https://api.openai.com/v1/chat/completions", headers=headers, json=body)
-        r.raise_for_status()
-        j = r.json()
-        return j["choices"][0]["message"]["content"]
+    client = get_http_client("openai")
+    r = await client.post(f"{settings.OPENAI_BASE_URL}/chat/completions", headers=_headers(), json=body)
+    r.raise_for_status()
+    j = r.json()
+    return j["choices"][0]["message"]["content"]
@@ -0,0 +1,38 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from app.config import settings
+
+class TokenCache:
+    """プロバイダ×ユーザー単位のアクセストークンキャッシュ（プロセス内）"""
+
+    def __init__(self):
+        self._items: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, user_id: str) -> Optional[str]:
+        """期限の TOKEN_CACHE_SKEW_SEC 秒前までは保持中のトークンを返す"""
+        with self._lock:
+            item = self._items.get((provider, user_id))
+            if not item:
+                return None
+            token, expires_at = item
+            if expires_at - settings.TOKEN_CACHE_SKEW_SEC <= time.time():
+                self._items.pop((provider, user_id), None)
+                return None
+            return token
+
+    def put(self, provider: str, user_id: str, token: str, expires_at: Optional[float] = None) -> None:
+        """expires_at（epoch秒）が不明なら TOKEN_CACHE_DEFAULT_TTL_SEC だけ保持"""
+        if not token:
+            return
+        if not expires_at:
+            expires_at = time.time() + settings.TOKEN_CACHE_DEFAULT_TTL_SEC + settings.TOKEN_CACHE_SKEW_SEC
+        with self._lock:
+            self._items[(provider, user_id)] = (token, float(expires_at))
+
+    def invalidate(self, provider: str, user_id: str) -> None:
+        with self._lock:
+            self._items.pop((provider, user_id), None)
+
+token_cache = TokenCache()
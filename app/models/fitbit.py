@@ -1,12 +1,99 @@
+import re
+from dataclasses import dataclass, asdict, field, fields, replace
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Dict, Any
+
+def to_int(x: Any, default: Optional[int] = 0) -> Optional[int]:
+    """Fitbit の数値（"1234" や 1234.0）を int にする。変換できなければ default"""
+    if x is None or x == "":
+        return default
+    try:
+        return int(float(x))
+    except (TypeError, ValueError):
+        return default
+
+def to_float(x: Any) -> Optional[float]:
+    if x is None or x == "":
+        return None
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return None
+
+# 旧形式（表示用文字列）のドキュメントを読むための正規表現
+_LEGACY_SLEEP_TOTAL = re.compile(r"総睡眠(\d+)分")
+_LEGACY_SLEEP_STAGE = {k: re.compile(rf"{label}:(\d+)") for k, label in
+                       (("deep", "深"), ("rem", "レム"), ("light", "浅"), ("wake", "覚醒"))}
+_LEGACY_SPO2_AVG = re.compile(r"平均([\d.]+)")
+
+@dataclass(frozen=True, slots=True)
+class FitbitDay:
+    """Fitbit の1日分（取り込み時に1回だけ数値化し、表示文字列はプロンプト生成時に作る）"""
+    date: str
+    steps_total: int = 0
+    calories_total: int = 0
+    sleep_minutes: Optional[int] = None
+    sleep_deep_min: Optional[int] = None
+    sleep_rem_min: Optional[int] = None
+    sleep_light_min: Optional[int] = None
+    sleep_wake_min: Optional[int] = None
+    spo2_avg: Optional[float] = None
+    spo2_min: Optional[float] = None
+    spo2_max: Optional[float] = None
+    # 全リソースの取得に成功したか（失敗した日は finalized にせず次回の同期で取り直す）。値ではないので BigQuery には出さない
+    complete: bool = field(default=True, compare=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = asdict(self)
+        d.pop("complete")
+        return d
+
+    def with_fields(self, **changes: Any) -> "FitbitDay":
+        return replace(self, **changes)
+
+    @property
+    def has_sleep_stages(self) -> bool:
+        return any(v for v in (self.sleep_deep_min, self.sleep_rem_min, self.sleep_light_min, self.sleep_wake_min))
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "FitbitDay":
+        """Firestore/アウトボックスの dict から生成。旧形式（sleep_line / spo2_line）も読める"""
+        day = {
+            "date": d["date"],
+            "complete": d.get("complete", True) is not False,
+            "steps_total": to_int(d.get("steps_total")),
+            "calories_total": to_int(d.get("calories_total")),
+        }
+        for f in ("sleep_minutes", "sleep_deep_min", "sleep_rem_min", "sleep_light_min", "sleep_wake_min"):
+            day[f] = to_int(d.get(f), None)
+        for f in ("spo2_avg", "spo2_min", "spo2_max"):
+            day[f] = to_float(d.get(f))
+
+        sleep_line = d.get("sleep_line") or ""
+        if day["sleep_minutes"] is None and (m := _LEGACY_SLEEP_TOTAL.search(sleep_line)):
+            day["sleep_minutes"] = int(m.group(1))
+            for k, rx in _LEGACY_SLEEP_STAGE.items():
+                if sm := rx.search(sleep_line):
+                    day[f"sleep_{k}_min"] = int(sm.group(1))
+        if day["spo2_avg"] is None and (m := _LEGACY_SPO2_AVG.search(d.get("spo2_line") or "")):
+            day["spo2_avg"] = float(m.group(1))
+        return cls(**day)
+
+# 変更検出・保存に使う値フィールド（date 以外）
+FITBIT_DAY_VALUE_FIELDS = tuple(f.name for f in fields(FitbitDay) if f.name not in ("date", "complete"))
 
 class FitbitDayData(BaseModel):
     date: str
-    steps_total: str
-    sleep_line: str
-    spo2_line: str
-    calories_total: str
+    steps_total: int = 0
+    calories_total: int = 0
+    sleep_minutes: Optional[int] = None
+    sleep_deep_min: Optional[int] = None
+    sleep_rem_min: Optional[int] = None
+    sleep_light_min: Optional[int] = None
+    sleep_wake_min: Optional[int] = None
+    spo2_avg: Optional[float] = None
+    spo2_min: Optional[float] = None
+    spo2_max: Optional[float] = None
 
 class FitbitSummary(BaseModel):
     steps_sum: int
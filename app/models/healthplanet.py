@@ -1,5 +1,62 @@
+from dataclasses import dataclass, asdict, fields
+from datetime import datetime
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
+from app.models.fitbit import to_int, to_float
+
+# innerscan のタグ → (列名, BigQuery 型)
+INNERSCAN_TAGS: Dict[str, Tuple[str, str]] = {
+    "6021": ("weight_kg", "FLOAT64"),              # 体重(kg)
+    "6022": ("body_fat_pct", "FLOAT64"),           # 体脂肪率(%)
+    "6023": ("muscle_mass_kg", "FLOAT64"),         # 筋肉量(kg)
+    "6024": ("muscle_score", "INT64"),             # 筋肉スコア
+    "6025": ("visceral_fat_level", "FLOAT64"),     # 内臓脂肪レベル（小数点付き）
+    "6026": ("visceral_fat_level", "FLOAT64"),     # 内臓脂肪レベル（整数。6025 がない機種用）
+    "6027": ("basal_metabolism_kcal", "INT64"),    # 基礎代謝量(kcal)
+    "6028": ("body_age", "INT64"),                 # 体内年齢(歳)
+    "6029": ("bone_mass_kg", "FLOAT64"),           # 推定骨量(kg)
+}
+
+@dataclass(frozen=True, slots=True)
+class BodyMeasurement:
+    """体組成計の1回分の測定（タグごとの縦持ちを測定時刻ごとの1行に展開したもの）"""
+    measured_at: str
+    weight_kg: Optional[float] = None
+    body_fat_pct: Optional[float] = None
+    muscle_mass_kg: Optional[float] = None
+    muscle_score: Optional[int] = None
+    visceral_fat_level: Optional[float] = None
+    basal_metabolism_kcal: Optional[int] = None
+    body_age: Optional[int] = None
+    bone_mass_kg: Optional[float] = None
+    model: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def pivot(cls, items: List[Dict[str, Any]]) -> List["BodyMeasurement"]:
+        """innerscan.json の data（1タグ1要素）を測定時刻ごとにまとめる（古い順）"""
+        by_ts: Dict[str, Dict[str, Any]] = {}
+        for item in items:
+            ts = item.get("date")  # "yyyymmddHHMMSS"
+            tag = INNERSCAN_TAGS.get(item.get("tag"))
+            value = item.get("keydata")
+            if not ts or not tag or value in (None, ""):
+                continue
+            row = by_ts.setdefault(ts, {"measured_at": datetime.strptime(ts, "%Y%m%d%H%M%S").isoformat()})
+            col, bq_type = tag
+            v = to_int(value, None) if bq_type == "INT64" else to_float(value)
+            # 内臓脂肪は小数点付き(6025)を優先
+            if col == "visceral_fat_level" and item.get("tag") == "6026" and row.get(col) is not None:
+                continue
+            row[col] = v
+            if item.get("model"):
+                row["model"] = item["model"]
+        return [cls(**by_ts[k]) for k in sorted(by_ts)]
+
+# 値の列（BigQuery のワイド行・移行 SQL で使う）
+BODY_VALUE_FIELDS = tuple(f.name for f in fields(BodyMeasurement) if f.name not in ("measured_at", "model"))
 
 class HealthPlanetData(BaseModel):
     measured_at: str
@@ -0,0 +1,70 @@
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse
+import numpy as np
+from app.services.analytics_service import (
+    METRICS, load_user_series, summarize_series, rolling_mean, ewma,
+    linear_trend, weekday_profile, correlations, analytics_prompt_block,
+)
+
+router = APIRouter(prefix="/analytics", tags=["analytics"])
+
+_METRIC_PATTERN = "^(" + "|".join(METRICS) + ")$"
+
+def _json_array(x: np.ndarray) -> list:
+    return [None if np.isnan(v) else round(float(v), 2) for v in x]
+
+@router.get("/summary")
+async def analytics_summary(user_id: str = "demo", days: int = Query(365, ge=7, le=3660)):
+    """トレンド要約（移動平均・EWMA・睡眠負債・カロリー収支・体重トレンド・曜日別・相関）"""
+    try:
+        summary = summarize_series(await load_user_series(user_id, days))
+        return {"ok": True, "summary": summary, "prompt_block": analytics_prompt_block(summary)}
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+@router.get("/rolling")
+async def analytics_rolling(user_id: str = "demo", metric: str = Query("steps", pattern=_METRIC_PATTERN),
+                            window: int = Query(7, ge=2, le=365), days: int = Query(90, ge=7, le=3660)):
+    """日次値・移動平均・EWMA の系列"""
+    try:
+        s = await load_user_series(user_id, days)
+        x = s.cols[metric]
+        return {
+            "ok": True,
+            "metric": metric,
+            "dates": [str(d) for d in s.dates],
+            "values": _json_array(x),
+            "rolling_mean": _json_array(rolling_mean(x, window)),
+            "ewma": _json_array(ewma(x, window)),
+        }
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+@router.get("/weight_trend")
+async def analytics_weight_trend(user_id: str = "demo", days: int = Query(90, ge=7, le=3660)):
+    """体重の線形回帰トレンド（kg/週）"""
+    try:
+        s = await load_user_series(user_id, days)
+        return {"ok": True, "days": days, "trend": linear_trend(s.cols["weight_kg"]),
+                "body_fat_trend": linear_trend(s.cols["body_fat_pct"])}
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+@router.get("/weekday")
+async def analytics_weekday(user_id: str = "demo", metric: str = Query("steps", pattern=_METRIC_PATTERN),
+                            days: int = Query(365, ge=7, le=3660)):
+    """曜日別平均"""
+    try:
+        s = await load_user_series(user_id, days)
+        return {"ok": True, "metric": metric, "profile": weekday_profile(s.cols[metric], s.weekdays())}
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+@router.get("/correlations")
+async def analytics_correlations(user_id: str = "demo", days: int = Query(365, ge=14, le=3660)):
+    """指標間の相関係数"""
+    try:
+        s = await load_user_series(user_id, days)
+        return {"ok": True, "days": days, "correlations": correlations(s.cols)}
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
@@ -1,27 +1,31 @@
 from fastapi import APIRouter
-from fastapi.responses import JSONResponse
-from app.services.coaching_service import daily_coaching, weekly_coaching, monthly_coaching, build_daily_prompt
-from app.external.openai_client import ask_gpt5
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+from app.services.coaching_service import (
+    daily_coaching, weekly_coaching, monthly_coaching, build_daily_prompt, prepare_weekly, push_weekly
+)
+from app.external.openai_client import ask_gpt5, ask_gpt5_stream
 from app.external.line_client import push_line
 from app.config import settings
 import httpx
+import json
 
 router = APIRouter(tags=["coaching"])
 
 @router.get("/now")
-async def coach_now():
+async def coach_now(nocache: bool = False):
     """今すぐコーチング"""
     # 循環インポートを避けるため、ここで import
     from app.services.fitbit_service import fitbit_today_core
     
     day = await fitbit_today_core()
     prompt = build_daily_prompt(day)
-    msg = await ask_gpt5(prompt)
+    msg = await ask_gpt5(prompt, use_cache=not nocache)
     res = push_line(f"📣 今日のコーチング\n{msg}")
     return {"sent": res, "model": settings.OPENAI_MODEL, "preview": msg}
 
 @router.get("/now_debug")
-async def coach_now_debug():
+async def coach_now_debug(nocache: bool = False):
     """デバッグ用コーチング"""
     try:
         # 循環インポートを避けるため、ここで import
@@ -29,7 +33,7 @@ async def coach_now_debug():
         
         day = await fitbit_today_core()
         prompt = build_daily_prompt(day)
-        out = await ask_gpt5(prompt)
+        out = await ask_gpt5(prompt, use_cache=not nocache)
         return {"ok": True, "preview": out, "model": settings.OPENAI_MODEL}
     except httpx.HTTPStatusError as e:
         return JSONResponse({"ok": False, "status": e.response.status_code, "body": e.response.text[:1200]}, status_code=500)
@@ -37,10 +41,10 @@ async def coach_now_debug():
         return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
 
 @router.get("/weekly")
-async def coach_weekly(dry: bool = False, show_prompt: bool = False):
+async def coach_weekly(dry: bool = False, show_prompt: bool = False, nocache: bool = False):
     """週次コーチング"""
     try:
-        result = await weekly_coaching(dry, show_prompt)
+        result = await weekly_coaching(dry, show_prompt, use_cache=not nocache)
         return result
     except Exception as e:
         return JSONResponse({"ok": False, "where": "coach_weekly", "error": repr(e)}, status_code=500)
@@ -53,3 +57,79 @@ async def coach_monthly():
         return result
     except Exception as e:
         return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Server-Sent Events の1イベントを整形"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _sse_response(
+    prepare: Callable[[], Awaitable[str]],
+    use_cache: bool,
+    on_done: Optional[Callable[[str], Awaitable[Dict[str, Any]]]] = None,
+) -> StreamingResponse:
+    """プロンプト準備→トークン転送→完了後処理（LINE送信等）を SSE で返す"""
+    async def gen() -> AsyncIterator[str]:
+        yield _sse("status", {"stage": "preparing"})
+        parts = []
+        try:
+            prompt = await prepare()
+            yield _sse("status", {"stage": "generating", "model": settings.OPENAI_MODEL})
+            async for delta in ask_gpt5_stream(prompt, use_cache=use_cache):
+                parts.append(delta)
+                yield _sse("token", {"text": delta})
+        except httpx.HTTPStatusError as e:
+            yield _sse("error", {"ok": False, "status": e.response.status_code, "body": e.response.text[:1200]})
+            return
+        except Exception as e:
+            yield _sse("error", {"ok": False, "error": repr(e)})
+            return
+
+        msg = "".join(parts)
+        done: Dict[str, Any] = {}
+        if on_done:
+            try:
+                done = await on_done(msg)
+            except Exception as e:
+                done = {"after_error": repr(e)}
+        yield _sse("done", {"ok": True, "model": settings.OPENAI_MODEL, "length": len(msg), **done})
+
+    return StreamingResponse(
+        gen(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def _daily_prompt() -> str:
+    # 循環インポートを避けるため、ここで import
+    from app.services.fitbit_service import fitbit_today_core
+    return build_daily_prompt(await fitbit_today_core())
+
+@router.get("/now/stream")
+async def coach_now_stream(nocache: bool = False):
+    """今すぐコーチング（SSE。生成完了後にLINE送信）"""
+    async def after(msg: str) -> Dict[str, Any]:
+        return {"sent": push_line(f"📣 今日のコーチング\n{msg}")}
+    return _sse_response(_daily_prompt, not nocache, after)
+
+@router.get("/now_debug/stream")
+async def coach_now_debug_stream(nocache: bool = False):
+    """デバッグ用コーチング（SSE。LINE送信なし）"""
+    return _sse_response(_daily_prompt, not nocache)
+
+@router.get("/weekly/stream")
+async def coach_weekly_stream(nocache: bool = False):
+    """週次コーチング（SSE。生成完了後にLINE送信）"""
+    ctx: Dict[str, Any] = {}
+
+    async def prepare() -> str:
+        ctx.update(await prepare_weekly("demo"))
+        return ctx["prompt"]
+
+    async def after(msg: str) -> Dict[str, Any]:
+        return {
+            "sent": await push_weekly(msg, "demo"),
+            "saved_count": len(ctx.get("saved", [])),
+            "profile_used": ctx.get("profile_used", False),
+        }
+
+    return _sse_response(prepare, not nocache, after)
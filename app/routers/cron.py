@@ -1,14 +1,88 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
 from fastapi.responses import JSONResponse
-from app.services.coaching_service import daily_coaching
+from app.services.coaching_service import daily_coaching, weekly_coaching, monthly_coaching
+from app.services.batch_service import run_coaching_batch
+from app.database.firestore import fs_run
+from app.database.outbox import drain_outbox_once
+from app.database.rollup import bq_rebuild_rollups
+from app.services.fitbit_backfill_service import run_fitbit_backfill
+from app.services.coaching_batch_service import submit_coaching_batch, poll_coaching_batch, poll_open_batches
 
 router = APIRouter(tags=["cron"])
 
+async def _run(kind: str, user_id: str | None, shard: int, of: int):
+    """user_id 指定時は単一ユーザー、未指定時は全ユーザー（シャード）をバッチ実行"""
+    try:
+        if user_id:
+            if kind == "daily":
+                return await daily_coaching(user_id)
+            if kind == "weekly":
+                return await weekly_coaching(user_id=user_id)
+            return await monthly_coaching(user_id)
+        return await run_coaching_batch(kind, shard=shard, of=of)
+    except ValueError as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
 @router.get("/daily")
-async def cron_daily():
+async def cron_daily(user_id: str | None = None, shard: int = Query(0, ge=0), of: int = Query(1, ge=1)):
     """日次バッチ処理（クーロン用）"""
+    return await _run("daily", user_id, shard, of)
+
+@router.get("/weekly")
+async def cron_weekly(user_id: str | None = None, shard: int = Query(0, ge=0), of: int = Query(1, ge=1)):
+    """週次バッチ処理（クーロン用）"""
+    return await _run("weekly", user_id, shard, of)
+
+@router.get("/monthly")
+async def cron_monthly(user_id: str | None = None, shard: int = Query(0, ge=0), of: int = Query(1, ge=1)):
+    """月次バッチ処理（クーロン用）"""
+    return await _run("monthly", user_id, shard, of)
+
+@router.get("/outbox")
+async def cron_outbox(limit: int = Query(500, ge=1, le=5000)):
+    """BigQueryアウトボックスを即時ドレイン（CPUがスロットルされる環境向け）"""
+    try:
+        return await fs_run(drain_outbox_once, limit)
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+@router.get("/fitbit_backfill")
+async def cron_fitbit_backfill(user_id: str | None = None, shard: int = Query(0, ge=0), of: int = Query(1, ge=1)):
+    """Fitbit 履歴バックフィルをチェックポイントから進める（未登録・完了済みユーザーは即スキップ）"""
+    try:
+        if user_id:
+            return await run_fitbit_backfill(user_id)
+        return await run_coaching_batch("fitbit_backfill", shard=shard, of=of)
+    except ValueError as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+@router.post("/rollup/rebuild")
+async def cron_rollup_rebuild(user_id: str = "demo", days: int = Query(400, ge=1, le=3660)):
+    """日次/月次集計テーブルを既存データから再計算（導入時の初回投入用）"""
+    try:
+        return await fs_run(bq_rebuild_rollups, user_id, days)
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+@router.post("/batch/submit")
+async def cron_batch_submit(kind: str = Query(..., pattern="^(weekly|monthly)$"),
+                            shard: int = Query(0, ge=0), of: int = Query(1, ge=1)):
+    """週次/月次コーチングを OpenAI Batch API にまとめて投入"""
+    try:
+        return await submit_coaching_batch(kind, shard=shard, of=of)
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+@router.get("/batch/poll")
+async def cron_batch_poll(batch_id: str | None = None):
+    """Batch の完了確認と結果配信（batch_id 未指定なら未完了分すべて）"""
     try:
-        result = await daily_coaching()
-        return result
+        if batch_id:
+            return await poll_coaching_batch(batch_id)
+        return await poll_open_batches()
     except Exception as e:
         return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
@@ -2,9 +2,13 @@ from fastapi import APIRouter
 from fastapi.responses import JSONResponse
 from app.config import settings
 from app.external.openai_client import ask_gpt5
-from app.database.firestore import user_doc
+from app.database.firestore import db, user_doc
+from app.external.http_client import get_http_client
+from app.database.row_keys import recent_rows
+from app.database.outbox import outbox_stats
+from app.external.completion_cache import completion_cache
+from app.database.schema import apply_schema, scan_report
 from datetime import datetime, timezone
-import httpx
 import json
 
 router = APIRouter(tags=["debug"])
@@ -44,8 +48,8 @@ async def debug_openai_ping():
         "max_tokens": 10
     }
     
-    async with httpx.AsyncClient(timeout=30) as c:
-        r = await c.post("https://api.openai.com/v1/chat/completions", headers=headers, json=body)
+    client = get_http_client("openai")
+    r = await client.post(f"{settings.OPENAI_BASE_URL}/chat/completions", headers=headers, json=body, timeout=30)
     
     ct = r.headers.get("content-type", "").lower()
     if "application/json" in ct:
@@ -63,6 +67,31 @@ async def debug_openai_ping():
         "body": body_text[:1200],
     }
 
+@router.get("/openai_cache")
+def debug_openai_cache():
+    """OpenAI応答キャッシュのヒット/ミス統計"""
+    return completion_cache.snapshot()
+
+@router.get("/outbox")
+def debug_outbox():
+    """BigQueryアウトボックスの滞留状況"""
+    return {**outbox_stats(), "recently_seen": recent_rows.snapshot()}
+
+@router.get("/bq_layout")
+def debug_bq_layout():
+    """BigQuery テーブルのレイアウト差分（変更はしない）"""
+    return apply_schema(apply=False)
+
+@router.get("/bq_scan")
+def debug_bq_scan(user_id: str = "demo"):
+    """代表クエリのスキャンバイト数（現在値）と、直近マイグレーション前後の記録"""
+    snap = db.collection("system").document("bq_schema").get()
+    last = snap.to_dict() if snap.exists else None
+    return {
+        "current": scan_report(user_id),
+        "last_migration": last,
+    }
+
 @router.get("/test/firestore")
 def test_firestore():
     """Firestore接続テスト"""
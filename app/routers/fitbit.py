@@ -1,11 +1,13 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request, Response
 from fastapi.responses import RedirectResponse, JSONResponse
-from app.external.fitbit_client import get_redirect_uri, fitbit_exchange_code, get_fitbit_access_token
-from app.services.fitbit_service import fitbit_today_core, fitbit_last_n_days, save_fitbit_daily_firestore, save_last7_fitbit_to_stores
-from app.database.firestore import fitbit_token_doc
+from app.external.fitbit_client import get_redirect_uri, fitbit_exchange_code, get_fitbit_access_token, get_rate_budget
+from app.services.fitbit_service import fitbit_today_core, fitbit_last_n_days, save_fitbit_days_with_outbox, save_last7_fitbit_to_stores
+from app.database.firestore import fitbit_token_doc, fs_set
 from app.external.line_client import push_line
+from app.external.token_cache import token_cache
+from app.services.fitbit_webhook_service import fitbit_webhook_worker, verify_signature, create_subscription
+from app.services.fitbit_backfill_service import start_fitbit_backfill, run_fitbit_backfill, fitbit_backfill_status
 from app.config import settings
-from app.database.bigquery import bq_insert_rows
 from datetime import datetime, timezone
 import urllib.parse
 import httpx
@@ -41,7 +43,7 @@ async def auth_fitbit(code: str = "", state: str = ""):
         now = int(datetime.now(timezone.utc).timestamp())
         expires_at = now + int(token.get("expires_in", 3600))
         
-        fitbit_token_doc("demo").set({
+        await fs_set(fitbit_token_doc("demo"), {
             "access_token": token["access_token"],
             "refresh_token": token.get("refresh_token"),
             "token_type": token.get("token_type", "Bearer"),
@@ -50,6 +52,12 @@ async def auth_fitbit(code: str = "", state: str = ""):
             "expires_at": expires_at,
             "updated_at": datetime.now(timezone.utc).isoformat(),
         })
+        token_cache.invalidate("fitbit", "demo")
+        # 新規連携ユーザーは過去分のバックフィルを登録（cron /fitbit_backfill で進む）
+        try:
+            await start_fitbit_backfill("demo")
+        except Exception as e:
+            print(f"[WARN] fitbit backfill registration failed: {e}")
         
         push_line("✅ Fitbit連携が完了しました")
         return RedirectResponse(url="/")
@@ -67,36 +75,15 @@ async def fitbit_today():
 async def fitbit_last7():
     """過去7日間のFitbitデータ取得"""
     data = await fitbit_last_n_days(7)
-
-    def to_int(x: str) -> int:
-        try:
-            return int(float(x))
-        except Exception:
-            return 0
-
-    steps_sum = sum(to_int(d["steps_total"]) for d in data)
-    calories_sum = sum(to_int(d["calories_total"]) for d in data)
+    steps_sum = sum(d.steps_total for d in data)
+    calories_sum = sum(d.calories_total for d in data)
     return {"days": data, "summary": {"steps_sum": steps_sum, "calories_sum": calories_sum, "count": len(data)}}
 
 @router.post("/save/today")
 async def fitbit_save_today():
     """今日のFitbitデータを保存"""
     day = await fitbit_today_core()
-    saved = save_fitbit_daily_firestore("demo", day)
-    
-    try:
-        bq_insert_rows(settings.BQ_TABLE_FITBIT, [{
-            "user_id": "demo",
-            "date": saved["date"],
-            "steps_total": saved["steps_total"],
-            "sleep_line": saved["sleep_line"],
-            "spo2_line": saved["spo2_line"],
-            "calories_total": saved["calories_total"],
-            "ingested_at": datetime.now(timezone.utc).isoformat(),
-        }])
-    except Exception as e:
-        print(f"[WARN] BQ insert (fitbit_save_today) failed: {e}")
-    
+    saved = (await save_fitbit_days_with_outbox("demo", [day]))[0]
     return {"ok": True, "saved": saved}
 
 @router.post("/save/last7")
@@ -107,3 +94,65 @@ async def fitbit_save_last7():
         return {"ok": True, **res}
     except Exception as e:
         return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+@router.post("/backfill/start")
+async def fitbit_backfill_start(user_id: str = "demo", days: int | None = None, reset: bool = False):
+    """過去分バックフィルを登録（reset=true でやり直し）"""
+    try:
+        return await start_fitbit_backfill(user_id, days, reset)
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+@router.post("/backfill/run")
+async def fitbit_backfill_run(user_id: str = "demo"):
+    """バックフィルを今すぐ1回分進める"""
+    try:
+        return await run_fitbit_backfill(user_id)
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
+
+@router.get("/backfill/status")
+async def fitbit_backfill_get_status(user_id: str = "demo"):
+    """バックフィルの進捗（日数・days/min・レート予算）"""
+    return await fitbit_backfill_status(user_id)
+
+@router.get("/rate_limit")
+def fitbit_rate_limit(user_id: str = "demo"):
+    """Fitbit APIの残りレート予算を確認"""
+    return {"ok": True, **get_rate_budget(user_id).snapshot()}
+
+@router.get("/webhook")
+def fitbit_webhook_verify(verify: str = ""):
+    """Subscription API のサブスクライバー検証（正しいコードなら204、それ以外は404）"""
+    if settings.FITBIT_SUBSCRIBER_VERIFY_CODE and verify == settings.FITBIT_SUBSCRIBER_VERIFY_CODE:
+        return Response(status_code=204)
+    return Response(status_code=404)
+
+@router.post("/webhook")
+async def fitbit_webhook(request: Request):
+    """Subscription API 通知の受信（署名検証後すぐ204を返し、取得はワーカーで行う）"""
+    body = await request.body()
+    if not verify_signature(body, request.headers.get("x-fitbit-signature")):
+        return Response(status_code=404)
+    try:
+        notifications = await request.json()
+    except Exception:
+        return Response(status_code=400)
+    if isinstance(notifications, list):
+        fitbit_webhook_worker.submit(notifications)
+    return Response(status_code=204)
+
+@router.get("/webhook/stats")
+def fitbit_webhook_stats():
+    """Webhook ワーカーの処理状況"""
+    return {"ok": True, **fitbit_webhook_worker.snapshot()}
+
+@router.post("/subscribe")
+async def fitbit_subscribe(user_id: str = "demo", collection: str | None = None):
+    """Fitbit Subscription API への購読登録"""
+    try:
+        return {"ok": True, "subscription": await create_subscription(user_id, collection)}
+    except httpx.HTTPStatusError as e:
+        return JSONResponse({"ok": False, "status": e.response.status_code, "body": e.response.text[:1200]}, status_code=500)
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": repr(e)}, status_code=500)
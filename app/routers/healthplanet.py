@@ -3,12 +3,16 @@ from fastapi.responses import RedirectResponse, JSONResponse, HTMLResponse
 from app.external.healthplanet_client import (
     get_oauth_url, exchange_code_for_token, is_env_configured, jst_now
 )
-from app.database.firestore import healthplanet_token_doc  # 修正: 正しいインポート
+from app.database.firestore import healthplanet_token_doc, fs_set  # 修正: 正しいインポート
 from app.services.healthplanet_service import (
     fetch_last7_data, parse_innerscan_for_prompt, 
-    summarize_for_prompt, save_to_bigquery
+    summarize_for_prompt, save_to_bigquery,
+    import_healthplanet_history, healthplanet_import_status
 )
 from app.config import settings
+from app.external.token_cache import token_cache
+import time
+from datetime import date
 
 router = APIRouter(prefix="/healthplanet", tags=["healthplanet"])
 
@@ -58,15 +62,18 @@ async def _exchange_and_store(code: str):
 
     try:
         token = await exchange_code_for_token(code)
+        expires_in = token.get("expires_in")
         
         # Firestore保存
-        healthplanet_token_doc("demo").set({
+        await fs_set(healthplanet_token_doc("demo"), {
             "access_token": token.get("access_token"),
             "token_type": token.get("token_type", "Bearer"),
             "scope": settings.HEALTHPLANET_SCOPE,
             "raw": token,
+            "expires_at": int(time.time()) + int(expires_in) if expires_in else None,
             "updated_at": jst_now().isoformat(),
         })
+        token_cache.invalidate("healthplanet", "demo")
         
         return RedirectResponse(url="/healthplanet/status")
     
@@ -112,6 +119,22 @@ async def innerscan_last7_save_bq(user_id: str = "demo"):
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
+@router.post("/innerscan/import")
+async def innerscan_import(user_id: str = "demo", start: date | None = None, end: date | None = None, reset: bool = False):
+    """体組成履歴の一括インポート（start 省略時はチェックポイントから再開）"""
+    try:
+        result = await import_healthplanet_history(user_id, start, end, reset)
+        if not result["ok"]:
+            return JSONResponse(result, status_code=500)
+        return result
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+
+@router.get("/innerscan/import/status")
+async def innerscan_import_status(user_id: str = "demo"):
+    """履歴インポートの進捗"""
+    return await healthplanet_import_status(user_id)
+
 @router.get("/status")
 def status():
     """Health Planet連携状況確認"""
@@ -124,6 +147,8 @@ def status():
             "last7": "/healthplanet/innerscan/last7",
             "last7_prompt": "/healthplanet/innerscan/last7/prompt",
             "last7_save_bq": "/healthplanet/innerscan/last7/save_bq (POST)",
+            "import": "/healthplanet/innerscan/import (POST)",
+            "import_status": "/healthplanet/innerscan/import/status",
         },
-        "bq": {"table": settings.HP_BQ_TABLE, "location": settings.BQ_LOCATION},
+        "bq": {"table": settings.HP_BQ_TABLE_BODY, "legacy_table": settings.HP_BQ_TABLE, "location": settings.BQ_LOCATION},
     }
@@ -3,13 +3,15 @@ from fastapi.responses import JSONResponse
 from datetime import datetime, timezone
 from app.models.profile import ProfileIn
 from app.models.meal import MealIn
-from app.services.meal_service import save_meal_to_stores, to_when_date_str  # 修正: インポート追加
+from app.services.meal_service import save_meal_to_stores, to_when_date_str, find_similar_meal  # 修正: インポート追加
 from app.external.openai_client import vision_extract_meal_bytes
-from app.database.firestore import user_doc, get_latest_profile
-from app.database.bigquery import bq_upsert_profile
+from app.database.firestore import user_doc, get_latest_profile, fs_run
+from app.database.outbox import commit_with_outbox, outbox_result
 from app.config import settings
 from app.utils.auth_utils import require_token
-import base64
+from app.utils.image_utils import read_upload_limited, prepare_image_for_vision
+import asyncio
+import time
 
 router = APIRouter(prefix="/ui", tags=["ui"])
 
@@ -52,17 +54,13 @@ def ui_profile(body: ProfileIn, x_api_token: str | None = Header(None, alias="x-
             pass
 
     payload["updated_at"] = datetime.now(timezone.utc).isoformat()
-    doc.set(payload, merge=True)
-    
-    try:
-        bq_res = bq_upsert_profile("demo")
-        if not bq_res.get("ok"):
-            print(f"[ERROR] bq_upsert_profile failed: {bq_res}")
-    except Exception as e:
-        print(f"[ERROR] bq_upsert_profile exception: {e}")
-        bq_res = {"ok": False, "reason": repr(e)}
+    # プロフィール保存とBigQuery反映項目を同一バッチでコミット
+    commit_with_outbox(
+        [(doc, payload, True)],
+        [("profile-demo", "profile_upsert", {"user_id": "demo"})],
+    )
 
-    return {"ok": True, "bq": bq_res}
+    return {"ok": True, "bq": outbox_result()}
 
 @router.get("/profile_latest")
 def ui_profile_latest(x_api_token: str | None = Header(None, alias="x-api-token")):
@@ -90,11 +88,12 @@ async def ui_meal_image_no_store(
     when: str | None = Form(None),
     file: UploadFile = File(...),
     dry: bool = Query(False),
+    nodedupe: bool = Query(False),
 ):
     """画像食事記録"""
     require_token(x_api_token)
 
-    data: bytes = await file.read()
+    data: bytes = await read_upload_limited(file, settings.MEAL_IMAGE_MAX_BYTES)
     mime = file.content_type or "image/png"
 
     if dry:
@@ -109,26 +108,55 @@ async def ui_meal_image_no_store(
     if not settings.OPENAI_API_KEY:
         return JSONResponse({"ok": False, "error": "OPENAI_API_KEY not set"}, status_code=500)
 
-    # 画像→OpenAI
-    try:
-        text = await vision_extract_meal_bytes(data, mime)
-    except Exception as e:
-        return JSONResponse({"ok": False, "where": "openai", "error": repr(e)}, status_code=500)
-    
+    # 画像→縮小・再エンコード→OpenAI
+    sent, sent_mime, detail, image_stats = await asyncio.to_thread(prepare_image_for_vision, data, mime)
+    del data
+
+    # 同じ/ほぼ同じ写真の再アップロードなら前回の解析結果を再利用
+    dhash = image_stats.get("dhash")
+    similar = None
+    if dhash and settings.MEAL_DEDUPE_ENABLED and not nodedupe:
+        try:
+            similar = await find_similar_meal(dhash, "demo")
+        except Exception as e:
+            print(f"[WARN] meal dedupe lookup failed: {e!r}")
+
+    if similar:
+        text = similar["text"]
+        image_stats["dedupe_of"] = similar["meal_id"]
+        image_stats["dedupe_distance"] = similar["distance"]
+    else:
+        try:
+            t0 = time.perf_counter()
+            text = await vision_extract_meal_bytes(sent, sent_mime, detail)
+            image_stats["vision_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        except Exception as e:
+            return JSONResponse({"ok": False, "where": "openai", "error": repr(e)}, status_code=500)
+    print(f"[INFO] meal_image stats: {image_stats}")
+
+    when_iso = when or datetime.now(timezone.utc).isoformat(timespec="seconds")
+    if similar and similar.get("when_date") == to_when_date_str(when_iso):
+        # 同じ日の再送（タイムアウト後のリトライ等）は記録済みの食事を返し、二重に記録しない
+        return {"ok": True, "preview": text, "image": image_stats,
+                "meal_id": similar["meal_id"], "duplicate": True}
+
     try:
-        when_iso = when or datetime.now(timezone.utc).isoformat(timespec="seconds")
         payload = {
             "when": when_iso,
             "when_date": to_when_date_str(when_iso),
             "text": text,
             "created_at": datetime.now(timezone.utc).isoformat(),
-            "source": "image-bytes+gpt",
+            "source": "image-bytes+dedupe" if similar else "image-bytes+gpt",
             "file_name": file.filename,
             "mime": mime,
         }
-        save_meal_to_stores(payload, "demo")
+        if dhash:
+            payload["dhash"] = dhash
+        if similar:
+            payload["dedupe_of"] = similar["meal_id"]
+        saved = await fs_run(save_meal_to_stores, payload, "demo")
     except Exception as e:
         return JSONResponse({"ok": False, "where": "firestore", "error": repr(e),
                              "preview": text}, status_code=500)
     
-    return {"ok": True, "preview": text}
+    return {"ok": True, "preview": text, "image": image_stats, "meal_id": saved["meal_id"]}
@@ -0,0 +1,261 @@
+import asyncio
+import numpy as np
+from datetime import datetime, date, timezone, timedelta
+from typing import List, Dict, Any, Optional
+from google.cloud import bigquery
+from app.database.bigquery import bq_client
+from app.database.schema import get_spec
+from app.config import settings
+
+# 系列名 → 表示名
+METRICS = {
+    "steps": "歩数",
+    "calories_out": "消費カロリー",
+    "calories_in": "摂取カロリー",
+    "sleep_min": "睡眠(分)",
+    "weight_kg": "体重(kg)",
+    "body_fat_pct": "体脂肪率(%)",
+}
+
+WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+
+class UserSeries:
+    """ユーザーの日次系列（列指向）。欠損日は NaN、dates は連続した日付"""
+
+    def __init__(self, start: date, n: int):
+        self.start = start
+        self.dates = np.arange(np.datetime64(start, "D"), np.datetime64(start, "D") + n)
+        self.cols: Dict[str, np.ndarray] = {k: np.full(n, np.nan) for k in METRICS}
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def put(self, metric: str, d: date, value: Any) -> None:
+        i = (d - self.start).days
+        if 0 <= i < len(self) and value is not None:
+            self.cols[metric][i] = float(value)
+
+    def weekdays(self) -> np.ndarray:
+        # 1970-01-01 は木曜（月=0 に合わせる）
+        return (self.dates.astype("int64") + 3) % 7
+
+# ---- 集計カーネル（NaN を欠損として扱う） ----
+
+def rolling_mean(x: np.ndarray, window: int, min_periods: Optional[int] = None) -> np.ndarray:
+    """後方窓の移動平均（累積和で O(n)）"""
+    min_periods = min_periods or max(1, window // 2)
+    valid = ~np.isnan(x)
+    csum = np.concatenate(([0.0], np.cumsum(np.where(valid, x, 0.0))))
+    ccnt = np.concatenate(([0], np.cumsum(valid)))
+    idx = np.arange(1, len(x) + 1)
+    lo = np.maximum(idx - window, 0)
+    s = csum[idx] - csum[lo]
+    c = ccnt[idx] - ccnt[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = s / c
+    out[c < min_periods] = np.nan
+    return out
+
+def ewma(x: np.ndarray, span: int) -> np.ndarray:
+    """指数加重移動平均（欠損日は前値を維持）"""
+    alpha = 2.0 / (span + 1.0)
+    out = np.empty_like(x)
+    acc = np.nan
+    for i, v in enumerate(x):
+        if not np.isnan(v):
+            acc = v if np.isnan(acc) else acc + alpha * (v - acc)
+        out[i] = acc
+    return out
+
+def linear_trend(x: np.ndarray) -> Optional[Dict[str, float]]:
+    """日次系列の最小二乗直線。slope は1日あたり"""
+    t = np.flatnonzero(~np.isnan(x))
+    if len(t) < 3:
+        return None
+    y = x[t]
+    A = np.vstack([t, np.ones_like(t)]).T.astype(float)
+    (slope, intercept), *_ = np.linalg.lstsq(A, y, rcond=None)
+    pred = A @ np.array([slope, intercept])
+    ss_tot = float(np.sum((y - y.mean()) ** 2))
+    r2 = 1.0 - float(np.sum((y - pred) ** 2)) / ss_tot if ss_tot > 0 else 0.0
+    return {
+        "slope_per_day": float(slope),
+        "slope_per_week": float(slope * 7),
+        "r2": r2,
+        "n": int(len(t)),
+        "fitted_last": float(slope * (len(x) - 1) + intercept),
+    }
+
+def weekday_profile(x: np.ndarray, weekdays: np.ndarray) -> Dict[str, Optional[float]]:
+    """曜日別の平均（月〜日）"""
+    valid = ~np.isnan(x)
+    sums = np.bincount(weekdays[valid], weights=x[valid], minlength=7)
+    cnts = np.bincount(weekdays[valid], minlength=7)
+    return {WEEKDAYS[i]: (float(sums[i] / cnts[i]) if cnts[i] else None) for i in range(7)}
+
+def correlations(cols: Dict[str, np.ndarray], min_overlap: int = 10) -> Dict[str, float]:
+    """系列ペアごとのピアソン相関（両方そろった日のみ）"""
+    names = [k for k, v in cols.items() if np.count_nonzero(~np.isnan(v)) >= min_overlap]
+    out: Dict[str, float] = {}
+    for i, a in enumerate(names):
+        for b in names[i + 1:]:
+            m = ~np.isnan(cols[a]) & ~np.isnan(cols[b])
+            if np.count_nonzero(m) < min_overlap:
+                continue
+            xa, xb = cols[a][m], cols[b][m]
+            if xa.std() == 0 or xb.std() == 0:
+                continue
+            out[f"{a}~{b}"] = float(np.corrcoef(xa, xb)[0, 1])
+    return out
+
+def sleep_debt(sleep_min: np.ndarray, days: int = 14) -> Optional[float]:
+    """直近 days 日の睡眠負債（目標との差の合計、分）。記録のない日は数えない"""
+    recent = sleep_min[-days:]
+    recent = recent[~np.isnan(recent)]
+    if not len(recent):
+        return None
+    return float(np.sum(settings.SLEEP_TARGET_MIN - recent))
+
+def _last_valid(x: np.ndarray) -> Optional[float]:
+    idx = np.flatnonzero(~np.isnan(x))
+    return float(x[idx[-1]]) if len(idx) else None
+
+def _mean_tail(x: np.ndarray, n: int) -> Optional[float]:
+    tail = x[-n:]
+    tail = tail[~np.isnan(tail)]
+    return float(tail.mean()) if len(tail) else None
+
+def summarize_series(s: UserSeries) -> Dict[str, Any]:
+    """コーチングと /analytics/summary 用のコンパクトな数値要約"""
+    c = s.cols
+    balance = c["calories_in"] - c["calories_out"]
+    out: Dict[str, Any] = {"days": len(s), "start": str(s.dates[0]), "end": str(s.dates[-1])}
+    for k in ("steps", "calories_out", "calories_in", "sleep_min"):
+        out[k] = {
+            "avg7": _mean_tail(c[k], 7),
+            "avg28": _mean_tail(c[k], 28),
+            "ewma14": _last_valid(ewma(c[k], 14)),
+        }
+    out["sleep_debt_14d_min"] = sleep_debt(c["sleep_min"])
+    out["calorie_balance"] = {"avg7": _mean_tail(balance, 7), "avg28": _mean_tail(balance, 28)}
+    out["weight"] = {
+        "last": _last_valid(c["weight_kg"]),
+        "trend28": linear_trend(c["weight_kg"][-28:]),
+        "trend90": linear_trend(c["weight_kg"][-90:]),
+    }
+    out["weekday_steps"] = weekday_profile(c["steps"], s.weekdays())
+    out["correlations"] = correlations(c)
+    return out
+
+def analytics_prompt_block(summary: Dict[str, Any]) -> str:
+    """要約をプロンプト用の短い数値行にする"""
+    def f(v: Optional[float], fmt: str = "{:.0f}") -> str:
+        return fmt.format(v) if v is not None else "-"
+
+    lines = [
+        f"- 歩数: 7日平均 {f(summary['steps']['avg7'])} / 28日平均 {f(summary['steps']['avg28'])}",
+        f"- 睡眠: 7日平均 {f(summary['sleep_min']['avg7'])}分 / 14日の睡眠負債 {f(summary['sleep_debt_14d_min'])}分",
+        f"- カロリー収支(摂取-消費): 7日平均 {f(summary['calorie_balance']['avg7'])}kcal/日",
+    ]
+    trend = summary["weight"].get("trend28")
+    if trend:
+        lines.append(f"- 体重: 最新 {f(summary['weight']['last'], '{:.1f}')}kg、"
+                     f"28日トレンド {trend['slope_per_week']:+.2f}kg/週 (R²={trend['r2']:.2f})")
+    wd = {k: v for k, v in summary["weekday_steps"].items() if v is not None}
+    if wd:
+        lo, hi = min(wd, key=wd.get), max(wd, key=wd.get)
+        lines.append(f"- 曜日別歩数: 最多 {hi}曜 {f(wd[hi])} / 最少 {lo}曜 {f(wd[lo])}")
+    strong = sorted(summary["correlations"].items(), key=lambda kv: -abs(kv[1]))[:2]
+    for name, r in strong:
+        if abs(r) >= 0.3:
+            a, b = name.split("~")
+            lines.append(f"- 相関: {METRICS[a]} と {METRICS[b]} r={r:+.2f}")
+    return "[トレンド分析]\n" + "\n".join(lines)
+
+# ---- データ読み込み（BigQuery から列指向で） ----
+
+def _query(sql: str, params: List[Any]) -> List[Any]:
+    cfg = bigquery.QueryJobConfig(query_parameters=params)
+    return list(bq_client.query(sql, job_config=cfg).result())
+
+async def load_user_series(user_id: str = "demo", days: int = 365) -> UserSeries:
+    """BigQuery から直近 days 日の系列を読み込む（3クエリを並行実行）"""
+    today = datetime.now(timezone.utc).astimezone().date()
+    start = today - timedelta(days=days - 1)
+    s = UserSeries(start, days)
+    if not bq_client:
+        return s
+
+    params = [
+        bigquery.ScalarQueryParameter("user_id", "STRING", user_id),
+        bigquery.ScalarQueryParameter("start", "DATE", start),
+        bigquery.ScalarQueryParameter("end", "DATE", today),
+    ]
+    fitbit_sql = f"""
+    SELECT date, ARRAY_AGG(STRUCT(steps_total, calories_total,
+             COALESCE(sleep_minutes, SAFE_CAST(REGEXP_EXTRACT(sleep_line, r'総睡眠(\\d+)分') AS INT64)) AS sleep_min)
+           ORDER BY ingested_at DESC LIMIT 1)[OFFSET(0)] AS v
+    FROM `{get_spec(settings.BQ_TABLE_FITBIT).table_id}`
+    WHERE user_id=@user_id AND date BETWEEN @start AND @end
+    GROUP BY date
+    """
+    intake_sql = f"""
+    SELECT date, meal_kcal
+    FROM `{get_spec(settings.BQ_TABLE_DAILY_ROLLUP).table_id}`
+    WHERE user_id=@user_id AND date BETWEEN @start AND @end AND meal_kcal IS NOT NULL
+    """
+    body_range = "user_id=@user_id AND measured_at BETWEEN DATETIME(@start) AND DATETIME(DATE_ADD(@end, INTERVAL 1 DAY))"
+    body_sql = f"""
+    SELECT DATE(measured_at) AS date, AVG(weight_kg) AS weight_kg, AVG(body_fat_pct) AS body_fat_pct
+    FROM `{get_spec(settings.HP_BQ_TABLE_BODY).table_id}`
+    WHERE {body_range}
+    GROUP BY date
+    """
+    if settings.HP_LEGACY_READ:
+        # ワイド行への移行前は旧テーブル（縦持ち）も読み、同じ日はワイド行を優先
+        body_sql = f"""
+        WITH wide AS ({body_sql}),
+        legacy AS (
+            SELECT DATE(measured_at) AS date,
+                   AVG(IF(tag='6021', value, NULL)) AS weight_kg,
+                   AVG(IF(tag='6022', value, NULL)) AS body_fat_pct
+            FROM `{get_spec(settings.HP_BQ_TABLE).table_id}`
+            WHERE {body_range} AND tag IN ('6021', '6022')
+            GROUP BY date
+        )
+        SELECT date,
+               COALESCE(wide.weight_kg, legacy.weight_kg) AS weight_kg,
+               COALESCE(wide.body_fat_pct, legacy.body_fat_pct) AS body_fat_pct
+        FROM wide FULL OUTER JOIN legacy USING (date)
+        """
+    fitbit_rows, intake_rows, body_rows = await asyncio.gather(
+        asyncio.to_thread(_query, fitbit_sql, params),
+        asyncio.to_thread(_query, intake_sql, params),
+        asyncio.to_thread(_query, body_sql, params),
+        return_exceptions=True,
+    )
+    if isinstance(fitbit_rows, Exception):
+        raise fitbit_rows
+    for r in fitbit_rows:
+        s.put("steps", r["date"], r["v"]["steps_total"])
+        s.put("calories_out", r["date"], r["v"]["calories_total"])
+        s.put("sleep_min", r["date"], r["v"]["sleep_min"])
+    for rows, cols in ((intake_rows, {"calories_in": "meal_kcal"}),
+                       (body_rows, {"weight_kg": "weight_kg", "body_fat_pct": "body_fat_pct"})):
+        if isinstance(rows, Exception):
+            print(f"[WARN] analytics load partial failure: {rows!r}")
+            continue
+        for r in rows:
+            for metric, key in cols.items():
+                s.put(metric, r["date"], r[key])
+    return s
+
+async def analytics_prompt_for(user_id: str = "demo", days: int = 90) -> str:
+    """コーチングプロンプトに差し込むトレンド行（取得失敗時は空文字）"""
+    if not bq_client:
+        return ""
+    try:
+        return analytics_prompt_block(summarize_series(await load_user_series(user_id, days)))
+    except Exception as e:
+        print(f"[WARN] analytics for prompt failed: {e!r}")
+        return ""
@@ -0,0 +1,102 @@
+import asyncio
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Callable, Awaitable
+from app.database.firestore import db, list_user_ids, user_doc, fs_run
+from app.config import settings
+
+def in_shard(user_id: str, shard: int = 0, of: int = 1) -> bool:
+    """user_id が shard 番目（0始まり, 全 of 個）に属するか（安定ハッシュ）"""
+    if of <= 1:
+        return True
+    return zlib.crc32(user_id.encode("utf-8")) % of == shard
+
+def _coaching_runner(kind: str) -> Callable[[str], Awaitable[Dict[str, Any]]]:
+    """kind に対応するユーザー単位のコーチング関数を返す"""
+    from app.services.coaching_service import daily_coaching, weekly_coaching, monthly_coaching
+
+    if kind == "daily":
+        return lambda uid: daily_coaching(uid)
+    if kind == "weekly":
+        return lambda uid: weekly_coaching(user_id=uid)
+    if kind == "monthly":
+        return lambda uid: monthly_coaching(uid)
+    if kind == "fitbit_backfill":
+        from app.services.fitbit_backfill_service import run_fitbit_backfill
+        return lambda uid: run_fitbit_backfill(uid)
+    raise ValueError(f"unknown coaching kind: {kind}")
+
+async def run_coaching_batch(
+    kind: str,
+    shard: int = 0,
+    of: int = 1,
+    user_ids: List[str] | None = None,
+) -> Dict[str, Any]:
+    """
+    全ユーザー（またはシャード）に対してコーチングを並行実行する
+
+    - 同時実行数は CRON_CONCURRENCY、ユーザー単位のタイムアウトは CRON_USER_TIMEOUT_SEC
+    - CRON_DEADLINE_SEC を過ぎて未着手のユーザーは skipped として次回に回す
+    - ユーザーごとの結果は users/{uid}/cron_status/{kind}、全体は cron_runs/{run_id} に記録
+    """
+    if of < 1 or not (0 <= shard < of):
+        raise ValueError("shard must satisfy 0 <= shard < of")
+
+    runner = _coaching_runner(kind)
+    run_id = f"{kind}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{shard}of{of}-{uuid.uuid4().hex[:6]}"
+    started = time.monotonic()
+    deadline = started + settings.CRON_DEADLINE_SEC
+
+    ids = user_ids if user_ids is not None else await fs_run(list_user_ids)
+    targets = [uid for uid in ids if in_shard(uid, shard, of)]
+    sem = asyncio.Semaphore(max(1, settings.CRON_CONCURRENCY))
+
+    async def one(uid: str) -> Dict[str, Any]:
+        async with sem:
+            if time.monotonic() >= deadline:
+                return {"user_id": uid, "status": "skipped", "duration_ms": 0}
+            t0 = time.monotonic()
+            try:
+                res = await asyncio.wait_for(runner(uid), timeout=settings.CRON_USER_TIMEOUT_SEC)
+                status = "ok" if res.get("ok", True) else "error"
+                error = None if status == "ok" else str(res.get("error"))
+            except asyncio.TimeoutError:
+                status, error = "timeout", f"exceeded {settings.CRON_USER_TIMEOUT_SEC}s"
+            except Exception as e:
+                status, error = "error", repr(e)
+            out = {"user_id": uid, "status": status, "duration_ms": int((time.monotonic() - t0) * 1000)}
+            if error:
+                out["error"] = error[:500]
+            try:
+                await fs_run(
+                    user_doc(uid).collection("cron_status").document(kind).set,
+                    {**out, "run_id": run_id, "finished_at": datetime.now(timezone.utc).isoformat()},
+                )
+            except Exception as e:
+                print(f"[WARN] cron_status write failed ({uid}): {e}")
+            return out
+
+    results = await asyncio.gather(*(one(uid) for uid in targets))
+
+    counts: Dict[str, int] = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    summary = {
+        "run_id": run_id,
+        "kind": kind,
+        "shard": shard,
+        "of": of,
+        "users": len(targets),
+        "counts": counts,
+        "duration_ms": int((time.monotonic() - started) * 1000),
+        "failed": [r for r in results if r["status"] not in ("ok", "skipped")][:100],
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+    }
+    try:
+        await fs_run(db.collection("cron_runs").document(run_id).set, summary)
+    except Exception as e:
+        print(f"[WARN] cron_runs write failed: {e}")
+
+    return {"ok": not summary["failed"], **summary}
@@ -0,0 +1,223 @@
+import json
+import time
+from datetime import datetime, timezone
+from google.cloud import firestore
+from typing import List, Dict, Any, Optional
+from app.config import settings
+from app.database.firestore import db, fs_run, fs_get, fs_set, fs_stream, list_user_ids
+from app.external.openai_client import (
+    coaching_chat_body, coaching_cache_key, openai_upload_batch_file,
+    openai_create_batch, openai_get_batch, openai_file_content,
+)
+from app.external.completion_cache import completion_cache
+from app.services.batch_service import in_shard
+from app.services.coaching_service import (
+    prepare_weekly, push_weekly, prepare_monthly, finish_monthly, push_monthly_notice,
+)
+from app.utils.async_utils import gather_limited
+
+# Batch ジョブの記録（llm_batches/{batch_id}、ユーザー単位は items サブコレクション）
+BATCH_COLLECTION = "llm_batches"
+_TERMINAL_FAILED = ("failed", "expired", "cancelled")
+# 再試行しても届かない LINE 送信（送信先・設定なし）。これ以外の送信失敗は submitted に戻して再試行
+_PUSH_TERMINAL_REASONS = ("no line_user_id", "LINE secrets not set")
+
+class _PushFailed(Exception):
+    """LINE 送信が一時的に失敗した（結果の保存は済んでいる）"""
+
+def batch_doc(batch_id: str):
+    return db.collection(BATCH_COLLECTION).document(batch_id)
+
+@firestore.transactional
+def _claim_item(transaction, ref, now: float) -> bool:
+    """
+    配信前に submitted → delivering へ切り替えて項目を確保する（重なった poll が二重に LINE 送信しないように）
+
+    delivering のまま BATCH_DELIVERY_LEASE_SEC を過ぎた項目は、配信中に落ちたとみなして取り直す。
+    """
+    snap = ref.get(transaction=transaction)
+    d = snap.to_dict() or {}
+    status = d.get("status")
+    stale = status == "delivering" and now - float(d.get("claimed_at") or 0) > settings.BATCH_DELIVERY_LEASE_SEC
+    if status != "submitted" and not stale:
+        return False
+    transaction.update(ref, {"status": "delivering", "claimed_at": now})
+    return True
+
+async def _prepare(kind: str, user_id: str) -> Dict[str, Any]:
+    """ユーザー1人分のプロンプトと、結果反映に必要なコンテキストを作る"""
+    if kind == "weekly":
+        ctx = await prepare_weekly(user_id)
+        return {"prompt": ctx["prompt"], "ctx": {}}
+    if kind == "monthly":
+        ctx = await prepare_monthly(user_id)
+        return {"prompt": ctx["prompt"], "ctx": {"month": ctx["month"], "stats": ctx["stats"]}}
+    raise ValueError(f"unsupported batch kind: {kind}")
+
+async def submit_coaching_batch(
+    kind: str,
+    shard: int = 0,
+    of: int = 1,
+    user_ids: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    対象ユーザー全員のプロンプトを1つの JSONL にまとめて OpenAI Batch API に投入する
+
+    custom_id は "{kind}:{user_id}"。結果の反映は poll_coaching_batch で行う。
+    """
+    if not settings.OPENAI_API_KEY:
+        return {"ok": False, "error": "OPENAI_API_KEY not set"}
+
+    ids = user_ids if user_ids is not None else await fs_run(list_user_ids)
+    targets = [uid for uid in ids if in_shard(uid, shard, of)]
+
+    prepared = await gather_limited([_prepare(kind, uid) for uid in targets], limit=settings.CRON_CONCURRENCY)
+
+    lines: List[str] = []
+    items: Dict[str, Dict[str, Any]] = {}
+    prepare_errors: Dict[str, str] = {}
+    for uid, res in zip(targets, prepared):
+        if isinstance(res, Exception):
+            prepare_errors[uid] = repr(res)[:500]
+            continue
+        custom_id = f"{kind}:{uid}"
+        lines.append(json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": coaching_chat_body(res["prompt"]),
+        }, ensure_ascii=False))
+        items[uid] = {"custom_id": custom_id, "ctx": res["ctx"], "prompt": res["prompt"], "status": "submitted"}
+
+    if not lines:
+        return {"ok": False, "error": "no prompts prepared", "prepare_errors": prepare_errors}
+
+    file_id = await openai_upload_batch_file(("\n".join(lines) + "\n").encode("utf-8"), f"{kind}-coaching.jsonl")
+    batch = await openai_create_batch(file_id, {"kind": kind, "shard": f"{shard}/{of}"})
+    batch_id = batch["id"]
+
+    await fs_set(batch_doc(batch_id), {
+        "kind": kind,
+        "shard": shard,
+        "of": of,
+        "status": batch.get("status", "validating"),
+        "input_file_id": file_id,
+        "users": len(items),
+        "prepare_errors": prepare_errors,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "finished": False,
+    })
+
+    def write_items() -> None:
+        wb = db.batch()
+        for n, (uid, item) in enumerate(items.items(), start=1):
+            wb.set(batch_doc(batch_id).collection("items").document(uid), item)
+            if n % 400 == 0:
+                wb.commit()
+                wb = db.batch()
+        wb.commit()
+    await fs_run(write_items)
+
+    return {"ok": True, "batch_id": batch_id, "status": batch.get("status"), "users": len(items),
+            "prepare_errors": prepare_errors}
+
+def _check_sent(sent: Dict[str, Any]) -> Dict[str, Any]:
+    """push の結果を確認し、再試行で届く可能性がある失敗なら _PushFailed を送出"""
+    if not sent.get("sent") and sent.get("reason") not in _PUSH_TERMINAL_REASONS:
+        raise _PushFailed(sent.get("reason"))
+    return sent
+
+async def _fan_out(kind: str, user_id: str, item: Dict[str, Any], text: str) -> Dict[str, Any]:
+    """1ユーザー分の結果を Firestore / BigQuery / LINE に反映"""
+    if kind == "weekly":
+        return {"sent": _check_sent(await push_weekly(text, user_id))}
+    ctx = item.get("ctx") or {}
+    if item.get("stored"):
+        # 保存済みで通知だけ失敗していた項目は通知のみ再送（月次レポートを二重に書かない）
+        return {"sent": _check_sent(await push_monthly_notice(user_id, ctx["month"]))}
+    res = await finish_monthly(user_id, ctx["month"], text, ctx.get("stats") or {})
+    _check_sent(res["sent"])
+    return res
+
+async def poll_coaching_batch(batch_id: str) -> Dict[str, Any]:
+    """
+    Batch の状態を確認し、完了していれば未反映のユーザーにだけ結果を配る（再実行可能）
+    """
+    snap = await fs_get(batch_doc(batch_id))
+    if not snap.exists:
+        return {"ok": False, "error": f"unknown batch: {batch_id}"}
+    rec = snap.to_dict() or {}
+    if rec.get("finished"):
+        return {"ok": True, "batch_id": batch_id, "status": rec.get("status"), "finished": True}
+
+    batch = await openai_get_batch(batch_id)
+    status = batch.get("status")
+    update: Dict[str, Any] = {"status": status, "request_counts": batch.get("request_counts")}
+
+    if status in _TERMINAL_FAILED:
+        update["finished"] = True
+        await fs_set(batch_doc(batch_id), update, merge=True)
+        return {"ok": False, "batch_id": batch_id, "status": status, "errors": batch.get("errors")}
+    if status != "completed":
+        await fs_set(batch_doc(batch_id), update, merge=True)
+        return {"ok": True, "batch_id": batch_id, "status": status, "finished": False}
+
+    # 完了：出力 JSONL を custom_id で突き合わせる
+    outputs: Dict[str, Dict[str, Any]] = {}
+    for file_key in ("output_file_id", "error_file_id"):
+        if batch.get(file_key):
+            for line in (await openai_file_content(batch[file_key])).splitlines():
+                if line.strip():
+                    row = json.loads(line)
+                    outputs[row.get("custom_id")] = row
+
+    kind = rec["kind"]
+    item_snaps = await fs_stream(
+        batch_doc(batch_id).collection("items").where("status", "in", ["submitted", "delivering"])
+    )
+
+    async def deliver(item_snap) -> str:
+        uid = item_snap.id
+        item = item_snap.to_dict() or {}
+        row = outputs.get(item.get("custom_id")) or {}
+        resp = row.get("response") or {}
+        ref = batch_doc(batch_id).collection("items").document(uid)
+        if not await fs_run(_claim_item, db.transaction(), ref, time.time()):
+            # 別の poll が配信中（完了はその poll か次回の poll で記録される）
+            return "in_progress"
+        if resp.get("status_code") != 200:
+            await fs_set(ref, {"status": "failed", "error": str(row.get("error") or resp)[:500]}, merge=True)
+            return "failed"
+        text = resp["body"]["choices"][0]["message"]["content"]
+        try:
+            await _fan_out(kind, uid, item, text)
+        except Exception as e:
+            # 反映に失敗したユーザーは submitted に戻し、次回の poll で再試行
+            print(f"[WARN] batch {batch_id} fan-out failed ({uid}): {e!r}")
+            reset = {"status": "submitted", "last_error": repr(e)[:500]}
+            if isinstance(e, _PushFailed):
+                reset["stored"] = True
+            await fs_set(ref, reset, merge=True)
+            return "retry"
+        if settings.OPENAI_CACHE_ENABLED and item.get("prompt"):
+            body = coaching_chat_body(item["prompt"])
+            await completion_cache.put(coaching_cache_key(body), text, body["model"])
+        await fs_set(ref, {"status": "delivered", "delivered_at": datetime.now(timezone.utc).isoformat()}, merge=True)
+        return "delivered"
+
+    results = await gather_limited([deliver(s) for s in item_snaps], limit=settings.CRON_CONCURRENCY)
+    counts: Dict[str, int] = {}
+    for r in results:
+        key = r if isinstance(r, str) else "retry"
+        counts[key] = counts.get(key, 0) + 1
+
+    update["finished"] = counts.get("retry", 0) == 0 and counts.get("in_progress", 0) == 0
+    update["delivered_counts"] = counts
+    await fs_set(batch_doc(batch_id), update, merge=True)
+    return {"ok": True, "batch_id": batch_id, "status": status, "finished": update["finished"], "counts": counts}
+
+async def poll_open_batches() -> Dict[str, Any]:
+    """未完了の Batch をすべて poll する（スケジューラ用）"""
+    snaps = await fs_stream(db.collection(BATCH_COLLECTION).where("finished", "==", False))
+    results = [await poll_coaching_batch(s.id) for s in snaps]
+    return {"ok": all(r.get("ok") for r in results), "batches": results}
@@ -1,35 +1,54 @@
-from datetime import datetime, timezone
+import asyncio
+from datetime import datetime, timezone, date, timedelta
 from typing import List, Dict, Any, Optional
 from app.external.openai_client import ask_gpt5
 from app.external.line_client import push_line
 from app.services.meal_service import meals_last_n_days
-from app.database.firestore import get_latest_profile, user_doc
-from app.database.bigquery import bq_upsert_profile, bq_insert_rows, bq_client
+from app.database.firestore import get_latest_profile, get_line_user_id, user_doc, fs_run
+from app.database.bigquery import bq_upsert_profile, bq_client
+from app.database.outbox import commit_with_outbox, outbox_result
+from app.database.row_keys import row_key
+from app.database.rollup import bq_read_monthly_rollup
+from app.services.analytics_service import analytics_prompt_for
+from app.models.fitbit import FitbitDay
+from google.cloud import bigquery
 from app.config import settings
 
-def build_daily_prompt(day: Dict[str, Any]) -> str:
+def format_sleep(day: FitbitDay) -> str:
+    """睡眠の表示用文字列（プロンプト生成時のみ使う）"""
+    if day.sleep_minutes is None:
+        return "データなし"
+    if day.has_sleep_stages:
+        return (f"総睡眠{day.sleep_minutes}分 "
+                f"(深:{day.sleep_deep_min or 0} / レム:{day.sleep_rem_min or 0} / "
+                f"浅:{day.sleep_light_min or 0} / 覚醒:{day.sleep_wake_min or 0})")
+    return f"総睡眠{day.sleep_minutes}分"
+
+def format_spo2(day: FitbitDay) -> str:
+    """SpO2の表示用文字列（プロンプト生成時のみ使う）"""
+    if day.spo2_avg is None:
+        return "データなし"
+    if day.spo2_min is not None and day.spo2_max is not None:
+        return f"平均{day.spo2_avg:g} (最低{day.spo2_min:g} / 最高{day.spo2_max:g})"
+    return f"平均{day.spo2_avg:g}"
+
+def build_daily_prompt(day: FitbitDay) -> str:
     """日次コーチング用プロンプトを生成"""
-    date = day.get("date", "")
-    steps = day.get("steps_total", "0")
-    sleep_line = day.get("sleep_line", "データなし")
-    calories = day.get("calories_total", "0")
-    spo2_line = day.get("spo2_line", "データなし")
-    
-    return f"""今日は {date}。Fitbit の今日のデータは:
-- 歩数: {steps}
-- 睡眠: {sleep_line}
-- SpO₂: {spo2_line}
-- 消費カロリー: {calories}
+    return f"""今日は {day.date}。Fitbit の今日のデータは:
+- 歩数: {day.steps_total}
+- 睡眠: {format_sleep(day)}
+- SpO₂: {format_spo2(day)}
+- 消費カロリー: {day.calories_total}
 
 あなたはヘルスケア&エクササイズのプロコーチです。
 500文字以内で今日の状態を要約し、明日に向けて1〜3つの具体的アクションを日本語で提案してください。"""
 
-def build_weekly_prompt(days: List[Dict[str, Any]], meals_by_day: Dict[str, List[Dict[str, Any]]], profile: Optional[Dict[str, Any]] = None) -> str:
+def build_weekly_prompt(days: List[FitbitDay], meals_by_day: Dict[str, List[Dict[str, Any]]], profile: Optional[Dict[str, Any]] = None, analytics: str = "") -> str:
     """コーチング用プロンプトを生成"""
     # 週次本文
     lines = []
     for d in days:
-        day_key = d["date"]
+        day_key = d.date
         meals = meals_by_day.get(day_key, [])
         meal_snippets = []
         for m in meals[:2]:
@@ -41,8 +60,8 @@ def build_weekly_prompt(days: List[Dict[str, Any]], meals_by_day: Dict[str, List
         meal_block = "\n".join(meal_snippets) if meal_snippets else "（食事記録なし）"
 
         lines.append(
-            f"{d['date']}: 歩数{d['steps_total']}, 睡眠{d['sleep_line']}, "
-            f"SpO₂{d['spo2_line']}, カロリー{d['calories_total']}\n"
+            f"{d.date}: 歩数{d.steps_total}, 睡眠{format_sleep(d)}, "
+            f"SpO₂{format_spo2(d)}, カロリー{d.calories_total}\n"
             f"  食事:\n{meal_block}"
         )
     body = "\n".join(lines)
@@ -77,13 +96,14 @@ def build_weekly_prompt(days: List[Dict[str, Any]], meals_by_day: Dict[str, List
         add("アレルギー", "allergies")
 
     profile_block = "\n".join(prof_lines) if prof_lines else "（プロフィール未設定）"
+    analytics_block = f"\n{analytics}\n" if analytics else ""
 
     return f"""過去7日間のヘルスデータと食事記録です:
 {body}
 
 [プロフィール抜粋]
 {profile_block}
-
+{analytics_block}
 あなたはヘルスケア&栄養のプロコーチです。
 すべての分析と提案は、ここまでに記載されたユーザーのプロフィール（年齢、性別、身長、体重、目標体重、運動目的、嗜好、既往歴、生活習慣、過去7日間のデータ）を必ず参照して行ってください。
 返答は以下の構成を必須とします。
@@ -102,95 +122,105 @@ def build_weekly_prompt(days: List[Dict[str, Any]], meals_by_day: Dict[str, List
 　 - 食事・運動・睡眠のそれぞれについて、再現性が高く今すぐ実行できる内容を提案する
 すべて日本語で、専門性・個別性・具体性を重視して作成してください。"""
 
-async def daily_coaching() -> Dict[str, Any]:
+async def push_to_user(user_id: str, text: str) -> Dict[str, Any]:
+    """ユーザー本人のLINE宛てに送信（送信先が未登録なら送らない）"""
+    to = await fs_run(get_line_user_id, user_id)
+    if not to:
+        print(f"[WARN] LINE push skipped: no line_user_id for user {user_id}")
+        return {"sent": False, "reason": "no line_user_id"}
+    return push_line(text, to=to)
+
+async def daily_coaching(user_id: str = "demo") -> Dict[str, Any]:
     """日次コーチングを実行"""
     try:
         # 循環インポートを避けるため、ここで import
-        from app.services.fitbit_service import fitbit_today_core, save_fitbit_daily_firestore
+        from app.services.fitbit_service import fitbit_today_core, save_fitbit_days_with_outbox
         
         # 今日のFitbitデータ取得
-        day = await fitbit_today_core()
-        
-        # Firestore保存
-        saved = save_fitbit_daily_firestore("demo", day)
+        day = await fitbit_today_core(user_id, priority="low")
         
-        # BigQuery保存
-        try:
-            bq_insert_rows(settings.BQ_TABLE_FITBIT, [{
-                "user_id": "demo",
-                "date": saved["date"],
-                "steps_total": saved["steps_total"],
-                "sleep_line": saved["sleep_line"],
-                "spo2_line": saved["spo2_line"],
-                "calories_total": saved["calories_total"],
-                "ingested_at": datetime.now(timezone.utc).isoformat(),
-            }])
-        except Exception as e:
-            print(f"[WARN] BQ insert (daily_coaching) failed: {e}")
+        # Firestore保存（BigQueryへはアウトボックス経由で反映）
+        saved = (await save_fitbit_days_with_outbox(user_id, [day]))[0]
         
         # GPTでコーチング生成
         prompt = build_daily_prompt(day)
         msg = await ask_gpt5(prompt)
         
         # LINE送信
-        res = push_line(f"⏰ 毎日のコーチング\n{msg}")
+        res = await push_to_user(user_id, f"⏰ 毎日のコーチング\n{msg}")
         
         return {"ok": True, "sent": res, "preview": msg, "saved": saved}
     except Exception as e:
-        push_line(f"⚠️ cronエラー: {e}")
+        await push_to_user(user_id, f"⚠️ cronエラー: {e}")
         return {"ok": False, "error": str(e)}
 
-async def weekly_coaching(dry: bool = False, show_prompt: bool = False) -> Dict[str, Any]:
+async def prepare_weekly(user_id: str = "demo", priority: str = "low") -> Dict[str, Any]:
+    """週次コーチングの前処理（Fitbit同期・プロフィール反映・プロンプト生成）"""
+    # 循環インポートを避けるため、ここで import
+    from app.services.fitbit_service import fitbit_sync_window
+    
+    # 直近7日 Fitbit（未確定日のみ取得し、変化した日だけ Firestore / BigQuery(アウトボックス) へ保存）
+    sync = await fitbit_sync_window(7, user_id, priority=priority)
+    days = sync["days"]
+    saved = sync["changed"]
+    bq_prof = await fs_run(bq_upsert_profile, user_id)
+    
+    # 週次プロンプト準備
+    meals_map, profile, analytics = await asyncio.gather(
+        meals_last_n_days(7, user_id),
+        fs_run(get_latest_profile, user_id),
+        analytics_prompt_for(user_id, settings.ANALYTICS_PROMPT_DAYS),
+    )
+    prompt    = build_weekly_prompt(days, meals_map, profile, analytics)
+    
+    print("\n=== WEEKLY PROMPT ===\n", prompt, "\n=== END PROMPT ===\n")
+    
+    return {
+        "prompt": prompt,
+        "saved": saved,
+        "bq_fitbit": outbox_result(count=len(saved)),
+        "bq_profile": bq_prof,
+        "meals_keys": list(meals_map.keys()),
+        "profile_used": bool(profile),
+    }
+
+async def push_weekly(msg: str, user_id: str = "demo") -> Dict[str, Any]:
+    """週次コーチング結果をLINE送信"""
+    try:
+        return await push_to_user(user_id, f"🗓️ AIコーチのアドバイス\n{msg}")
+    except Exception as e:
+        print(f"[WARN] LINE push failed: {e}")
+        return {"sent": False, "reason": repr(e)}
+
+async def weekly_coaching(dry: bool = False, show_prompt: bool = False, user_id: str = "demo", use_cache: bool = True) -> Dict[str, Any]:
     """コーチングを実行"""
     try:
-        # 循環インポートを避けるため、ここで import
-        from app.services.fitbit_service import fitbit_last_n_days, save_fitbit_daily_firestore
-        from app.database.bigquery import bq_upsert_fitbit_days
-        
-        # 直近7日 Fitbit
-        days = await fitbit_last_n_days(7)
-        
-        # Firestore保存
-        saved = [save_fitbit_daily_firestore("demo", d) for d in days]
-        
-        # BigQuery保存
-        bq_fitbit = bq_upsert_fitbit_days("demo", days)
-        bq_prof   = bq_upsert_profile("demo")
-        
-        # 週次プロンプト準備
-        meals_map = await meals_last_n_days(7, "demo")
-        profile   = get_latest_profile("demo")
-        prompt    = build_weekly_prompt(days, meals_map, profile)
-        
-        print("\n=== WEEKLY PROMPT ===\n", prompt, "\n=== END PROMPT ===\n")
+        ctx = await prepare_weekly(user_id)
+        prompt = ctx["prompt"]
         
         # dry=1 の時は生成＆LINE送信をスキップ
         msg = "(dry run) no OpenAI call"
         send_res = {"sent": False, "reason": "dry"}
         if not dry:
             try:
-                msg = await ask_gpt5(prompt)
+                msg = await ask_gpt5(prompt, use_cache=use_cache)
             except Exception as e:
                 print(f"[ERROR] OpenAI failed: {e}")
                 msg = f"(OpenAI error) {e}"
             
-            try:
-                send_res = push_line(f"🗓️ AIコーチのアドバイス\n{msg}")
-            except Exception as e:
-                print(f"[WARN] LINE push failed: {e}")
-                send_res = {"sent": False, "reason": repr(e)}
+            send_res = await push_weekly(msg, user_id)
         
         resp = {
             "ok": True,
             "dry": dry,
-            "saved_count": len(saved),
-            "bq_fitbit": bq_fitbit,
-            "bq_profile": bq_prof,
+            "saved_count": len(ctx["saved"]),
+            "bq_fitbit": ctx["bq_fitbit"],
+            "bq_profile": ctx["bq_profile"],
             "model": settings.OPENAI_MODEL,
             "sent": send_res,
             "preview": msg,
-            "meals_keys": list(meals_map.keys()),
-            "profile_used": bool(profile),
+            "meals_keys": ctx["meals_keys"],
+            "profile_used": ctx["profile_used"],
         }
         if show_prompt:
             resp["prompt"] = prompt
@@ -201,80 +231,107 @@ async def weekly_coaching(dry: bool = False, show_prompt: bool = False) -> Dict[
         print(f"[FATAL] weekly_coaching error: {e}")
         return {"ok": False, "where": "weekly_coaching", "error": str(e)}
 
-async def monthly_coaching() -> Dict[str, Any]:
-    """月次コーチングを実行"""
-    if not bq_client:
-        return {"ok": False, "error": "BigQuery not configured"}
-
-    def q(sql: str):
-        return list(bq_client.query(sql).result())
-
-    fitbit_sql = f"""
-    WITH d AS (
-      SELECT DATE(date) AS d, steps_total, calories_total
-      FROM `{settings.BQ_PROJECT_ID}.{settings.BQ_DATASET}.{settings.BQ_TABLE_FITBIT}`
-      WHERE user_id='demo'
-        AND date BETWEEN DATE_SUB(CURRENT_DATE(), INTERVAL 29 DAY) AND CURRENT_DATE()
-    )
-    SELECT COUNT(*) days, AVG(steps_total) avg_steps, MIN(steps_total) min_steps, MAX(steps_total) max_steps,
-           AVG(calories_total) avg_cal, MIN(calories_total) min_cal, MAX(calories_total) max_cal
-    FROM d
-    """
+async def prepare_monthly(user_id: str = "demo", month: Optional[str] = None) -> Dict[str, Any]:
+    """月次コーチングの前処理（月次集計1行＋代表食事を並行取得・プロンプト生成）。month 省略時は前月"""
+    # 月次 cron は月初に走るので、既定は締まった前月
+    today = datetime.now(timezone.utc).astimezone().date()
+    month_str = month or (today.replace(day=1) - timedelta(days=1)).strftime("%Y-%m")
+    month_start = date.fromisoformat(f"{month_str}-01")
+    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
 
     meals_sql = f"""
     SELECT when_date, text
     FROM `{settings.BQ_PROJECT_ID}.{settings.BQ_DATASET}.{settings.BQ_TABLE_MEALS}`
-    WHERE user_id='demo'
-      AND when_date BETWEEN DATE_SUB(CURRENT_DATE(), INTERVAL 29 DAY) AND CURRENT_DATE()
+    WHERE user_id=@user_id
+      AND when_date BETWEEN @start AND @end
     ORDER BY when_date DESC
     LIMIT 10
     """
 
-    fb = q(fitbit_sql)[0]
-    meals = q(meals_sql)
+    def meals_q():
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("user_id", "STRING", user_id),
+                bigquery.ScalarQueryParameter("start", "DATE", month_start),
+                bigquery.ScalarQueryParameter("end", "DATE", month_end),
+            ]
+        )
+        return list(bq_client.query(meals_sql, job_config=job_config).result())
+
+    fb, meals, analytics = await asyncio.gather(
+        asyncio.to_thread(bq_read_monthly_rollup, user_id, month_str),
+        asyncio.to_thread(meals_q),
+        analytics_prompt_for(user_id, settings.ANALYTICS_PROMPT_DAYS),
+    )
+    fb = fb or {}
+
+    def n(key: str) -> int:
+        return int(fb.get(key) or 0)
 
     meal_lines = "\n".join([f"- {r['when_date']}: {r['text']}" for r in meals])
-    month_str = datetime.now(timezone.utc).astimezone().strftime("%Y-%m")
     prompt = f"""
-あなたはヘルスケア＆栄養のプロコーチです。以下は{month_str}の30日分ダイジェストです。
+あなたはヘルスケア＆栄養のプロコーチです。以下は{month_str}の月間ダイジェストです。
 
 [活動・消費]
-- 期間日数: {int(fb['days'])}日
-- 歩数: 平均 {int(fb['avg_steps'])}、最小 {int(fb['min_steps'])}、最大 {int(fb['max_steps'])}
-- 消費カロリー: 平均 {int(fb['avg_cal'])}、最小 {int(fb['min_cal'])}、最大 {int(fb['max_cal'])}
+- 記録日数: {n('days')}日
+- 歩数: 平均 {n('avg_steps')}、最小 {n('min_steps')}、最大 {n('max_steps')}
+- 消費カロリー: 平均 {n('avg_cal')}、最小 {n('min_cal')}、最大 {n('max_cal')}
+- 食事記録: {n('meal_count')}件
 
 [食事（代表10件）]
 {meal_lines}
 
+{analytics}
+
 お願い：
-1) この30日を「良かった点／改善点／注意すべき兆候」に分けて要約（300〜500字）
+1) この1か月を「良かった点／改善点／注意すべき兆候」に分けて要約（300〜500字）
 2) 来月の具体アクションを最大5つ（食事・運動・睡眠の観点で）
 3) 実行チェックリスト（5箇条、短く）
 """
 
-    monthly_text = await ask_gpt5(prompt)
+    stats = {
+        "avg_steps": n('avg_steps'), "min_steps": n('min_steps'), "max_steps": n('max_steps'),
+        "avg_cal": n('avg_cal'), "min_cal": n('min_cal'), "max_cal": n('max_cal'),
+    }
+    return {"prompt": prompt, "month": month_str, "stats": stats}
 
-    # Firestore保存
-    user_doc("demo").collection("coach_monthly").document(month_str).set({
-        "month": month_str,
-        "text": monthly_text,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "stats": {
-            "avg_steps": int(fb['avg_steps']), "min_steps": int(fb['min_steps']), "max_steps": int(fb['max_steps']),
-            "avg_cal": int(fb['avg_cal']), "min_cal": int(fb['min_cal']), "max_cal": int(fb['max_cal']),
-        }
-    }, merge=True)
-
-    # BigQuery保存
-    try:
-        bq_insert_rows(settings.BQ_TABLE_MONTHLY, [{
-            "user_id": "demo",
+async def finish_monthly(user_id: str, month_str: str, monthly_text: str, stats: Dict[str, Any]) -> Dict[str, Any]:
+    """月次コーチング結果を Firestore に保存し、BigQuery ミラーをアウトボックスに積んで LINE 通知"""
+    created_at = datetime.now(timezone.utc).isoformat()
+    # Firestore保存とBigQueryミラー項目を同一バッチでコミット（BQ障害でも行を失わない）
+    await fs_run(
+        commit_with_outbox,
+        [(user_doc(user_id).collection("coach_monthly").document(month_str), {
             "month": month_str,
-            "summary_text": monthly_text,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-        }])
-    except Exception:
-        pass
-
-    push_line(f"📅 {month_str} の振り返りができました！")
-    return {"ok": True, "month": month_str, "preview": monthly_text[:400]}
+            "text": monthly_text,
+            "created_at": created_at,
+            "stats": stats,
+        }, True)],
+        [(f"monthly-{user_id}-{month_str}", "insert_rows", {
+            "table": settings.BQ_TABLE_MONTHLY,
+            "rows": [{
+                "user_id": user_id,
+                "month": month_str,
+                "summary_text": monthly_text,
+                "created_at": created_at,
+            }],
+            "row_ids": [row_key("monthly", user_id, month_str, created_at)],
+        })],
+    )
+
+    sent = await push_monthly_notice(user_id, month_str)
+    return {"ok": True, "month": month_str, "preview": monthly_text[:400], "sent": sent}
+
+async def push_monthly_notice(user_id: str, month_str: str) -> Dict[str, Any]:
+    """月次コーチング完了をLINE通知"""
+    return await push_to_user(user_id, f"📅 {month_str} の振り返りができました！")
+
+async def monthly_coaching(user_id: str = "demo") -> Dict[str, Any]:
+    """月次コーチングを実行"""
+    if not bq_client:
+        return {"ok": False, "error": "BigQuery not configured"}
+
+    ctx = await prepare_monthly(user_id)
+    monthly_text = await ask_gpt5(ctx["prompt"])
+    res = await finish_monthly(user_id, ctx["month"], monthly_text, ctx["stats"])
+    return {"ok": True, "month": res["month"], "preview": res["preview"]}
@@ -0,0 +1,158 @@
+import time
+from datetime import datetime, date, timezone, timedelta
+from typing import List, Dict, Any, Optional
+from app.config import settings
+from app.database.firestore import user_doc, fs_run, fs_get, fs_set
+from app.database.outbox import commit_with_outbox
+from app.external.fitbit_client import FitbitRateLimitError, get_rate_budget
+from app.models.fitbit import FitbitDay
+from app.services.fitbit_service import fitbit_date_range, fitbit_daily_payload
+
+# 1回の WriteBatch に入れる日数（日次ドキュメント＋チェックポイントで 500 書き込み以内）
+_BACKFILL_BATCH_DAYS = 200
+
+def fitbit_backfill_doc(user_id: str = "demo"):
+    """バックフィルのチェックポイント（users/{uid}/private/fitbit_backfill）"""
+    return user_doc(user_id).collection("private").document("fitbit_backfill")
+
+def _is_empty(day: FitbitDay) -> bool:
+    # 取得に失敗した日はデータなしと区別できないので空とみなさない
+    return day.complete and not day.steps_total and day.sleep_minutes is None and day.spo2_avg is None
+
+def _days_per_min(days: int, seconds: float) -> Optional[float]:
+    return round(days / (seconds / 60), 1) if seconds > 0 else None
+
+async def start_fitbit_backfill(user_id: str = "demo", days: Optional[int] = None, reset: bool = False) -> Dict[str, Any]:
+    """バックフィルを登録（既に登録済みなら reset=True のときだけやり直す）"""
+    doc = fitbit_backfill_doc(user_id)
+    snap = await fs_get(doc)
+    if snap.exists and not reset:
+        return {"ok": True, "created": False, **snap.to_dict()}
+
+    today = datetime.now(timezone.utc).astimezone().date()
+    days = days or settings.FITBIT_BACKFILL_DAYS
+    state = {
+        "status": "pending",
+        "target_start": (today - timedelta(days=days - 1)).isoformat(),
+        "next_end": today.isoformat(),
+        "days_done": 0,
+        "chunks_done": 0,
+        "elapsed_sec": 0.0,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    await fs_set(doc, state)
+    return {"ok": True, "created": True, **state}
+
+def _commit_chunk(user_id: str, days: List[FitbitDay], checkpoint: Dict[str, Any]) -> None:
+    """日次ドキュメントとアウトボックス（チャンクごとに1項目＝1回のMERGE）とチェックポイントを同時コミット"""
+    col = user_doc(user_id).collection("fitbit_daily")
+    for i in range(0, len(days), _BACKFILL_BATCH_DAYS):
+        part = days[i:i + _BACKFILL_BATCH_DAYS]
+        writes = [(col.document(d.date), fitbit_daily_payload(d), True) for d in part]
+        last = i + _BACKFILL_BATCH_DAYS >= len(days)
+        if last:
+            writes.append((fitbit_backfill_doc(user_id), checkpoint, True))
+        commit_with_outbox(writes, [(
+            f"fitbit-backfill-{user_id}-{part[-1].date}-{part[0].date}",
+            "fitbit_days_upsert",
+            {"user_id": user_id, "days": [d.to_dict() for d in part]},
+        )])
+    if not days:
+        fitbit_backfill_doc(user_id).set(checkpoint, merge=True)
+
+async def run_fitbit_backfill(user_id: str = "demo", max_seconds: Optional[float] = None) -> Dict[str, Any]:
+    """
+    チェックポイントから過去方向にバックフィルを進める
+
+    - 1チャンク（FITBIT_BACKFILL_CHUNK_DAYS 日）ごとに各リソースの上限ウィンドウで取得
+    - 低優先度でレート予算を使い、予算切れ（FitbitRateLimitError）なら paused で中断
+    - 各チャンクの保存とチェックポイント更新は同じ WriteBatch（途中で落ちても再開できる）
+    - 1チャンクまるごとデータがなければ利用開始前とみなして完了
+    """
+    doc = fitbit_backfill_doc(user_id)
+    snap = await fs_get(doc)
+    if not snap.exists:
+        return {"ok": True, "user_id": user_id, "status": "none"}
+    state = snap.to_dict()
+    if state.get("status") == "done":
+        return {"ok": True, "user_id": user_id, **state}
+
+    max_seconds = max_seconds or settings.FITBIT_BACKFILL_RUN_SEC
+    target_start = date.fromisoformat(state["target_start"])
+    next_end = date.fromisoformat(state["next_end"])
+    t0 = time.monotonic()
+    run_days = 0
+    run_chunks = 0
+    status = "running"
+    note = None
+
+    while next_end >= target_start:
+        if time.monotonic() - t0 >= max_seconds:
+            break
+        chunk_start = max(target_start, next_end - timedelta(days=settings.FITBIT_BACKFILL_CHUNK_DAYS - 1))
+        try:
+            days = await fitbit_date_range(chunk_start, next_end, user_id, priority="low", raise_on_rate_limit=True)
+        except FitbitRateLimitError as e:
+            status = "paused"
+            note = f"rate limited; retry after {int(e.retry_after)}s"
+            break
+
+        empty = all(_is_empty(d) for d in days)
+        incomplete = [d.date for d in days if not d.complete]
+        if incomplete:
+            # finalized にせず保存し、直近分は通常の同期で取り直す
+            print(f"[WARN] fitbit backfill {user_id}: {len(incomplete)} day(s) incomplete ({incomplete[-1]}..{incomplete[0]})")
+        next_end = chunk_start - timedelta(days=1)
+        elapsed = time.monotonic() - t0
+        checkpoint = {
+            "status": "done" if empty or next_end < target_start else "running",
+            "next_end": next_end.isoformat(),
+            "days_done": int(state.get("days_done", 0)) + run_days + (0 if empty else len(days)),
+            "chunks_done": int(state.get("chunks_done", 0)) + run_chunks + 1,
+            "elapsed_sec": float(state.get("elapsed_sec", 0.0)) + elapsed,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if empty:
+            checkpoint["note"] = f"no data before {days[0].date}"
+        await fs_run(_commit_chunk, user_id, [] if empty else days, checkpoint)
+        run_chunks += 1
+        if empty:
+            status, note = "done", checkpoint["note"]
+            break
+        run_days += len(days)
+
+    if status == "running" and next_end < target_start:
+        status = "done"
+
+    elapsed = time.monotonic() - t0
+    total_days = int(state.get("days_done", 0)) + run_days
+    total_sec = float(state.get("elapsed_sec", 0.0)) + elapsed
+    final = {
+        "status": status,
+        "next_end": next_end.isoformat(),
+        "days_done": total_days,
+        "chunks_done": int(state.get("chunks_done", 0)) + run_chunks,
+        "elapsed_sec": round(total_sec, 1),
+        "days_per_min": _days_per_min(total_days, total_sec),
+        "last_run": {
+            "days": run_days,
+            "chunks": run_chunks,
+            "seconds": round(elapsed, 1),
+            "days_per_min": _days_per_min(run_days, elapsed),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+        },
+        "rate_budget": get_rate_budget(user_id).snapshot(),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    if note:
+        final["note"] = note
+    await fs_set(doc, final, merge=True)
+    return {"ok": True, "user_id": user_id, **final}
+
+async def fitbit_backfill_status(user_id: str = "demo") -> Dict[str, Any]:
+    """バックフィルの進捗"""
+    snap = await fs_get(fitbit_backfill_doc(user_id))
+    if not snap.exists:
+        return {"ok": True, "user_id": user_id, "status": "none"}
+    return {"ok": True, "user_id": user_id, **snap.to_dict()}
@@ -1,160 +1,332 @@
-from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Any
-from app.external.fitbit_client import get_fitbit_access_token, fitbit_get
-from app.database.firestore import user_doc
-from app.database.bigquery import bq_upsert_fitbit_days
-
-async def fitbit_day_core(date_str: str, access_token: str) -> Dict[str, Any]:
-    """指定日のFitbitデータを取得"""
-    base = "https://api.fitbit.com"
+import asyncio
+from datetime import datetime, date, timezone, timedelta
+from typing import List, Dict, Any, Optional, Set, Tuple
+from app.external.fitbit_client import get_fitbit_access_token, fitbit_get, FitbitRateLimitError
+from app.database.firestore import user_doc, fs_run, fs_set
+from app.database.outbox import commit_with_outbox, outbox_result
+from app.database.row_keys import fitbit_row_id, recent_rows
+from app.utils.async_utils import gather_limited
+from app.utils.date_utils import split_date_range
+from app.models.fitbit import FitbitDay, FITBIT_DAY_VALUE_FIELDS, to_int, to_float
+from app.config import settings
+
+# Fitbit 範囲APIの最大期間（日）。リソースごとに上限が異なる
+FITBIT_RANGE_MAX_DAYS = {"activities": 1095, "sleep": 100, "spo2": 30}
+FITBIT_SPO2_MAX_RANGE_DAYS = FITBIT_RANGE_MAX_DAYS["spo2"]
+
+def parse_steps_day(steps_json: Dict[str, Any]) -> int:
+    """1日分の歩数レスポンスから合計値を取り出す"""
+    return to_int((steps_json.get("activities-steps", [{}]) or [{}])[0].get("value"))
 
-    steps_json = await fitbit_get(access_token, f"{base}/1/user/-/activities/steps/date/{date_str}/1d.json")
-    steps_total = (steps_json.get("activities-steps", [{}]) or [{}])[0].get("value", "0")
+def parse_calories_day(calorie_json: Dict[str, Any]) -> int:
+    """1日分のカロリーレスポンスから合計値を取り出す"""
+    return to_int((calorie_json.get("activities-calories", [{}]) or [{}])[0].get("value"))
 
-    sleep_json = await fitbit_get(access_token, f"{base}/1.2/user/-/sleep/date/{date_str}.json")
-    sleep_line = "データなし"
-    if "summary" in sleep_json:
+def parse_sleep_logs(logs: List[Dict[str, Any]]) -> Dict[str, Dict[str, int]]:
+    """睡眠ログ（複数可）を dateOfSleep ごとに合算し、総睡眠とステージ別の分数を返す"""
+    by_day: Dict[str, Dict[str, int]] = {}
+    for log in logs:
+        day = log.get("dateOfSleep") or (log.get("startTime", "")[:10])
+        if not day:
+            continue
+        cur = by_day.setdefault(day, {"sleep_minutes": 0, "sleep_deep_min": 0, "sleep_rem_min": 0,
+                                      "sleep_light_min": 0, "sleep_wake_min": 0})
+        cur["sleep_minutes"] += to_int(log.get("minutesAsleep"))
+        summary = ((log.get("levels") or {}).get("summary") or {})
+        for k in ("deep", "rem", "light", "wake"):
+            cur[f"sleep_{k}_min"] += to_int((summary.get(k) or {}).get("minutes"))
+    return by_day
+
+def parse_sleep_day(sleep_json: Dict[str, Any]) -> Dict[str, Optional[int]]:
+    """1日分の睡眠レスポンスを数値フィールドにする（データなしは空 dict）"""
+    if "summary" in sleep_json and sleep_json["summary"].get("totalMinutesAsleep") is not None:
         s = sleep_json["summary"]
-        total = s.get("totalMinutesAsleep")
-        st = s.get("stages", {})
-        sleep_line = f"総睡眠{total}分 (深:{st.get('deep')} / レム:{st.get('rem')} / 浅:{st.get('light')} / 覚醒:{st.get('wake')})"
-    elif "sleep" in sleep_json:
-        total = sum([x.get("minutesAsleep", 0) for x in sleep_json.get("sleep", [])])
-        sleep_line = f"総睡眠{total}分"
-
-    spo2_line = "データなし"
-    try:
-        spo2_json = await fitbit_get(access_token, f"{base}/1/user/-/spo2/date/{date_str}.json")
-        spo2_val = spo2_json.get("value", {}).get("avg")
-        if spo2_val:
-            spo2_line = f"平均{spo2_val}"
-    except Exception:
-        pass
-
-    calorie_json = await fitbit_get(access_token, f"{base}/1/user/-/activities/calories/date/{date_str}/1d.json")
-    calories_total = (calorie_json.get("activities-calories", [{}]) or [{}])[0].get("value", "0")
-
-    return {"date": date_str, "steps_total": steps_total, "sleep_line": sleep_line,
-            "spo2_line": spo2_line, "calories_total": calories_total}
-
-async def fitbit_today_core() -> Dict[str, Any]:
+        st = s.get("stages") or {}
+        return {
+            "sleep_minutes": to_int(s.get("totalMinutesAsleep")),
+            "sleep_deep_min": to_int(st.get("deep"), None),
+            "sleep_rem_min": to_int(st.get("rem"), None),
+            "sleep_light_min": to_int(st.get("light"), None),
+            "sleep_wake_min": to_int(st.get("wake"), None),
+        }
+    if sleep_json.get("sleep"):
+        days = parse_sleep_logs(sleep_json["sleep"])
+        return next(iter(days.values())) if len(days) == 1 else {
+            "sleep_minutes": sum(v["sleep_minutes"] for v in days.values())
+        }
+    return {}
+
+def parse_spo2(item: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """SpO2レスポンス1件から avg/min/max を取り出す（データなしは空 dict）"""
+    v = item.get("value") or item.get("spo2") or {}
+    if not isinstance(v, dict) or v.get("avg") is None:
+        return {}
+    return {"spo2_avg": to_float(v.get("avg")), "spo2_min": to_float(v.get("min")), "spo2_max": to_float(v.get("max"))}
+
+async def fitbit_day_core(date_str: str, access_token: str, user_id: str = "demo", priority: str = "high") -> FitbitDay:
+    """指定日のFitbitデータを取得（歩数・睡眠・SpO2・カロリーを並行取得）"""
+    base = "https://api.fitbit.com"
+
+    steps_json, sleep_json, spo2_json, calorie_json = await gather_limited([
+        fitbit_get(access_token, f"{base}/1/user/-/activities/steps/date/{date_str}/1d.json", user_id, priority),
+        fitbit_get(access_token, f"{base}/1.2/user/-/sleep/date/{date_str}.json", user_id, priority),
+        fitbit_get(access_token, f"{base}/1/user/-/spo2/date/{date_str}.json", user_id, priority),
+        fitbit_get(access_token, f"{base}/1/user/-/activities/calories/date/{date_str}/1d.json", user_id, priority),
+    ], limit=settings.FITBIT_MAX_CONCURRENCY)
+
+    # 必須リソースが全て失敗した場合（認証切れ等）は従来どおり例外を送出
+    required = (steps_json, sleep_json, calorie_json)
+    if all(isinstance(r, Exception) for r in required):
+        raise steps_json
+    for name, r in (("steps", steps_json), ("sleep", sleep_json), ("calories", calorie_json)):
+        if isinstance(r, Exception):
+            print(f"[WARN] fitbit {name} fetch failed ({date_str}): {r!r}")
+
+    return FitbitDay(
+        date=date_str,
+        steps_total=0 if isinstance(steps_json, Exception) else parse_steps_day(steps_json),
+        calories_total=0 if isinstance(calorie_json, Exception) else parse_calories_day(calorie_json),
+        **({} if isinstance(sleep_json, Exception) else parse_sleep_day(sleep_json)),
+        **({} if isinstance(spo2_json, Exception) else parse_spo2(spo2_json)),
+        complete=not any(isinstance(r, Exception) for r in (steps_json, sleep_json, spo2_json, calorie_json)),
+    )
+
+async def fitbit_today_core(user_id: str = "demo", priority: str = "high") -> FitbitDay:
     """今日のFitbitデータを取得"""
-    token = await get_fitbit_access_token("demo")
+    token = await get_fitbit_access_token(user_id)
     today = datetime.now(timezone.utc).astimezone().strftime("%Y-%m-%d")
-    return await fitbit_day_core(today, token)
+    return await fitbit_day_core(today, token, user_id, priority)
 
-async def fitbit_last_n_days(n: int = 7) -> List[Dict[str, Any]]:
-    """直近n日のFitbitデータを取得"""
-    local_today = datetime.now(timezone.utc).astimezone().date()
-    end_date   = local_today.strftime("%Y-%m-%d")
-    start_date = (local_today - timedelta(days=n - 1)).strftime("%Y-%m-%d")
+def _window_dates(ws: date, we: date) -> List[str]:
+    """[ws, we] の日付文字列"""
+    return [(ws + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((we - ws).days + 1)]
 
-    access = await get_fitbit_access_token("demo")
+async def fitbit_spo2_range(access: str, start: date, end: date, user_id: str = "demo", priority: str = "high",
+                            raise_on_rate_limit: bool = False) -> Tuple[Dict[str, Dict[str, Optional[float]]], Set[str]]:
+    """期間内のSpO2 (avg/min/max) を日付キーで返す（範囲APIを優先し、失敗時は日別を並行取得）。取得できなかった日も返す"""
     base = "https://api.fitbit.com"
+    windows = split_date_range(start, end, FITBIT_SPO2_MAX_RANGE_DAYS)
+    results = await gather_limited([
+        fitbit_get(access, f"{base}/1/user/-/spo2/date/{ws:%Y-%m-%d}/{we:%Y-%m-%d}.json", user_id, priority)
+        for ws, we in windows
+    ], limit=settings.FITBIT_MAX_CONCURRENCY)
+
+    spo2_map: Dict[str, Dict[str, Optional[float]]] = {}
+    failed: Set[str] = set()
+    fallback_days: List[str] = []
+    for (ws, we), res in zip(windows, results):
+        if isinstance(res, FitbitRateLimitError):
+            # バックフィルは中断・再開できるよう返す。それ以外の同期は従来どおり「データなし」
+            if raise_on_rate_limit:
+                raise res
+            failed.update(_window_dates(ws, we))
+            continue
+        if isinstance(res, Exception):
+            fallback_days.extend(_window_dates(ws, we))
+            continue
+        # 範囲APIは配列、単日の場合はオブジェクトで返る
+        items = res if isinstance(res, list) else [res]
+        for item in items:
+            val = parse_spo2(item or {})
+            if item and item.get("dateTime") and val:
+                spo2_map[item["dateTime"]] = val
 
-    # Steps and calories (bulk fetch)
-    steps_json = await fitbit_get(access, f"{base}/1/user/-/activities/steps/date/{start_date}/{end_date}.json")
-    cals_json  = await fitbit_get(access, f"{base}/1/user/-/activities/calories/date/{start_date}/{end_date}.json")
-
-    steps_map = {row.get("dateTime"): row.get("value", "0")
-                 for row in steps_json.get("activities-steps", [])}
-    cals_map  = {row.get("dateTime"): row.get("value", "0")
-                 for row in cals_json.get("activities-calories", [])}
-
-    # Sleep data aggregation
-    sleep_total_map: Dict[str, int] = {}
-    sleep_stage_map: Dict[str, Dict[str, int]] = {}
-    try:
-        sleep_json = await fitbit_get(access, f"{base}/1.2/user/-/sleep/date/{start_date}/{end_date}.json")
-        for log in sleep_json.get("sleep", []):
-            day = log.get("dateOfSleep") or (log.get("startTime", "")[:10])
-            if not day:
+    if fallback_days:
+        per_day = await gather_limited([
+            fitbit_get(access, f"{base}/1/user/-/spo2/date/{d}.json", user_id, priority) for d in fallback_days
+        ], limit=settings.FITBIT_MAX_CONCURRENCY)
+        for d, res in zip(fallback_days, per_day):
+            if isinstance(res, Exception):
+                failed.add(d)
                 continue
-            mins = int(log.get("minutesAsleep", 0) or 0)
-            sleep_total_map[day] = sleep_total_map.get(day, 0) + mins
-
-            summary = ((log.get("levels") or {}).get("summary") or {})
-            cur = sleep_stage_map.get(day, {"deep": 0, "rem": 0, "light": 0, "wake": 0})
-            for k in ("deep", "rem", "light", "wake"):
-                cur[k] += int(((summary.get(k) or {}).get("minutes")) or 0)
-            sleep_stage_map[day] = cur
-    except Exception:
-        pass
-
-    # SpO2 data (per day)
-    dates = [(local_today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(n)]
-    spo2_map: Dict[str, float] = {}
-    for d in dates:
-        try:
-            s = await fitbit_get(access, f"{base}/1/user/-/spo2/date/{d}.json")
-            val = (s.get("value") or {}).get("avg")
-            if val is None and "spo2" in s:
-                val = (s.get("spo2") or {}).get("avg")
-            if val is not None:
+            val = parse_spo2(res)
+            if val:
                 spo2_map[d] = val
-        except Exception:
-            pass
-
-    # Format results
-    results: List[Dict[str, Any]] = []
-    for d in dates:
-        steps = steps_map.get(d, "0")
-        cals  = cals_map.get(d, "0")
-
-        if d in sleep_total_map:
-            stages = sleep_stage_map.get(d)
-            if stages and sum(stages.values()) > 0:
-                sleep_line = (
-                    f"総睡眠{sleep_total_map[d]}分 "
-                    f"(深:{stages.get('deep',0)} / レム:{stages.get('rem',0)} / "
-                    f"浅:{stages.get('light',0)} / 覚醒:{stages.get('wake',0)})"
-                )
-            else:
-                sleep_line = f"総睡眠{sleep_total_map[d]}分"
-        else:
-            sleep_line = "データなし"
 
-        spo2_line = f"平均{spo2_map[d]}" if d in spo2_map else "データなし"
+    return spo2_map, failed
 
-        results.append({
-            "date": d,
-            "steps_total": steps,
-            "sleep_line": sleep_line,
-            "spo2_line": spo2_line,
-            "calories_total": cals,
-        })
+async def fitbit_last_n_days(n: int = 7, user_id: str = "demo", priority: str = "high") -> List[FitbitDay]:
+    """直近n日のFitbitデータを取得"""
+    local_today = datetime.now(timezone.utc).astimezone().date()
+    return await fitbit_date_range(local_today - timedelta(days=n - 1), local_today, user_id, priority)
 
-    return results
+async def _fetch_range_windows(access: str, path: str, start: date, end: date, max_days: int,
+                              user_id: str, priority: str) -> List[Any]:
+    """範囲APIを上限日数ごとのウィンドウに分けて並行取得（結果は例外を含むリスト）"""
+    return await gather_limited([
+        fitbit_get(access, f"https://api.fitbit.com{path}/date/{ws:%Y-%m-%d}/{we:%Y-%m-%d}.json", user_id, priority)
+        for ws, we in split_date_range(start, end, max_days)
+    ], limit=settings.FITBIT_MAX_CONCURRENCY)
 
-def save_fitbit_daily_firestore(user_id: str, day: Dict[str, Any]) -> Dict[str, Any]:
-    """Fitbit日次サマリをFirestoreに保存"""
-    doc = user_doc(user_id).collection("fitbit_daily").document(day["date"])
-    def to_int(x):
-        try:
-            return int(float(x))
-        except Exception:
-            return 0
-    payload = {
-        "date": day["date"],
-        "steps_total": to_int(day.get("steps_total", 0)),
-        "sleep_line": day.get("sleep_line", ""),
-        "spo2_line": day.get("spo2_line", ""),
-        "calories_total": to_int(day.get("calories_total", 0)),
+async def fitbit_date_range(start: date, end: date, user_id: str = "demo", priority: str = "high",
+                            raise_on_rate_limit: bool = False) -> List[FitbitDay]:
+    """
+    [start, end] のFitbitデータを範囲APIで取得（新しい日付順）。各リソースの上限いっぱいのウィンドウで呼ぶ
+
+    raise_on_rate_limit=True（バックフィル）では睡眠・SpO2 のレート制限も FitbitRateLimitError で返す。
+    """
+    n = (end - start).days + 1
+    access = await get_fitbit_access_token(user_id)
+    activities_max = FITBIT_RANGE_MAX_DAYS["activities"]
+
+    # Steps / calories / sleep / SpO2 を範囲APIで並行取得
+    steps_res, cals_res, sleep_res, spo2_res = await asyncio.gather(
+        _fetch_range_windows(access, "/1/user/-/activities/steps", start, end, activities_max, user_id, priority),
+        _fetch_range_windows(access, "/1/user/-/activities/calories", start, end, activities_max, user_id, priority),
+        _fetch_range_windows(access, "/1.2/user/-/sleep", start, end, FITBIT_RANGE_MAX_DAYS["sleep"], user_id, priority),
+        fitbit_spo2_range(access, start, end, user_id, priority, raise_on_rate_limit),
+        return_exceptions=True,
+    )
+    for r in (*steps_res, *cals_res):
+        if isinstance(r, Exception):
+            raise r
+    # バックフィルではレート制限を欠損として扱わず呼び出し元に返す（中断・再開できるように）
+    # それ以外（対話的な同期・定期コーチング）は睡眠・SpO2 のレート制限を従来どおり「データなし」として続行
+    if raise_on_rate_limit:
+        for r in (*sleep_res, spo2_res):
+            if isinstance(r, FitbitRateLimitError):
+                raise r
+
+    # 睡眠・SpO2 を取得できなかった日（complete=False。finalized にせず次回の同期で取り直す）
+    incomplete: Set[str] = set()
+    if isinstance(spo2_res, Exception):
+        print(f"[WARN] fitbit spo2 range fetch failed: {spo2_res!r}")
+        spo2_map: Dict[str, Dict[str, Optional[float]]] = {}
+        incomplete.update(_window_dates(start, end))
+    else:
+        spo2_map, spo2_failed = spo2_res
+        incomplete |= spo2_failed
+
+    steps_map = {row.get("dateTime"): to_int(row.get("value"))
+                 for res in steps_res for row in res.get("activities-steps", [])}
+    cals_map  = {row.get("dateTime"): to_int(row.get("value"))
+                 for res in cals_res for row in res.get("activities-calories", [])}
+
+    sleep_logs: List[Dict[str, Any]] = []
+    for (ws, we), r in zip(split_date_range(start, end, FITBIT_RANGE_MAX_DAYS["sleep"]), sleep_res):
+        if isinstance(r, Exception):
+            print(f"[WARN] fitbit sleep range fetch failed: {r!r}")
+            incomplete.update(_window_dates(ws, we))
+        else:
+            sleep_logs.extend(r.get("sleep", []))
+    sleep_map = parse_sleep_logs(sleep_logs)
+
+    dates = [(end - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(n)]
+    return [
+        FitbitDay(
+            date=d,
+            steps_total=steps_map.get(d, 0),
+            calories_total=cals_map.get(d, 0),
+            **sleep_map.get(d, {}),
+            **spo2_map.get(d, {}),
+            complete=d not in incomplete,
+        )
+        for d in dates
+    ]
+
+def fitbit_daily_payload(day: FitbitDay) -> Dict[str, Any]:
+    """Fitbit日次サマリのFirestore保存用ペイロードを生成（数値カラム）。取得に失敗したリソースがある日は確定させない"""
+    return {
+        **day.to_dict(),
+        "complete": day.complete,
+        "finalized": day.complete and is_day_finalized(day.date),
         "updated_at": datetime.now(timezone.utc).isoformat(),
     }
-    doc.set(payload, merge=True)
+
+def is_day_finalized(date_str: str) -> bool:
+    """FITBIT_OPEN_DAYS より前の日は同期済みで以後変化しないとみなす"""
+    local_today = datetime.now(timezone.utc).astimezone().date()
+    return date.fromisoformat(date_str) <= local_today - timedelta(days=settings.FITBIT_OPEN_DAYS)
+
+async def save_fitbit_daily_firestore(user_id: str, day: FitbitDay) -> Dict[str, Any]:
+    """Fitbit日次サマリをFirestoreに保存"""
+    doc = user_doc(user_id).collection("fitbit_daily").document(day.date)
+    payload = fitbit_daily_payload(day)
+    await fs_set(doc, payload, merge=True)
     return payload
 
-async def save_last7_fitbit_to_stores(user_id: str = "demo") -> Dict[str, Any]:
-    """直近7日を取得し、FirestoreとBigQueryに保存"""
-    days = await fitbit_last_n_days(7)
+async def save_fitbit_days_with_outbox(user_id: str, days: List[FitbitDay]) -> List[Dict[str, Any]]:
+    """Fitbit日次サマリをFirestoreに保存し、BigQuery MERGE をアウトボックスに積む（1バッチ）"""
+    payloads = [fitbit_daily_payload(d) for d in days]
+    writes = [
+        (user_doc(user_id).collection("fitbit_daily").document(p["date"]), p, True)
+        for p in payloads
+    ]
+    keys, rows = fitbit_unsent_days(user_id, days)
+    items = [
+        (f"fitbit-{user_id}-{r['date']}", "fitbit_days_upsert", {"user_id": user_id, "days": [r]})
+        for r in rows
+    ]
+    await fs_run(commit_with_outbox, writes, items)
+    recent_rows.mark(keys, rows)
+    return payloads
+
+def fitbit_unsent_days(user_id: str, days: List[FitbitDay]) -> tuple[List[str], List[Dict[str, Any]]]:
+    """直近に同じ内容で BigQuery へ積んだ日を除いた (キー, 行) を返す（同じ日の再保存で MERGE を積まない）"""
+    return recent_rows.filter([fitbit_row_id(user_id, d.date) for d in days], [d.to_dict() for d in days])
+
+def fitbit_sync_doc(user_id: str = "demo"):
+    """増分同期カーソルのドキュメント参照"""
+    return user_doc(user_id).collection("private").document("fitbit_sync")
 
-    # Firestore保存
-    saved = []
-    for d in days:
-        saved.append(save_fitbit_daily_firestore(user_id, d))
+def _load_stored_days(user_id: str, start: str, end: str) -> Dict[str, Dict[str, Any]]:
+    """Firestoreに保存済みの日次サマリを日付キーで返す"""
+    q = (user_doc(user_id).collection("fitbit_daily")
+         .where("date", ">=", start)
+         .where("date", "<=", end))
+    return {s.id: s.to_dict() for s in q.stream()}
 
-    # BigQuery保存
-    bq_res = bq_upsert_fitbit_days(user_id, days)
+async def fitbit_sync_window(n: int = 7, user_id: str = "demo", priority: str = "high") -> Dict[str, Any]:
+    """
+    直近n日を増分同期する
 
-    return {"firestore_saved_count": len(saved), "bigquery": bq_res}
+    - finalized な日（FITBIT_OPEN_DAYS より前で保存済み）は Firestore から読むだけ
+    - 未確定の日と欠損日のみ Fitbit から取得し、内容が変わった日だけ書き込む
+    - 同期カーソル users/{uid}/private/fitbit_sync を更新
+    """
+    local_today = datetime.now(timezone.utc).astimezone().date()
+    start = local_today - timedelta(days=n - 1)
+    dates = [(local_today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(n)]
+
+    stored = await fs_run(_load_stored_days, user_id, dates[-1], dates[0])
+    need = [d for d in dates if not (stored.get(d) or {}).get("finalized")]
+
+    fetched: Dict[str, FitbitDay] = {}
+    if need:
+        # 範囲APIは期間の長さに関わらず呼び出し回数が一定なので、必要な最古日〜今日をまとめて取得
+        fetch_start = max(start, date.fromisoformat(min(need)))
+        for d in await fitbit_date_range(fetch_start, local_today, user_id, priority):
+            if d.date in need:
+                fetched[d.date] = d
+
+    changed: List[FitbitDay] = []
+    for d, day in fetched.items():
+        prev = stored.get(d) or {}
+        cur = fitbit_daily_payload(day)
+        # 旧形式（表示文字列）のドキュメントは数値カラムがないため変更扱い＝書き直される
+        if any(prev.get(k) != cur[k] for k in FITBIT_DAY_VALUE_FIELDS) or prev.get("finalized") != cur["finalized"]:
+            changed.append(day)
+
+    if changed:
+        await save_fitbit_days_with_outbox(user_id, changed)
+
+    await fs_set(fitbit_sync_doc(user_id), {
+        "last_synced_at": datetime.now(timezone.utc).isoformat(),
+        "finalized_through": (local_today - timedelta(days=settings.FITBIT_OPEN_DAYS)).strftime("%Y-%m-%d"),
+        "last_fetched_days": len(fetched),
+        "last_changed_days": len(changed),
+    }, merge=True)
+
+    days = [fetched.get(d) or (FitbitDay.from_dict(stored[d]) if d in stored else FitbitDay(date=d))
+            for d in dates]
+    return {"days": days, "fetched": sorted(fetched), "changed": [d.date for d in changed]}
+
+async def save_last7_fitbit_to_stores(user_id: str = "demo") -> Dict[str, Any]:
+    """直近7日を増分同期し、変化した日だけFirestore/BigQuery（アウトボックス経由）に保存"""
+    res = await fitbit_sync_window(7, user_id)
+    return {
+        "firestore_saved_count": len(res["changed"]),
+        "fetched_days": res["fetched"],
+        "changed_days": res["changed"],
+        "bigquery": outbox_result(count=len(res["changed"])),
+    }
@@ -0,0 +1,217 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import time
+from typing import List, Dict, Any, Optional, Tuple
+from google.cloud import firestore
+from app.config import settings
+from app.database.firestore import db, user_doc, fs_run
+from app.database.bigquery import bq_client
+from app.database.outbox import outbox_ref, outbox_item
+from app.database.row_keys import recent_rows
+from app.external.fitbit_client import get_fitbit_access_token, fitbit_get
+from app.external.http_client import get_http_client
+from app.services.fitbit_service import (
+    parse_steps_day, parse_calories_day, parse_sleep_day, fitbit_daily_payload, fitbit_unsent_days
+)
+from app.models.fitbit import FitbitDay
+
+# 通知の collectionType ごとに取得するリソース（SpO2 は購読対象外）
+COLLECTION_RESOURCES = {
+    "activities": ("steps", "calories"),
+    "sleep": ("sleep",),
+}
+
+def verify_signature(body: bytes, signature: Optional[str]) -> bool:
+    """X-Fitbit-Signature（HMAC-SHA1, key=client_secret&）を検証（シークレット未設定なら拒否）"""
+    if not settings.FITBIT_CLIENT_SECRET:
+        print("[WARN] fitbit webhook rejected: FITBIT_CLIENT_SECRET not set")
+        return False
+    if not signature:
+        return False
+    key = f"{settings.FITBIT_CLIENT_SECRET}&".encode()
+    expected = base64.b64encode(hmac.new(key, body, hashlib.sha1).digest()).decode()
+    return hmac.compare_digest(expected, signature)
+
+async def fetch_resource_fields(user_id: str, resource: str, date_str: str) -> Dict[str, Any]:
+    """通知された1リソース・1日分だけを取得して日次サマリの該当フィールドを返す"""
+    access = await get_fitbit_access_token(user_id)
+    base = "https://api.fitbit.com"
+    if resource == "steps":
+        j = await fitbit_get(access, f"{base}/1/user/-/activities/steps/date/{date_str}/1d.json", user_id, "low")
+        return {"steps_total": parse_steps_day(j)}
+    if resource == "calories":
+        j = await fitbit_get(access, f"{base}/1/user/-/activities/calories/date/{date_str}/1d.json", user_id, "low")
+        return {"calories_total": parse_calories_day(j)}
+    if resource == "sleep":
+        j = await fitbit_get(access, f"{base}/1.2/user/-/sleep/date/{date_str}.json", user_id, "low")
+        # 睡眠が削除された場合も反映されるよう、データなしは None で上書き
+        return {"sleep_minutes": None, "sleep_deep_min": None, "sleep_rem_min": None,
+                "sleep_light_min": None, "sleep_wake_min": None, **parse_sleep_day(j)}
+    raise ValueError(f"unsupported resource: {resource}")
+
+@firestore.transactional
+def _merge_day_fields(transaction, doc, user_id: str, date_str: str, fields: Dict[str, Any]):
+    """日次サマリの読み取り→マージ→書き込みとアウトボックス項目を1トランザクションで行う"""
+    snap = doc.get(transaction=transaction)
+    current = snap.to_dict() if snap.exists else {}
+    day = FitbitDay.from_dict({**current, "date": date_str}).with_fields(**fields)
+    payload = fitbit_daily_payload(day)
+    keys, rows = fitbit_unsent_days(user_id, [day])
+    transaction.set(doc, payload, merge=True)
+    if bq_client and rows:
+        transaction.set(outbox_ref(f"fitbit-{user_id}-{date_str}"),
+                        outbox_item("fitbit_days_upsert", {"user_id": user_id, "days": rows}))
+    return payload, keys, rows
+
+def apply_day_fields(user_id: str, date_str: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    既存の日次サマリに部分更新をマージし、Firestore と BigQuery(アウトボックス) に反映
+
+    同じ日の activities と sleep を別ワーカーが同時に処理しても互いのフィールドを消さないよう、
+    トランザクション内で読み直してからマージする（競合時は Firestore が再実行する）。
+    """
+    doc = user_doc(user_id).collection("fitbit_daily").document(date_str)
+    payload, keys, rows = _merge_day_fields(db.transaction(), doc, user_id, date_str, fields)
+    recent_rows.mark(keys, rows)
+    return payload
+
+class FitbitWebhookWorker:
+    """
+    Subscription API 通知を処理するバックグラウンドワーカー
+
+    (user_id, collectionType, date) 単位で重複排除する。
+    - 処理待ちの通知、直近 FITBIT_WEBHOOK_DEDUPE_SEC 秒以内に成功した通知は捨てる
+    - 取得中に届いた通知は dirty として記録し、処理後にもう一度積む（取得開始後の更新を取りこぼさない）
+    - 失敗した通知は FITBIT_WEBHOOK_MAX_RETRIES 回までバックオフして再試行（Fitbit には 204 済みで再送されない）
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: set = set()
+        self._running: set = set()
+        self._dirty: set = set()
+        self._attempts: Dict[Tuple[str, str, str], int] = {}
+        self._recent: Dict[Tuple[str, str, str], float] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"received": 0, "enqueued": 0, "deduped": 0, "requeued": 0,
+                      "retried": 0, "processed": 0, "failed": 0, "gave_up": 0}
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(settings.FITBIT_WEBHOOK_WORKERS)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        for t in self._tasks:
+            try:
+                await t
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def _enqueue(self, key: Tuple[str, str, str]) -> None:
+        self._pending.add(key)
+        self._queue.put_nowait(key)
+
+    def submit(self, notifications: List[Dict[str, Any]]) -> int:
+        """通知バッチを積む（即座に戻る）。積んだ件数を返す"""
+        if self._queue is None:
+            self.start()
+        now = time.monotonic()
+        added = 0
+        for n in notifications:
+            self.stats["received"] += 1
+            user_id = n.get("subscriptionId") or "demo"
+            collection = n.get("collectionType")
+            date_str = n.get("date")
+            if collection not in COLLECTION_RESOURCES or not date_str:
+                continue
+            key = (user_id, collection, date_str)
+            if key in self._running:
+                # 取得中：終わったらもう一度取りに行く
+                self._dirty.add(key)
+                self.stats["deduped"] += 1
+                continue
+            if key in self._pending or now - self._recent.get(key, -1e9) < settings.FITBIT_WEBHOOK_DEDUPE_SEC:
+                self.stats["deduped"] += 1
+                continue
+            self._enqueue(key)
+            added += 1
+        self.stats["enqueued"] += added
+        return added
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "queue_depth": self._queue.qsize() if self._queue else 0,
+                "running": len(self._running), "retrying": len(self._attempts)}
+
+    def _retry_later(self, key: Tuple[str, str, str]) -> None:
+        attempts = self._attempts.get(key, 0) + 1
+        if attempts > settings.FITBIT_WEBHOOK_MAX_RETRIES:
+            self._attempts.pop(key, None)
+            self.stats["gave_up"] += 1
+            print(f"[ERROR] fitbit webhook {key} gave up after {attempts - 1} retries")
+            return
+        self._attempts[key] = attempts
+        self.stats["retried"] += 1
+        # 待機中も処理待ち扱いにして、同じ通知を重ねて積まない
+        self._pending.add(key)
+        asyncio.get_running_loop().call_later(
+            min(300.0, 5.0 * (2 ** (attempts - 1))), self._queue.put_nowait, key
+        )
+
+    async def _run(self) -> None:
+        while True:
+            key = await self._queue.get()
+            user_id, collection, date_str = key
+            self._pending.discard(key)
+            self._running.add(key)
+            try:
+                fields: Dict[str, Any] = {}
+                for resource in COLLECTION_RESOURCES[collection]:
+                    fields.update(await fetch_resource_fields(user_id, resource, date_str))
+                await fs_run(apply_day_fields, user_id, date_str, fields)
+                self.stats["processed"] += 1
+                self._attempts.pop(key, None)
+                self._recent[key] = time.monotonic()
+                self._prune_recent()
+                ok = True
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"[WARN] fitbit webhook {key} failed: {e!r}")
+                ok = False
+            finally:
+                self._running.discard(key)
+                self._queue.task_done()
+            if key in self._dirty:
+                # 取得中に新しい通知が来ていたら取り直す（失敗時の再試行も兼ねる）
+                self._dirty.discard(key)
+                self._attempts.pop(key, None)
+                self.stats["requeued"] += 1
+                self._enqueue(key)
+            elif not ok:
+                self._retry_later(key)
+
+    def _prune_recent(self) -> None:
+        if len(self._recent) < 10000:
+            return
+        cutoff = time.monotonic() - settings.FITBIT_WEBHOOK_DEDUPE_SEC
+        self._recent = {k: v for k, v in self._recent.items() if v >= cutoff}
+
+fitbit_webhook_worker = FitbitWebhookWorker()
+
+async def create_subscription(user_id: str = "demo", collection: Optional[str] = None) -> Dict[str, Any]:
+    """Fitbit Subscription API に購読を登録（subscriptionId に自アプリの user_id を使う）"""
+    access = await get_fitbit_access_token(user_id)
+    path = f"/{collection}" if collection else ""
+    headers = {"Authorization": f"Bearer {access}"}
+    if settings.FITBIT_SUBSCRIBER_ID:
+        headers["X-Fitbit-Subscriber-Id"] = settings.FITBIT_SUBSCRIBER_ID
+    client = get_http_client("fitbit")
+    r = await client.post(f"https://api.fitbit.com/1/user/-{path}/apiSubscriptions/{user_id}.json", headers=headers)
+    r.raise_for_status()
+    return r.json() if r.content else {}
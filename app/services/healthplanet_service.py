@@ -1,9 +1,24 @@
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+import asyncio
+import time
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Any, Optional
+from google.cloud import bigquery
 from app.external.healthplanet_client import fetch_innerscan_data, jst_now, format_datetime
 from app.database.bigquery import bq_client
+from app.database.firestore import user_doc, fs_get, fs_set
+from app.database.row_keys import hp_row_id, recent_rows
+from app.database.schema import get_spec
+from app.models.healthplanet import BodyMeasurement, INNERSCAN_TAGS, BODY_VALUE_FIELDS
+from app.utils.async_utils import gather_limited
+from app.utils.date_utils import split_date_range
 from app.config import settings
 
+# MERGE 1回あたりの行数（クエリパラメータの配列で渡す）
+_HP_MERGE_BATCH_ROWS = 1000
+
+# ワイド行の値カラム → BigQuery 型
+_BODY_BQ_COLUMNS = [(col, {c: t for c, t in INNERSCAN_TAGS.values()}[col]) for col in BODY_VALUE_FIELDS] + [("model", "STRING")]
+
 def parse_innerscan_for_prompt(raw_data: Dict[str, Any]) -> List[Dict[str, Any]]:
     """APIレスポンスをプロンプト用に整形"""
     rows: Dict[str, Dict[str, Any]] = {}
@@ -43,26 +58,12 @@ def summarize_for_prompt(rows: List[Dict[str, Any]]) -> str:
     return "HealthPlanet 過去7日:\n" + "\n".join(lines)
 
 def to_bigquery_rows(user_id: str, raw_data: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """BigQuery用の行データに変換"""
-    rows: List[Dict[str, Any]] = []
+    """BigQuery用の行データに変換（測定時刻ごとに全タグを1行にまとめ、raw は持たない）"""
     now = jst_now().isoformat()
-    
-    for item in raw_data.get("data", []):
-        value = item.get("keydata")
-        if value in (None, ""):
-            continue
-        
-        rows.append({
-            "user_id": user_id,
-            "measured_at": datetime.strptime(item["date"], "%Y%m%d%H%M%S").isoformat(),
-            "tag": item.get("tag"),
-            "value": float(value),
-            "unit": item.get("unit") or None,
-            "ingested": now,
-            "raw": item,
-        })
-    
-    return rows
+    return [
+        {"user_id": user_id, **m.to_dict(), "ingested": now}
+        for m in BodyMeasurement.pivot(raw_data.get("data", []))
+    ]
 
 async def fetch_last7_data(user_id: str = "demo") -> Dict[str, Any]:
     """過去7日間のHealth Planetデータを取得"""
@@ -73,13 +74,64 @@ async def fetch_last7_data(user_id: str = "demo") -> Dict[str, Any]:
     return await fetch_innerscan_data(
         user_id=user_id,
         date=1,  # 測定日付
-        tag="6021,6022",  # 体重・体脂肪率
+        tag=settings.HP_INNERSCAN_TAGS,  # 全タグ（保存時にワイド行にする）
         from_dt=format_datetime(start),
         to_dt=format_datetime(end)
     )
 
+def bigquery_row_ids(rows: List[Dict[str, Any]]) -> List[str]:
+    """行ごとのキー（(user, measured_at) から決定的に作る）"""
+    return [hp_row_id(r["user_id"], r["measured_at"]) for r in rows]
+
+def _merge_body_rows(rows: List[Dict[str, Any]]) -> None:
+    """(user_id, measured_at) をキーに1回のMERGEで上書き（何度呼んでも行は増えない）"""
+    structs = [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter("user_id", "STRING", r["user_id"]),
+            bigquery.ScalarQueryParameter("measured_at", "DATETIME", datetime.fromisoformat(r["measured_at"])),
+            *[bigquery.ScalarQueryParameter(name, bq_type, r.get(name)) for name, bq_type in _BODY_BQ_COLUMNS],
+        )
+        for r in rows
+    ]
+    cols = [name for name, _ in _BODY_BQ_COLUMNS]
+    sql = f"""
+    MERGE `{get_spec(settings.HP_BQ_TABLE_BODY).table_id}` T
+    USING (SELECT r.* FROM UNNEST(@rows) AS r) S
+    ON T.user_id = S.user_id AND T.measured_at = S.measured_at
+    WHEN MATCHED THEN
+        UPDATE SET {", ".join(f"{c} = S.{c}" for c in cols)}, ingested = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+        INSERT (user_id, measured_at, {", ".join(cols)}, ingested)
+        VALUES (S.user_id, S.measured_at, {", ".join(f"S.{c}" for c in cols)}, CURRENT_TIMESTAMP())
+    """
+    cfg = bigquery.QueryJobConfig(query_parameters=[bigquery.ArrayQueryParameter("rows", "STRUCT", structs)])
+    bq_client.query(sql, job_config=cfg).result()
+
+def upsert_hp_rows(rows: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    測定行を MERGE で保存する
+
+    直近に同じ内容で保存済みの行はクエリを投げる前に落とし（プロセス内の一次フィルタ）、
+    成功した行だけ送信済みとして記録する。
+    """
+    # 同じ測定が複数あれば後勝ち（MERGEのソース重複を避ける）
+    rows = list({(r["user_id"], r["measured_at"]): r for r in rows}.values())
+    row_ids, rows = recent_rows.filter(bigquery_row_ids(rows), rows)
+    failed = 0
+    for i in range(0, len(rows), _HP_MERGE_BATCH_ROWS):
+        batch = rows[i:i + _HP_MERGE_BATCH_ROWS]
+        try:
+            _merge_body_rows(batch)
+        except Exception as e:
+            failed += len(batch)
+            print(f"[ERROR] HP merge failed: {e}")
+            continue
+        recent_rows.mark(row_ids[i:i + _HP_MERGE_BATCH_ROWS], batch)
+    return {"sent": len(rows) - failed, "failed": failed}
+
 def save_to_bigquery(user_id: str, raw_data: Dict[str, Any]) -> Dict[str, Any]:
-    """Health PlanetデータをBigQueryに保存"""
+    """Health PlanetデータをBigQueryに保存（(user_id, measured_at) で MERGE するので再保存しても増えない）"""
     if not bq_client:
         return {"ok": False, "reason": "BigQuery not configured"}
     
@@ -87,8 +139,219 @@ def save_to_bigquery(user_id: str, raw_data: Dict[str, Any]) -> Dict[str, Any]:
     if not rows:
         return {"ok": True, "saved": 0, "reason": "no data"}
     
-    errors = bq_client.insert_rows_json(settings.HP_BQ_TABLE, rows)
-    if errors:
-        return {"ok": False, "errors": errors}
+    res = upsert_hp_rows(rows)
+    if res["failed"]:
+        return {"ok": False, "saved": res["sent"], "failed": res["failed"]}
     
-    return {"ok": True, "saved": len(rows)}
+    return {"ok": True, "saved": res["sent"], "skipped": len(rows) - res["sent"]}
+
+def migrate_legacy_rows() -> Dict[str, Any]:
+    """旧テーブル（タグごとの縦持ち）を測定ごとのワイド行に変換して取り込む（既にある測定は触らない）"""
+    if not bq_client:
+        return {"ok": False, "reason": "BigQuery not configured"}
+
+    pivots = []
+    for col in BODY_VALUE_FIELDS:
+        tags = [t for t, (c, _) in INNERSCAN_TAGS.items() if c == col]
+        bq_type = INNERSCAN_TAGS[tags[0]][1]
+        # 同じ列に複数タグがある場合は先頭のタグを優先（内臓脂肪 6025 > 6026）
+        expr = "COALESCE(" + ", ".join(f"MAX(IF(tag='{t}', value, NULL))" for t in tags) + ")"
+        pivots.append(f"CAST({expr} AS {bq_type}) AS {col}")
+    cols = ["user_id", "measured_at", *BODY_VALUE_FIELDS, "model", "ingested"]
+    sql = f"""
+    MERGE `{get_spec(settings.HP_BQ_TABLE_BODY).table_id}` T
+    USING (
+        SELECT user_id, measured_at,
+               {", ".join(pivots)},
+               ANY_VALUE(JSON_VALUE(raw, '$.model')) AS model,
+               MAX(ingested) AS ingested
+        FROM `{get_spec(settings.HP_BQ_TABLE).table_id}`
+        GROUP BY user_id, measured_at
+    ) S
+    ON T.user_id = S.user_id AND T.measured_at = S.measured_at
+    WHEN NOT MATCHED THEN
+        INSERT ({", ".join(cols)})
+        VALUES ({", ".join(f"S.{c}" for c in cols)})
+    """
+    try:
+        job = bq_client.query(sql)
+        job.result()
+    except Exception as e:
+        print(f"[ERROR] HP legacy migration failed: {e}")
+        return {"ok": False, "error": str(e)}
+    return {"ok": True, "inserted": job.num_dml_affected_rows}
+
+# ---- 履歴インポート ----
+
+def healthplanet_import_doc(user_id: str = "demo"):
+    """履歴インポートのチェックポイント（users/{uid}/private/healthplanet_import）"""
+    return user_doc(user_id).collection("private").document("healthplanet_import")
+
+def import_windows(start: datetime, end: datetime, max_days: Optional[int] = None) -> List[tuple[datetime, datetime]]:
+    """[start, end] を Health Planet の期間上限に収まる日時ウィンドウに分割（古い順）"""
+    windows = []
+    for w_start, w_end in split_date_range(start.date(), end.date(), max_days or settings.HP_IMPORT_WINDOW_DAYS):
+        windows.append((
+            max(start, datetime(w_start.year, w_start.month, w_start.day)),
+            min(end, datetime(w_end.year, w_end.month, w_end.day, 23, 59, 59)),
+        ))
+    return windows
+
+def _merge_ranges(ranges: List[tuple[datetime, datetime]]) -> List[tuple[datetime, datetime]]:
+    """取り込み済み区間を昇順に並べ、重なる・隣接する区間をまとめる"""
+    merged: List[tuple[datetime, datetime]] = []
+    for r_start, r_end in sorted(ranges):
+        if merged and r_start <= merged[-1][1] + timedelta(seconds=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], r_end))
+        else:
+            merged.append((r_start, r_end))
+    return merged
+
+def _uncovered(start: datetime, end: datetime, done: List[tuple[datetime, datetime]]) -> List[tuple[datetime, datetime]]:
+    """[start, end] のうち取り込み済み区間に含まれない部分（古い順）"""
+    gaps: List[tuple[datetime, datetime]] = []
+    cur = start
+    for d_start, d_end in _merge_ranges(done):
+        if d_end < cur:
+            continue
+        if d_start > end:
+            break
+        if d_start > cur:
+            gaps.append((cur, d_start - timedelta(seconds=1)))
+        cur = max(cur, d_end + timedelta(seconds=1))
+    if cur <= end:
+        gaps.append((cur, end))
+    return gaps
+
+def _ranges_to_doc(ranges: List[tuple[datetime, datetime]]) -> List[Dict[str, str]]:
+    # Firestore は配列の入れ子を持てないので {from, to} の配列で保存
+    return [{"from": a.isoformat(), "to": b.isoformat()} for a, b in _merge_ranges(ranges)]
+
+def _ranges_from_doc(items: List[Dict[str, str]]) -> List[tuple[datetime, datetime]]:
+    return [(datetime.fromisoformat(r["from"]), datetime.fromisoformat(r["to"])) for r in items or []]
+
+async def import_healthplanet_history(
+    user_id: str = "demo",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    reset: bool = False,
+) -> Dict[str, Any]:
+    """
+    Health Planet の体組成履歴を BigQuery に取り込む
+
+    - 期間を HP_IMPORT_WINDOW_DAYS 日（3か月以内）のウィンドウに分割し、HP_IMPORT_CONCURRENCY 並列で取得
+    - 各ウィンドウは取得し次第 (user_id, measured_at) で BigQuery に MERGE（全期間をメモリに溜めない）
+    - start 省略時はチェックポイント（最後に取り込んだ測定時刻）の直後から再開
+    - チェックポイントは古い側から途切れず成功したウィンドウまでしか進めない（失敗区間は次回やり直し）
+    - 成功したウィンドウの区間は done_ranges に記録し、再実行時は未取り込みの区間だけ取得する
+    """
+    if not bq_client:
+        return {"ok": False, "reason": "BigQuery not configured"}
+
+    doc = healthplanet_import_doc(user_id)
+    snap = await fs_get(doc)
+    state = (snap.to_dict() or {}) if snap.exists and not reset else {}
+    if reset and snap.exists:
+        await fs_set(doc, {"reset_at": jst_now().isoformat()})
+
+    now = jst_now().replace(tzinfo=None)
+    end_dt = min(now, datetime(end.year, end.month, end.day, 23, 59, 59)) if end else now
+    if start:
+        start_dt = datetime(start.year, start.month, start.day)
+    elif state.get("last_measured_at"):
+        start_dt = datetime.fromisoformat(state["last_measured_at"]) + timedelta(seconds=1)
+    else:
+        start_dt = datetime(now.year, now.month, now.day) - timedelta(days=settings.HP_IMPORT_DAYS - 1)
+    if start_dt > end_dt:
+        return {"ok": True, "user_id": user_id, "windows": 0, "rows": 0, **state}
+
+    done = _ranges_from_doc(state.get("done_ranges"))
+    windows = [w for gap in _uncovered(start_dt, end_dt, done) for w in import_windows(*gap)]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(windows)
+    lock = asyncio.Lock()
+    # 同じテーブルへの MERGE を並行させると競合で失敗しうるため、取得は並列・書き込みは直列
+    write_lock = asyncio.Lock()
+    progress = {"next": 0, "last_measured_at": state.get("last_measured_at"), "done": done}
+    t0 = time.monotonic()
+
+    async def advance_checkpoint(i: int) -> None:
+        async with lock:
+            if not results[i]["ok"]:
+                return
+            progress["done"] = _merge_ranges(progress["done"] + [windows[i]])
+            # 完了順はばらばらなので、last_measured_at は古い側から連続して成功した分だけ進める
+            while progress["next"] < len(results) and (r := results[progress["next"]]) and r["ok"]:
+                if r["last_measured_at"]:
+                    progress["last_measured_at"] = max(progress["last_measured_at"] or "", r["last_measured_at"])
+                progress["next"] += 1
+            checkpoint = {"done_ranges": _ranges_to_doc(progress["done"]), "updated_at": jst_now().isoformat()}
+            if progress["last_measured_at"]:
+                checkpoint["last_measured_at"] = progress["last_measured_at"]
+            await fs_set(doc, checkpoint, merge=True)
+
+    async def run_window(i: int, w_start: datetime, w_end: datetime) -> None:
+        try:
+            raw = await fetch_innerscan_data(
+                user_id=user_id,
+                date=1,
+                tag=settings.HP_INNERSCAN_TAGS,
+                from_dt=format_datetime(w_start),
+                to_dt=format_datetime(w_end),
+            )
+            rows = to_bigquery_rows(user_id, raw)
+            failed = 0
+            if rows:
+                async with write_lock:
+                    failed = (await asyncio.to_thread(upsert_hp_rows, rows))["failed"]
+            results[i] = {
+                "ok": failed == 0,
+                "rows": len(rows),
+                "failed": failed,
+                "last_measured_at": max((r["measured_at"] for r in rows), default=None),
+            }
+        except Exception as e:
+            print(f"[WARN] HP import window {w_start:%Y-%m-%d}..{w_end:%Y-%m-%d} failed: {e!r}")
+            results[i] = {"ok": False, "rows": 0, "failed": 0, "last_measured_at": None, "error": repr(e)}
+        await advance_checkpoint(i)
+
+    await gather_limited(
+        (run_window(i, ws, we) for i, (ws, we) in enumerate(windows)),
+        limit=settings.HP_IMPORT_CONCURRENCY,
+    )
+
+    elapsed = time.monotonic() - t0
+    rows_total = sum(r["rows"] for r in results if r)
+    failed_windows = [
+        {"start": ws.isoformat(), "end": we.isoformat(), "error": r.get("error") or f"{r['failed']} rows failed"}
+        for (ws, we), r in zip(windows, results) if r and not r["ok"]
+    ]
+    final = {
+        "last_run": {
+            "start": start_dt.isoformat(),
+            "end": end_dt.isoformat(),
+            "windows": len(windows),
+            "rows": rows_total,
+            "failed_windows": len(failed_windows),
+            "seconds": round(elapsed, 2),
+            "finished_at": jst_now().isoformat(),
+        },
+        "updated_at": jst_now().isoformat(),
+    }
+    await fs_set(doc, final, merge=True)
+    return {
+        "ok": not failed_windows,
+        "user_id": user_id,
+        "windows": len(windows),
+        "rows": rows_total,
+        "rows_per_sec": round(rows_total / elapsed, 1) if elapsed > 0 else None,
+        "elapsed_sec": round(elapsed, 2),
+        "last_measured_at": progress["last_measured_at"],
+        "failed": failed_windows,
+    }
+
+async def healthplanet_import_status(user_id: str = "demo") -> Dict[str, Any]:
+    """履歴インポートのチェックポイントと前回実行結果"""
+    snap = await fs_get(healthplanet_import_doc(user_id))
+    if not snap.exists:
+        return {"ok": True, "user_id": user_id, "status": "none"}
+    return {"ok": True, "user_id": user_id, **snap.to_dict()}
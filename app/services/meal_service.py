@@ -1,8 +1,10 @@
 from datetime import datetime, timezone, timedelta
-from typing import Dict, List, Any
-from app.database.firestore import user_doc
-from app.database.bigquery import bq_insert_rows
+from typing import Dict, List, Any, Optional
+from app.database.firestore import user_doc, fs_stream
+from app.database.outbox import commit_with_outbox, outbox_result
+from app.database.row_keys import meal_row_id
 from app.config import settings
+from app.utils.image_utils import hamming_hex
 
 def to_when_date_str(iso_str: str | None) -> str:
     """ISO8601文字列の先頭10桁(YYYY-MM-DD)を日付キーとして返す"""
@@ -26,7 +28,7 @@ async def meals_last_n_days(n: int = 7, user_id: str = "demo") -> Dict[str, List
          .order_by("when_date"))
 
     result: Dict[str, List[Dict[str, Any]]] = {}
-    for snap in q.stream():
+    for snap in await fs_stream(q):
         d = snap.to_dict()
         key = d.get("when_date") or (d.get("when", "")[:10])
         result.setdefault(key, []).append({
@@ -37,13 +39,37 @@ async def meals_last_n_days(n: int = 7, user_id: str = "demo") -> Dict[str, List
         })
     return result
 
+async def find_similar_meal(dhash: str, user_id: str = "demo") -> Optional[Dict[str, Any]]:
+    """
+    直近の画像食事から dHash が MEAL_DEDUPE_MAX_DISTANCE 以内のものを探す
+    見つかれば {meal_id, text, when_date, distance} を返す
+    """
+    q = (user_doc(user_id)
+         .collection("meals")
+         .order_by("created_at", direction="DESCENDING")
+         .limit(settings.MEAL_DEDUPE_LOOKBACK)
+         .select(["dhash", "text", "when_date"]))
+
+    best: Optional[Dict[str, Any]] = None
+    for snap in await fs_stream(q):
+        d = snap.to_dict() or {}
+        other = d.get("dhash")
+        if not other or not d.get("text"):
+            continue
+        try:
+            dist = hamming_hex(dhash, other)
+        except ValueError:
+            continue
+        if dist <= settings.MEAL_DEDUPE_MAX_DISTANCE and (best is None or dist < best["distance"]):
+            best = {"meal_id": snap.id, "text": d["text"], "when_date": d.get("when_date"), "distance": dist}
+            if dist == 0:
+                break
+    return best
+
 def save_meal_to_stores(meal_data: Dict[str, Any], user_id: str = "demo") -> Dict[str, Any]:
-    """食事データをFirestoreとBigQueryに保存"""
-    # Firestore保存
-    meals = user_doc(user_id).collection("meals")
-    meals.document().set(meal_data)
+    """食事データをFirestoreに保存し、BigQueryへのミラーをアウトボックスに積む"""
+    meal_ref = user_doc(user_id).collection("meals").document()
 
-    # BigQuery保存
     bq_data = {
         "user_id": user_id,
         "when": meal_data["when"],
@@ -56,8 +82,11 @@ def save_meal_to_stores(meal_data: Dict[str, Any], user_id: str = "demo") -> Dic
         "ingested_at": datetime.now(timezone.utc).isoformat(),
     }
     
-    bq_result = bq_insert_rows(settings.BQ_TABLE_MEALS, [bq_data])
-    if not bq_result.get("ok"):
-        print(f"[ERROR] BQ insert meals failed: {bq_result.get('errors')}")
+    # Firestore保存とBigQueryミラー項目を同一バッチでコミット（BQ障害でも行を失わない）
+    commit_with_outbox(
+        [(meal_ref, meal_data, False)],
+        [(f"meal-{user_id}-{meal_ref.id}", "insert_rows",
+          {"table": settings.BQ_TABLE_MEALS, "rows": [bq_data], "row_ids": [meal_row_id(meal_ref.id)]})],
+    )
     
-    return {"firestore": True, "bigquery": bq_result}
+    return {"firestore": True, "bigquery": outbox_result(), "meal_id": meal_ref.id}
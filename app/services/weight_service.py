@@ -1,15 +1,14 @@
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict, Any
 from app.external.healthplanet_client import fetch_innerscan_data, get_access_token, jst_now, format_datetime
-from app.database.firestore import user_doc
+from app.database.firestore import user_doc, fs_get
 
-def get_manual_weight(user_id: str = "demo") -> Optional[Dict[str, Any]]:
+async def get_manual_weight(user_id: str = "demo") -> Optional[Dict[str, Any]]:
     """Firestoreから手入力体重を取得"""
-    doc = (
+    doc = await fs_get(
         user_doc(user_id)
         .collection("profile")
         .document("latest")
-        .get()
     )
     if not doc.exists:
         return None
@@ -59,7 +58,7 @@ async def get_current_weight(user_id: str = "demo", days: int = 1) -> Dict[str,
     hp_payload = {"found": False}
     
     try:
-        access = get_access_token(user_id)
+        access = await get_access_token(user_id)
         if access:
             today = jst_now().date()
             start = datetime(today.year, today.month, today.day, 0, 0, 0) - timedelta(days=days-1)
@@ -85,7 +84,7 @@ async def get_current_weight(user_id: str = "demo", days: int = 1) -> Dict[str,
         pass
     
     # 手入力データを取得
-    manual = get_manual_weight(user_id)
+    manual = await get_manual_weight(user_id)
     manual_payload = {"found": bool(manual), **(manual or {})}
     
     # 優先ロジック：Health Planetがあれば優先、なければ手入力
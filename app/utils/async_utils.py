@@ -0,0 +1,19 @@
+import asyncio
+import functools
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Iterable, List
+
+async def gather_limited(aws: Iterable[Awaitable[Any]], limit: int = 4, return_exceptions: bool = True) -> List[Any]:
+    """同時実行数を limit に制限して asyncio.gather する（結果は入力順）"""
+    sem = asyncio.Semaphore(max(1, limit))
+
+    async def run(aw: Awaitable[Any]) -> Any:
+        async with sem:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws), return_exceptions=return_exceptions)
+
+async def run_in_executor(executor: Executor, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """同期関数を指定 executor 上で実行し、イベントループをブロックしない"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
@@ -0,0 +1,74 @@
+import json
+from typing import Dict, Any, Callable, Awaitable
+
+# multipart の境界・ヘッダ分の余裕
+_MULTIPART_OVERHEAD = 64 * 1024
+
+async def _send_413(send: Callable[..., Awaitable[None]], limit: int) -> None:
+    body = json.dumps({"ok": False, "error": f"request body too large (>{limit} bytes)"}).encode()
+    await send({"type": "http.response.start", "status": 413,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+class BodySizeLimitMiddleware:
+    """
+    パスごとにリクエストボディの上限を掛ける ASGI ミドルウェア
+
+    UploadFile はハンドラに届く前に全体がスプールされるため、ハンドラ側の読み取り制限では
+    受信量もメモリも抑えられない。Content-Length で先に弾き、chunked 等で長さが不明なときは
+    受信しながら数えて上限を超えた時点で打ち切る。
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    def _limit_for(self, path: str) -> int:
+        for prefix, limit in self.limits.items():
+            if path.startswith(prefix):
+                return limit + _MULTIPART_OVERHEAD
+        return 0
+
+    async def __call__(self, scope: Dict[str, Any], receive, send) -> None:
+        limit = self._limit_for(scope.get("path", "")) if scope["type"] == "http" else 0
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    if int(value) > limit:
+                        await _send_413(send, limit - _MULTIPART_OVERHEAD)
+                        return
+                except ValueError:
+                    pass
+
+        received = 0
+        started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # アプリ側の例外処理（フォーム解析の 400 等）に握りつぶされないよう、ここで直接応答する
+                    rejected = True
+                    if not started:
+                        await _send_413(send, limit - _MULTIPART_OVERHEAD)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        await self.app(scope, limited_receive, tracked_send)
@@ -1,4 +1,5 @@
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, date, timezone, timedelta
+from typing import List, Tuple
 
 def to_when_date_str(iso_str: str | None) -> str:
     """ISO8601文字列の先頭10桁(YYYY-MM-DD)を日付キーとして返す"""
@@ -53,3 +54,13 @@ def days_ago(date_str: str, timezone_offset: int = 9) -> int:
         return (today - target_date).days
     except ValueError:
         return -1
+
+def split_date_range(start: date, end: date, max_days: int) -> List[Tuple[date, date]]:
+    """[start, end] を max_days 日以下の連続ウィンドウに分割（古い順）"""
+    windows: List[Tuple[date, date]] = []
+    cur = start
+    while cur <= end:
+        w_end = min(end, cur + timedelta(days=max_days - 1))
+        windows.append((cur, w_end))
+        cur = w_end + timedelta(days=1)
+    return windows
@@ -0,0 +1,108 @@
+import io
+import time
+from typing import Dict, Any, Tuple
+from fastapi import HTTPException, UploadFile
+from app.config import settings
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 未導入環境では縮小せずそのまま送る
+    Image = None
+    ImageOps = None
+
+_CHUNK = 64 * 1024
+
+async def read_upload_limited(file: UploadFile, max_bytes: int) -> bytes:
+    """アップロードをチャンク単位で読み、max_bytes を超えた時点で 413 を返す（受信自体の上限は BodySizeLimitMiddleware）"""
+    buf = bytearray()
+    while True:
+        chunk = await file.read(_CHUNK)
+        if not chunk:
+            break
+        buf.extend(chunk)
+        if len(buf) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"image too large (>{max_bytes} bytes)")
+    return bytes(buf)
+
+def _target_size(w: int, h: int, detail: str) -> Tuple[int, int]:
+    """Vision モデルが実際に使う解像度に合わせた縮小後サイズ"""
+    if detail == "low":
+        limit_long, limit_short = settings.VISION_LOW_DETAIL_MAX_SIDE, settings.VISION_LOW_DETAIL_MAX_SIDE
+    else:
+        limit_long, limit_short = settings.VISION_MAX_LONG_SIDE, settings.VISION_MAX_SHORT_SIDE
+    scale = min(1.0, limit_long / max(w, h), limit_short / min(w, h))
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+def dhash_hex(img, size: int = 8) -> str:
+    """差分ハッシュ (dHash, 64bit) を16進文字列で返す。再圧縮・縮小に強い"""
+    small = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    px = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = px[row * (size + 1) + col]
+            right = px[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return f"{bits:0{size * size // 4}x}"
+
+def hamming_hex(a: str, b: str) -> int:
+    """16進ハッシュ同士のハミング距離"""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def choose_detail(w: int, h: int) -> str:
+    """VISION_DETAIL=auto のとき、小さい画像は low、それ以外は high"""
+    if settings.VISION_DETAIL in ("low", "high"):
+        return settings.VISION_DETAIL
+    return "low" if max(w, h) <= settings.VISION_LOW_DETAIL_MAX_SIDE else "high"
+
+def prepare_image_for_vision(data: bytes, mime: str | None) -> Tuple[bytes, str, str, Dict[str, Any]]:
+    """
+    画像をデコード→縮小→再エンコードして (bytes, mime, detail, stats) を返す
+
+    CPU処理なので async ハンドラからは asyncio.to_thread で呼ぶ。
+    デコードできない場合は元データをそのまま返す。
+    """
+    t0 = time.perf_counter()
+    stats: Dict[str, Any] = {"original_bytes": len(data)}
+    if Image is None:
+        stats["skipped"] = "pillow not installed"
+        return data, mime or "image/jpeg", "auto", stats
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        w, h = img.size
+        detail = choose_detail(w, h)
+        tw, th = _target_size(w, h, detail)
+        # JPEG はデコード時点で縮小（メモリと時間を節約）
+        img.draft("RGB", (tw, th))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        w2, h2 = img.size
+        stats["dhash"] = dhash_hex(img)
+        tw, th = _target_size(w2, h2, detail)
+        if (tw, th) != (w2, h2):
+            img = img.resize((tw, th), Image.LANCZOS)
+
+        fmt = settings.VISION_IMAGE_FORMAT.upper()
+        out = io.BytesIO()
+        img.save(out, format=fmt, quality=settings.VISION_IMAGE_QUALITY, optimize=True)
+        encoded = out.getvalue()
+    except Exception as e:
+        stats["skipped"] = f"decode failed: {e!r}"
+        return data, mime or "image/jpeg", "auto", stats
+
+    # 再エンコードで大きくなる場合（既に小さいJPEG等）は元データを使う
+    if len(encoded) >= len(data) and (tw, th) == (w, h):
+        encoded, out_mime = data, mime or "image/jpeg"
+    else:
+        out_mime = "image/webp" if fmt == "WEBP" else "image/jpeg"
+
+    stats.update({
+        "original_size": [w, h],
+        "sent_size": list(img.size),
+        "sent_bytes": len(encoded),
+        "detail": detail,
+        "preprocess_ms": round((time.perf_counter() - t0) * 1000, 1),
+    })
+    return encoded, out_mime, detail, stats
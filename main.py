@@ -1,19 +1,51 @@
 # main.py
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 # ルーターのインポート（修正版）
 from app.routers import (
     health, ui, fitbit, healthplanet, 
-    weight, meals, coaching, cron, debug
+    weight, meals, coaching, cron, debug, analytics
 )
+from app.external.http_client import open_http_clients, close_http_clients
+from app.database.firestore import shutdown_firestore_executor
+from app.database.outbox import outbox_worker
+from app.services.fitbit_webhook_service import fitbit_webhook_worker
+from app.database.schema import ensure_all_tables
+from app.utils.body_limit import BodySizeLimitMiddleware
+from app.config import settings
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時に共有リソース（HTTPクライアント・バックグラウンドワーカー）を準備し、終了時に後始末する"""
+    await open_http_clients()
+    if settings.BQ_SCHEMA_ENSURE_ON_STARTUP:
+        try:
+            await asyncio.to_thread(ensure_all_tables)
+        except Exception as e:
+            print(f"[WARN] BigQuery schema check failed: {e}")
+    outbox_worker.start()
+    fitbit_webhook_worker.start()
+    try:
+        yield
+    finally:
+        await fitbit_webhook_worker.stop()
+        await outbox_worker.stop()
+        await close_http_clients()
+        shutdown_firestore_executor()
 
 app = FastAPI(
     title="FitLine API",
     description="Fitness tracking and coaching application with multi-device support",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan,
 )
 
+# アップロード上限（スプール前に弾く）。CORS より内側に置き、413 にも CORS ヘッダを付ける
+app.add_middleware(BodySizeLimitMiddleware, limits={"/ui/meal_image": settings.MEAL_IMAGE_MAX_BYTES})
+
 # CORS設定
 app.add_middleware(
     CORSMiddleware,
@@ -32,6 +64,7 @@ app.include_router(weight.router)        # prefixは内部で設定済み
 app.include_router(meals.router, prefix="/meals")
 app.include_router(coaching.router, prefix="/coach")
 app.include_router(cron.router, prefix="/cron")
+app.include_router(analytics.router)     # prefixは内部で設定済み
 app.include_router(debug.router, prefix="/debug")
 
 @app.get("/")
@@ -39,6 +72,6 @@ def root():
     """ルートエンドポイント"""
     return {
         "message": "FitLine API v2.0",
-        "services": ["fitbit", "healthplanet", "meals", "coaching"],
+        "services": ["fitbit", "healthplanet", "meals", "coaching", "analytics"],
         "status": "healthy"
     }
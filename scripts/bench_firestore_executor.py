@@ -0,0 +1,55 @@
+"""
+Firestore 同期呼び出しのイベントループ阻害ベンチマーク（GCP不要）
+
+同期クライアントの .get() を time.sleep で模擬し、
+  - blocking: async ハンドラ内で直接呼ぶ（従来）
+  - executor: fs_run と同じ専用 executor 経由で呼ぶ
+の同時リクエスト処理スループットを比較する。
+
+    python scripts/bench_firestore_executor.py --requests 200 --latency-ms 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.utils.async_utils import run_in_executor  # noqa: E402
+
+def fake_firestore_get(latency: float) -> dict:
+    time.sleep(latency)
+    return {"access_token": "x"}
+
+async def handler_blocking(latency: float) -> dict:
+    return fake_firestore_get(latency)
+
+async def handler_executor(executor: ThreadPoolExecutor, latency: float) -> dict:
+    return await run_in_executor(executor, fake_firestore_get, latency)
+
+async def bench(mode: str, n: int, latency: float, workers: int) -> float:
+    executor = ThreadPoolExecutor(max_workers=workers)
+    t0 = time.perf_counter()
+    if mode == "blocking":
+        await asyncio.gather(*(handler_blocking(latency) for _ in range(n)))
+    else:
+        await asyncio.gather(*(handler_executor(executor, latency) for _ in range(n)))
+    elapsed = time.perf_counter() - t0
+    executor.shutdown()
+    return elapsed
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    ap.add_argument("--workers", type=int, default=32)
+    args = ap.parse_args()
+    latency = args.latency_ms / 1000.0
+
+    for mode in ("blocking", "executor"):
+        elapsed = asyncio.run(bench(mode, args.requests, latency, args.workers))
+        print(f"{mode:9s}: {args.requests} req in {elapsed:.2f}s -> {args.requests / elapsed:.1f} req/s")
+
+if __name__ == "__main__":
+    main()
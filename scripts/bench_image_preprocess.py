@@ -0,0 +1,71 @@
+"""
+食事画像の前処理ベンチマーク（OpenAI不要）
+
+スマホ写真相当の画像（既定 4032x3024 JPEG）を生成し、
+  - before: 元画像をそのまま base64 化（従来）
+  - after:  prepare_image_for_vision で縮小・再エンコードしてから base64 化
+の送信バイト数・メモリピーク（tracemalloc）・処理時間を比較する。
+実画像で測る場合は --file を指定する。Vision の応答時間は /ui/meal_image の
+レスポンス "image.vision_ms" で確認する。
+
+    python scripts/bench_image_preprocess.py --width 4032 --height 3024
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.utils.image_utils import Image, prepare_image_for_vision  # noqa: E402
+
+def make_photo(width: int, height: int) -> bytes:
+    import random
+    img = Image.new("RGB", (width, height))
+    # 単色だと圧縮が効きすぎるのでノイズ入りのタイルで埋める
+    tile = Image.frombytes("RGB", (256, 256), bytes(random.getrandbits(8) for _ in range(256 * 256 * 3)))
+    for x in range(0, width, 256):
+        for y in range(0, height, 256):
+            img.paste(tile, (x, y))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=92)
+    return out.getvalue()
+
+def measure(label: str, fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    payload = fn()
+    elapsed = (time.perf_counter() - t0) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>6}: sent={len(payload):>10,} B  peak={peak / 1e6:7.1f} MB  time={elapsed:7.1f} ms")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--file")
+    ap.add_argument("--width", type=int, default=4032)
+    ap.add_argument("--height", type=int, default=3024)
+    args = ap.parse_args()
+
+    if Image is None:
+        sys.exit("Pillow が必要です: pip install Pillow")
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            data = f.read()
+    else:
+        data = make_photo(args.width, args.height)
+    print(f"original: {len(data):,} B")
+
+    measure("before", lambda: base64.b64encode(data))
+
+    def after():
+        sent, _, detail, stats = prepare_image_for_vision(data, "image/jpeg")
+        print(f"         {stats}")
+        return base64.b64encode(sent)
+    measure("after", after)
+
+if __name__ == "__main__":
+    main()
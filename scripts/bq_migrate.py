@@ -0,0 +1,58 @@
+"""
+BigQuery テーブルレイアウトの確認・作成・移行（デプロイ時に実行）
+
+app/database/schema.py の宣言（月単位パーティション・user_id クラスタ・保持期間）と
+実テーブルを比較する。既定は差分表示のみ。
+  --apply           存在しないテーブルの作成・列追加・クラスタリング/保持期間の変更
+  --allow-recreate  パーティション変更のため CTAS で作り直し、旧テーブルを __backup_* に退避
+  --hp-wide         Health Planet の旧テーブル（タグ縦持ち）をワイド行テーブルへ取り込む（--apply 時）
+移行前後に代表クエリをドライランし、スキャンバイト数を Firestore system/bq_schema に記録する
+（/debug/bq_scan で確認できる）。
+
+    python scripts/bq_migrate.py --apply --allow-recreate --user-id demo
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.database.firestore import db  # noqa: E402
+from app.database.schema import apply_schema, scan_report  # noqa: E402
+from app.services.healthplanet_service import migrate_legacy_rows  # noqa: E402
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--apply", action="store_true")
+    ap.add_argument("--allow-recreate", action="store_true")
+    ap.add_argument("--hp-wide", action="store_true")
+    ap.add_argument("--user-id", default="demo")
+    args = ap.parse_args()
+
+    before = scan_report(args.user_id)
+    result = apply_schema(apply=args.apply, allow_recreate=args.allow_recreate)
+    if args.apply and args.hp_wide and result.get("ok"):
+        result["healthplanet_wide"] = migrate_legacy_rows()
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+
+    if args.apply:
+        after = scan_report(args.user_id)
+        db.collection("system").document("bq_schema").set({
+            "migrated_at": datetime.now(timezone.utc).isoformat(),
+            "user_id": args.user_id,
+            "scan_before": before,
+            "scan_after": after,
+            "tables": [{k: v for k, v in t.items() if k in ("table", "action", "applied", "backup", "error")}
+                       for t in result.get("tables", [])],
+            "healthplanet_wide": result.get("healthplanet_wide"),
+        })
+        if (result.get("healthplanet_wide") or {}).get("ok"):
+            print("Health Planet legacy rows migrated; set HP_LEGACY_READ=0 to stop reading the legacy table.")
+        for name, b in before.get("queries", {}).items():
+            a = after.get("queries", {}).get(name, {})
+            print(f"{name:>24}: {b.get('bytes')} -> {a.get('bytes')} bytes")
+    sys.exit(0 if result.get("ok") else 1)
+
+if __name__ == "__main__":
+    main()
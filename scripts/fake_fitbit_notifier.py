@@ -0,0 +1,47 @@
+"""
+Fitbit Subscription API のローカル疑似通知送信スクリプト
+
+FITBIT_CLIENT_SECRET を設定していればアプリと同じ方式で署名する。
+同じ通知を重複して送り、ワーカー側の重複排除も確認できる。
+
+    python scripts/fake_fitbit_notifier.py --url http://localhost:8080/fitbit/webhook \\
+        --user demo --collection activities --date 2025-01-01 --repeat 3
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import urllib.request
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://localhost:8080/fitbit/webhook")
+    ap.add_argument("--user", default="demo")
+    ap.add_argument("--collection", default="activities", choices=["activities", "sleep", "body", "foods"])
+    ap.add_argument("--date", required=True)
+    ap.add_argument("--repeat", type=int, default=1)
+    args = ap.parse_args()
+
+    notifications = [{
+        "collectionType": args.collection,
+        "date": args.date,
+        "ownerId": "FAKE00",
+        "ownerType": "user",
+        "subscriptionId": args.user,
+    }] * args.repeat
+    body = json.dumps(notifications).encode()
+
+    headers = {"Content-Type": "application/json"}
+    secret = os.getenv("FITBIT_CLIENT_SECRET")
+    if secret:
+        digest = hmac.new(f"{secret}&".encode(), body, hashlib.sha1).digest()
+        headers["X-Fitbit-Signature"] = base64.b64encode(digest).decode()
+
+    req = urllib.request.Request(args.url, data=body, headers=headers, method="POST")
+    with urllib.request.urlopen(req, timeout=10) as r:
+        print(f"POST {args.url} -> {r.status}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+OpenAI Files / Batches API のローカルスタブ（Batch モードの動作確認用）
+
+    uvicorn scripts.openai_batch_stub:app --port 9000
+    OPENAI_BASE_URL=http://localhost:9000/v1 OPENAI_API_KEY=dummy uvicorn main:app
+
+投入された Batch は最初の GET で in_progress、2回目以降で completed になり、
+各リクエストにプロンプト先頭を含む固定の応答を返す。
+"""
+import json
+import time
+import uuid
+from typing import Dict, Any
+from fastapi import FastAPI, File, Form, UploadFile
+from fastapi.responses import PlainTextResponse
+
+app = FastAPI(title="OpenAI batch stub")
+
+FILES: Dict[str, str] = {}
+BATCHES: Dict[str, Dict[str, Any]] = {}
+
+def _complete(batch: Dict[str, Any]) -> None:
+    out_lines = []
+    for line in FILES[batch["input_file_id"]].splitlines():
+        if not line.strip():
+            continue
+        req = json.loads(line)
+        prompt = req["body"]["messages"][0]["content"]
+        out_lines.append(json.dumps({
+            "id": f"resp_{uuid.uuid4().hex[:8]}",
+            "custom_id": req["custom_id"],
+            "response": {
+                "status_code": 200,
+                "body": {"choices": [{"message": {"role": "assistant",
+                                                  "content": f"(stub) {prompt.strip()[:40]}…"}}]},
+            },
+            "error": None,
+        }, ensure_ascii=False))
+    out_id = f"file-{uuid.uuid4().hex[:12]}"
+    FILES[out_id] = "\n".join(out_lines) + "\n"
+    batch.update({
+        "status": "completed",
+        "output_file_id": out_id,
+        "completed_at": int(time.time()),
+        "request_counts": {"total": len(out_lines), "completed": len(out_lines), "failed": 0},
+    })
+
+@app.post("/v1/files")
+async def upload_file(purpose: str = Form(...), file: UploadFile = File(...)):
+    file_id = f"file-{uuid.uuid4().hex[:12]}"
+    FILES[file_id] = (await file.read()).decode("utf-8")
+    return {"id": file_id, "object": "file", "purpose": purpose, "filename": file.filename}
+
+@app.post("/v1/batches")
+async def create_batch(body: Dict[str, Any]):
+    batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+    BATCHES[batch_id] = {"id": batch_id, "object": "batch", "status": "validating", "polls": 0, **body}
+    return BATCHES[batch_id]
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    batch = BATCHES[batch_id]
+    batch["polls"] += 1
+    if batch["polls"] == 1:
+        batch["status"] = "in_progress"
+    elif batch["status"] != "completed":
+        _complete(batch)
+    return batch
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    return PlainTextResponse(FILES[file_id])